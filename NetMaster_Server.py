@@ -5,35 +5,253 @@ Servidor para o jogo NetMaster que suporta múltiplas sessões de até 4 jogador
 Configurado para rodar na VM: netmaster.vps.tecnico.ulisboa.pt:8000
 """
 
+import argparse
 import asyncio
+import atexit
+import bisect
+import contextlib
+import heapq
+import itertools
 import json
+import os
+import secrets
+import signal
 import time
 import uuid
+import zlib
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set
+from typing import Callable, Dict, List, Optional, Set
 import websockets
 import logging
-from dataclasses import dataclass, asdict
+import logging.handlers
+import queue
+from dataclasses import dataclass, asdict, field
 from enum import Enum
+from http import HTTPStatus
+
+try:
+    import uvloop  # Opcional: event loop sobre libuv (--loop uvloop)
+except ImportError:
+    uvloop = None
+
+import netmaster_codec
+import netmaster_engine
+import netmaster_inbound
+import netmaster_matchmaking
+import netmaster_persistence
+import netmaster_recording
 
 # Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('netmaster_server.log'),
-        logging.StreamHandler()
-    ]
-)
+LOG_FILE = 'netmaster_server.log'
+LOG_FORMAT = "text"  # "text" ou "json" (JSON lines, uma entrada por linha)
+LOG_LEVELS = {  # Nível por subsistema (tag dos logs)
+    'SERVER_TIMER': 'INFO',
+    'BROADCAST': 'INFO',
+    'CARD_STORAGE': 'INFO',
+    'PLAYERS_INFO': 'INFO',
+    'DISPATCH': 'INFO'
+}
+LOG_RATE_LIMITS = {  # Máximo de entradas por segundo nos subsistemas de alta frequência
+    'BROADCAST': 20,
+    'DISPATCH': 20
+}
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formata cada entrada como um objeto JSON numa única linha"""
+    
+    def format(self, record):
+        entry = {
+            'ts': record.created,
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'subsystem': record.name.rsplit('.', 1)[-1],
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """Deixa passar no máximo max_per_second entradas por segundo; as restantes são contadas e resumidas"""
+    
+    def __init__(self, max_per_second: int):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.window_start = 0.0
+        self.window_count = 0
+        self.suppressed = 0
+    
+    def filter(self, record):
+        now = time.monotonic()
+        if now - self.window_start >= 1.0:
+            self.window_start = now
+            self.window_count = 0
+            if self.suppressed:
+                # Anotar na primeira entrada da nova janela quantas foram suprimidas
+                record.msg = f"{record.getMessage()} [+{self.suppressed} entradas suprimidas]"
+                record.args = None
+                self.suppressed = 0
+        
+        if record.levelno >= logging.WARNING:
+            return True  # Avisos e erros nunca são suprimidos
+        
+        self.window_count += 1
+        if self.window_count > self.max_per_second:
+            self.suppressed += 1
+            return False
+        return True
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def shutdown_logging():
+    """Escreve as entradas pendentes e termina a thread de logging"""
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+def setup_logging(log_format: str = LOG_FORMAT, levels: Dict[str, str] = LOG_LEVELS,
+                  rate_limits: Dict[str, int] = LOG_RATE_LIMITS, log_file: str = LOG_FILE,
+                  console: bool = True) -> logging.handlers.QueueListener:
+    """
+    Configura o pipeline de logging não bloqueante.
+    
+    O event loop apenas coloca as entradas numa fila (QueueHandler); a escrita no
+    ficheiro e na consola é feita por uma thread de background (QueueListener).
+    """
+    global _log_listener
+    shutdown_logging()
+    
+    if log_format == "json":
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    
+    handlers = [logging.FileHandler(log_file)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+    
+    for subsystem, level in levels.items():
+        subsystem_logger = logger.getChild(subsystem)
+        subsystem_logger.setLevel(level)
+        for existing_filter in list(subsystem_logger.filters):
+            subsystem_logger.removeFilter(existing_filter)
+        if subsystem in rate_limits:
+            subsystem_logger.addFilter(RateLimitFilter(rate_limits[subsystem]))
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _log_listener = listener
+    return listener
+
 logger = logging.getLogger(__name__)
+timer_logger = logger.getChild('SERVER_TIMER')
+broadcast_logger = logger.getChild('BROADCAST')
+card_logger = logger.getChild('CARD_STORAGE')
+players_logger = logger.getChild('PLAYERS_INFO')
+dispatch_logger = logger.getChild('DISPATCH')
+setup_logging()
+atexit.register(shutdown_logging)
 
 # Configurações do servidor
 SERVER_HOST = "0.0.0.0"  # Bind em todas as interfaces
 SERVER_PORT = 8000
+EVENT_LOOPS = ("asyncio", "uvloop")
+EVENT_LOOP = "asyncio"  # Também --loop; "uvloop" sem o pacote instalado usa o asyncio
 MAX_PLAYERS_PER_SESSION = 4
 SESSION_DURATION_MINUTES = 30
 WAITING_TIMEOUT_MINUTES = 1  # Tempo limite para outros jogadores se juntarem
-HEARTBEAT_INTERVAL = 30  # segundos
+KEEPALIVE_PING_INTERVAL = 20  # segundos entre pings WebSocket (liveness e RTT de cada ligação)
+KEEPALIVE_PING_TIMEOUT = 20  # segundos sem pong até a ligação ser fechada (o lugar fica reservado para a retoma)
+LEGACY_HEARTBEAT_ENABLED = True  # Aceitar o heartbeat JSON dos clientes antigos (só responde heartbeat_ack)
+TIMER_RESYNC_INTERVAL = 15  # segundos entre ressincronizações do timer (clientes contam localmente)
+RESUME_GRACE_SECONDS = 60  # Lugar reservado a um jogador cuja ligação caiu (0 = remover de imediato)
+REPLAY_BUFFER_SIZE = 256  # Mensagens numeradas guardadas por sessão para reenvio na retoma
+STORE_PAGE_LIMIT = 20  # Máximo de cartas devolvidas por store_inventory
+MAILBOX_MAX_ATTEMPTS = 5  # Envios de uma carta sem ack antes de a devolver à Store
+
+# Filas de saída por ligação
+OUTBOUND_QUEUE_SIZE = 256  # Mensagens pendentes por ligação antes de aplicar a política de overflow
+OUTBOUND_OVERFLOW_POLICY = "coalesce"  # "drop_oldest", "coalesce" ou "disconnect"
+OUTBOUND_SEND_TIMEOUT = 5.0  # segundos para um websocket.send() individual
+COALESCE_MESSAGE_TYPES = {'timer_sync', 'sessions_list_update', 'players_info_sync'}  # Só interessa a última
+LOBBY_LEGACY_FULL_LIST = True  # Clientes não subscritos ao lobby continuam a receber sessions_list_update
+BROADCAST_MODE = "queue"  # "queue" (filas por ligação) ou "native" (websockets.broadcast, sem fila nem ordenação)
+
+# Espectadores (watch_session): ligações só de leitura que recebem os broadcasts de uma sessão
+MAX_SPECTATORS_PER_SESSION = 200
+SPECTATOR_MIN_INTERVALS = {'timer_sync': 60.0, 'players_info_sync': 2.0}  # segundos entre envios aos espectadores (o último segue no fim)
+
+# Matchmaking (queue_for_match): a fila é agrupada por duração e cores livres e as sessões criadas em lote
+MATCHMAKING_TICK_INTERVAL = 1.0  # segundos entre agrupamentos da fila
+MATCHMAKING_MATCH_SIZE = MAX_PLAYERS_PER_SESSION  # Jogadores de um grupo completo
+MATCHMAKING_MIN_PLAYERS = 2  # Tamanho mínimo de um grupo incompleto
+MATCHMAKING_MAX_WAIT_SECONDS = 30  # Espera do mais antigo a partir da qual um grupo incompleto é aceite
+MATCHMAKING_WAIT_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)  # segundos na fila
+
+# permessage-deflate afinado (ver netmaster_codec) em vez da configuração por omissão do websockets
+WS_SERVE_OPTIONS = {'compression': None, 'extensions': netmaster_codec.server_deflate_extensions(),
+                    'ping_interval': KEEPALIVE_PING_INTERVAL, 'ping_timeout': KEEPALIVE_PING_TIMEOUT}
+
+# Métricas (formato de texto Prometheus, servidas na porta do WebSocket)
+METRICS_PATH = "/metrics"
+# HTTP simples na mesma porta (sem upgrade para WebSocket): load balancer e dashboards
+HEALTH_PATH = "/healthz"  # 200 a aceitar sessões, 503 durante o encerramento gracioso
+STATUS_PATH = "/status"  # Contadores do servidor (JSON)
+SESSIONS_PATH = "/sessions"  # Sessões do lobby (JSON, serializado uma vez por versão do lobby)
+LOOP_LAG_INTERVAL = 0.5  # segundos entre medições do atraso do event loop
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # segundos
+MAILBOX_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0)  # segundos (carta guardada -> ack)
+
+# Modo multi-processo (netmaster_shards.py)
+SHARD_BASE_PORT = SERVER_PORT + 1  # Porta dedicada do shard 0; o shard i usa SHARD_BASE_PORT + i
+SHARD_COORDINATOR_SOCKET = "/tmp/netmaster_coordinator.sock"  # Socket Unix do coordenador do lobby
+
+# Persistência das sessões (netmaster_persistence): WAL + snapshots, reconstruídos no arranque
+PERSISTENCE_ENABLED = True
+PERSISTENCE_DIR = "netmaster_state"  # No modo multi-processo cada shard usa o subdiretório shard-<i>
+RESTORE_GRACE_SECONDS = 120  # Tempo para os jogadores de uma sessão recuperada voltarem
+
+# Encerramento gracioso (SIGTERM): sem sessões novas, as existentes terminam até ao prazo e as
+# restantes passam ao processo seguinte por um ficheiro de handoff (os clientes retomam lá)
+DRAIN_TIMEOUT_SECONDS = 120  # Prazo para as sessões em curso terminarem
+DRAIN_POLL_INTERVAL = 0.5  # segundos entre verificações das sessões ainda ativas
+DRAIN_REFUSED_TYPES = {'create_session', 'join_session', 'queue_for_match'}  # Pedidos recusados durante o encerramento
+HANDOFF_ENABLED = True
+HANDOFF_FILE = "netmaster_handoff.json"  # No modo multi-processo cada shard usa shard-<i>-netmaster_handoff.json
+HANDOFF_FORMAT = 1
+SERVICE_RESTART_CLOSE_CODE = 1012  # Código de fecho WebSocket "service restart": o cliente religa e retoma
+
+# Gravação das sessões (netmaster_recording): mensagens recebidas e broadcasts para o netmaster_replay.py
+RECORDING_ENABLED = False  # Também ativável com --record
+RECORDING_DIR = "netmaster_recordings"  # Um ficheiro <session_id>-<início>.nmrec por sessão
+RECORDING_BIND_TYPES = {'create_session', 'join_session', 'resume_session'}  # Associam a ligação a um jogador
+
+# Mensagens recebidas (netmaster_inbound): limite por cliente e por tipo - (mensagens/segundo, rajada)
+RATE_LIMITS = {
+    'list_sessions': (1.0, 5),
+    'get_session_info': (2.0, 5),
+    'watch_session': (1.0, 5),
+    'lobby_resync': (0.5, 3),
+    'create_session': (0.2, 3),
+    'join_session': (1.0, 5),
+    'resume_session': (0.5, 3),
+    'queue_for_match': (0.5, 3),
+    'unknown': (1.0, 5),  # Tipos fora da tabela de dispatch (um só bucket para todos)
+    '*': (20.0, 40)  # Restantes tipos (jogo, heartbeat, cartas)
+}
 
 class GameState(Enum):
     WAITING = "waiting"
@@ -48,17 +266,19 @@ class PlayerColor(Enum):
     GREEN = "green"
     YELLOW = "yellow"
 
-@dataclass
+@dataclass(slots=True)
 class Player:
-    """Representa um jogador na sessão"""
+    """Representa um jogador na sessão (única entrada do jogador - não há tabelas paralelas)"""
     id: str
     name: str
-    color: PlayerColor
+    color: PlayerColor  # Membro do enum: referência partilhada, sem string por jogador
     websocket: Optional[object] = None
     connected: bool = True
     last_heartbeat: float = 0
     position: int = 0
     score: int = 1000  # Saldo inicial
+    resume_token: Optional[str] = None  # Segredo para retomar o lugar após quebra de ligação (só o próprio o recebe)
+    joined_at: float = 0
     
     def to_dict(self):
         """Converte para dict sem o websocket"""
@@ -72,7 +292,15 @@ class Player:
             'score': self.score
         }
 
-@dataclass 
+def mailbox_record(envelope: dict) -> dict:
+    """Envelope da caixa de correio como é persistido (sem o contador de tentativas)"""
+    return {'delivery_id': envelope['delivery_id'], 'card': dict(envelope['card']), 'stored_at': envelope['stored_at']}
+
+def delivery_card(envelope: dict) -> dict:
+    """Carta como é enviada ao cliente: dados da carta + delivery_id para o ack"""
+    return {**envelope['card'], 'delivery_id': envelope['delivery_id']}
+
+@dataclass(slots=True)
 class GameSession:
     """Representa uma sessão de jogo"""
     id: str
@@ -84,15 +312,38 @@ class GameSession:
     waiting_expires_at: datetime  # Tempo limite para fase de espera
     max_players: int = MAX_PLAYERS_PER_SESSION
     duration_minutes: int = SESSION_DURATION_MINUTES  # Duração personalizada da sessão
-    player_order: List[str] = None  # Ordem dos jogadores por entrada na sessão
+    player_order: List[str] = field(default_factory=list)  # Ordem de turnos = jogadores ativos (única fonte)
     current_turn_index: int = 0  # Índice do jogador atual no player_order
     empty_since: Optional[float] = None  # Timestamp quando ficou vazia (para remoção adiada)
-    pending_cards: Dict[str, List[Dict]] = None  # Cartas pendentes por cor do jogador
+    pending_cards: Dict[str, List[Dict]] = field(default_factory=dict)  # Caixa de correio por cor: envelopes por confirmar
+    mailbox_seq: int = 0  # Último delivery_id atribuído (nunca reutilizado, também após reinício)
+    seed: int = field(default_factory=lambda: secrets.randbits(32))  # Seed dos baralhos da sessão
+    engine: Optional[netmaster_engine.SessionEngine] = field(default=None, repr=False)  # Baralhos (criados no primeiro uso)
     timer_finished: bool = False  # Flag para indicar que o timer já processou esta sessão
+    send_hook: Optional[Callable] = None  # Enfileira mensagem para um websocket (definido pelo servidor)
+    replay: 'ReplayBuffer' = field(default_factory=lambda: ReplayBuffer(), repr=False)  # Mensagens numeradas para a retoma
+    version: int = field(default=0, compare=False)  # Incrementada por cada mutação (ver touch)
+    views: Optional[Dict[str, dict]] = field(default=None, repr=False, compare=False)  # Vistas serializadas desta versão
     
-    # *** NOVO SISTEMA DE BROADCAST DE JOGADORES ***
-    players_info: Dict[str, Dict] = None  # {player_id: {'color': 'red', 'name': 'J', 'websocket': ws}}
-    active_players: List[str] = None  # Lista ordenada dos player_ids ativos
+    def decks(self) -> netmaster_engine.SessionEngine:
+        """Baralhos e Store da sessão"""
+        if self.engine is None:
+            self.engine = netmaster_engine.SessionEngine(self.seed)
+        return self.engine
+    
+    def touch(self):
+        """Marca a sessão como alterada: nova versão, vistas em cache descartadas"""
+        self.version += 1
+        self.views = None
+    
+    def cached_view(self, kind: str, build: Callable[[], dict]) -> dict:
+        """Vista serializada da versão atual (construída no máximo uma vez por versão; não alterar)"""
+        if self.views is None:
+            self.views = {}
+        view = self.views.get(kind)
+        if view is None:
+            view = self.views[kind] = build()
+        return view
     
     def is_expired(self) -> bool:
         """Verifica se a sessão expirou"""
@@ -132,14 +383,14 @@ class GameSession:
             return None
         
         self.current_turn_index = (self.current_turn_index + 1) % len(self.player_order)
+        self.touch()
         return self.get_current_player_id()
     
     def add_player_to_order(self, player_id: str):
         """Adiciona jogador à ordem de turnos"""
-        if self.player_order is None:
-            self.player_order = []
         if player_id not in self.player_order:
             self.player_order.append(player_id)
+            self.touch()
     
     def remove_player_from_order(self, player_id: str):
         """Remove jogador da ordem de turnos"""
@@ -152,139 +403,150 @@ class GameSession:
                 self.current_turn_index = 0
             elif old_index < self.current_turn_index:
                 self.current_turn_index -= 1
+            self.touch()
     
-    def store_card_for_player(self, target_player_color: str, card_data: Dict):
-        """Armazena carta pendente para um jogador"""
-        if self.pending_cards is None:
-            self.pending_cards = {}
-        
-        if target_player_color not in self.pending_cards:
-            self.pending_cards[target_player_color] = []
-        
-        self.pending_cards[target_player_color].append(card_data)
-        logger.info(f"[CARD_STORAGE] Carta armazenada para jogador {target_player_color}: {card_data.get('card_path', 'Unknown')}")
-        logger.info(f"[CARD_STORAGE] Total cartas pendentes para {target_player_color}: {len(self.pending_cards[target_player_color])}")
+    def store_card_for_player(self, target_player_color: str, card_data: Dict) -> Dict:
+        """Guarda a carta na caixa de correio do jogador e retorna o envelope (delivery_id + carta)"""
+        self.mailbox_seq += 1
+        envelope = {'delivery_id': self.mailbox_seq, 'card': card_data, 'stored_at': time.time(), 'attempts': 0}
+        self.pending_cards.setdefault(target_player_color, []).append(envelope)
+        card_logger.info(f"[CARD_STORAGE] Carta {self.mailbox_seq} armazenada para jogador {target_player_color}: {card_data.get('card_path', 'Unknown')}")
+        card_logger.info(f"[CARD_STORAGE] Total cartas pendentes para {target_player_color}: {len(self.pending_cards[target_player_color])}")
+        return envelope
     
     def get_pending_cards(self, player_color: str) -> List[Dict]:
-        """Obtém e remove cartas pendentes para um jogador"""
-        if self.pending_cards is None or player_color not in self.pending_cards:
+        """Envelopes por confirmar de um jogador (continuam na caixa até ao ack)"""
+        return list(self.pending_cards.get(player_color, ()))
+    
+    def ack_pending_cards(self, player_color: str, delivery_ids: Set[int]) -> List[Dict]:
+        """Remove e retorna os envelopes confirmados pelo cliente"""
+        envelopes = self.pending_cards.get(player_color)
+        if not envelopes:
             return []
-        
-        cards = self.pending_cards[player_color].copy()
-        self.pending_cards[player_color].clear()
-        
-        logger.info(f"[CARD_DELIVERY] Entregando {len(cards)} cartas pendentes para jogador {player_color}")
-        for card in cards:
-            logger.info(f"[CARD_DELIVERY] - {card.get('card_path', 'Unknown')} de {card.get('from_player', 'Unknown')}")
-        
-        return cards
+        acked = [envelope for envelope in envelopes if envelope['delivery_id'] in delivery_ids]
+        if acked:
+            remaining = [envelope for envelope in envelopes if envelope['delivery_id'] not in delivery_ids]
+            if remaining:
+                self.pending_cards[player_color] = remaining
+            else:
+                del self.pending_cards[player_color]
+        return acked
+    
+    def take_pending_cards(self, player_color: str) -> List[Dict]:
+        """Retira todos os envelopes de um jogador (para devolver à Store)"""
+        return self.pending_cards.pop(player_color, [])
     
     def get_pending_cards_count(self, player_color: str) -> int:
         """Obtém número de cartas pendentes para um jogador"""
-        if self.pending_cards is None or player_color not in self.pending_cards:
-            return 0
-        return len(self.pending_cards[player_color])
+        return len(self.pending_cards.get(player_color, ()))
     
     # *** NOVO SISTEMA DE BROADCAST DE JOGADORES ***
     
-    def add_player_info(self, player_id: str, color: str, name: str, websocket):
-        """Adiciona informações completas do jogador ao sistema de broadcast"""
-        if self.players_info is None:
-            self.players_info = {}
-        if self.active_players is None:
-            self.active_players = []
-            
-        self.players_info[player_id] = {
-            'color': color,
-            'name': name,
-            'websocket': websocket,
-            'joined_at': time.time()
-        }
-        
-        if player_id not in self.active_players:
-            self.active_players.append(player_id)
+    def add_player(self, player: Player, broadcast: bool = True):
+        """Adiciona jogador à tabela da sessão e à ordem de turnos e avisa todos os jogadores"""
+        player.joined_at = time.time()
+        self.players[player.id] = player
+        self.add_player_to_order(player.id)
+        self.touch()
         
-        logger.info(f"[PLAYERS_INFO] *** JOGADOR ADICIONADO AO BROADCAST SYSTEM ***")
-        logger.info(f"[PLAYERS_INFO] Jogador: {name} ({color}) - ID: {player_id}")
-        logger.info(f"[PLAYERS_INFO] Total jogadores ativos: {len(self.active_players)}")
-        logger.info(f"[PLAYERS_INFO] Lista ativa: {[self.players_info[pid]['name'] + '(' + self.players_info[pid]['color'] + ')' for pid in self.active_players]}")
+        players_logger.info(f"[PLAYERS_INFO] *** JOGADOR ADICIONADO AO BROADCAST SYSTEM ***")
+        players_logger.info(f"[PLAYERS_INFO] Jogador: {player.name} ({player.color.value}) - ID: {player.id}")
+        players_logger.info(f"[PLAYERS_INFO] Total jogadores ativos: {len(self.player_order)}")
+        players_logger.info(f"[PLAYERS_INFO] Lista ativa: {self.get_players_summary()}")
         
-        # *** BROADCAST AUTOMÁTICO QUANDO JOGADOR SE JUNTA ***
-        self.broadcast_players_info()
+        # *** BROADCAST AUTOMÁTICO QUANDO JOGADOR SE JUNTA *** (grupos do matchmaking: um só no fim)
+        if broadcast:
+            self.broadcast_players_info()
     
-    def remove_player_info(self, player_id: str):
-        """Remove jogador do sistema de broadcast"""
-        if self.players_info and player_id in self.players_info:
-            player_info = self.players_info[player_id]
-            logger.info(f"[PLAYERS_INFO] *** JOGADOR REMOVIDO DO BROADCAST SYSTEM ***")
-            logger.info(f"[PLAYERS_INFO] Jogador: {player_info['name']} ({player_info['color']}) - ID: {player_id}")
-            
-            del self.players_info[player_id]
-            
-        if self.active_players and player_id in self.active_players:
-            self.active_players.remove(player_id)
-            
-        logger.info(f"[PLAYERS_INFO] Total jogadores ativos restantes: {len(self.active_players) if self.active_players else 0}")
+    def remove_player(self, player_id: str) -> Optional[Player]:
+        """Remove jogador da tabela e da ordem de turnos e avisa os restantes"""
+        player = self.players.pop(player_id, None)
+        self.remove_player_from_order(player_id)
+        self.touch()
+        if player:
+            players_logger.info(f"[PLAYERS_INFO] *** JOGADOR REMOVIDO DO BROADCAST SYSTEM ***")
+            players_logger.info(f"[PLAYERS_INFO] Jogador: {player.name} ({player.color.value}) - ID: {player_id}")
+        players_logger.info(f"[PLAYERS_INFO] Total jogadores ativos restantes: {len(self.player_order)}")
         
         # *** BROADCAST AUTOMÁTICO QUANDO JOGADOR SAI ***
-        if self.active_players:  # Só faz broadcast se ainda há jogadores
+        if self.player_order:  # Só faz broadcast se ainda há jogadores
             self.broadcast_players_info()
+        return player
     
     def broadcast_players_info(self):
         """Envia lista de jogadores para TODOS na sessão"""
-        if not self.players_info or not self.active_players:
-            logger.info(f"[PLAYERS_BROADCAST] Sem jogadores para broadcast")
+        if not self.player_order:
+            players_logger.info(f"[PLAYERS_BROADCAST] Sem jogadores para broadcast")
             return
-            
-        players_data = {}
         
-        for player_id, info in self.players_info.items():
-            players_data[player_id] = {
-                'color': info['color'],
-                'name': info['name'],
-                'is_active': player_id in self.active_players
-            }
+        players_data = self.players_info_view()
         
         message = {
             'type': 'players_info_sync',
             'players': players_data,
-            'total_players': len(self.active_players),
+            'total_players': len(self.player_order),
             'session_id': self.id,
             'source': 'server'
         }
         
-        logger.info(f"[PLAYERS_BROADCAST] *** ENVIANDO BROADCAST PARA {len(self.active_players)} JOGADORES ***")
-        logger.info(f"[PLAYERS_BROADCAST] Dados enviados: {players_data}")
+        players_logger.info(f"[PLAYERS_BROADCAST] *** ENVIANDO BROADCAST PARA {len(self.player_order)} JOGADORES ***")
+        players_logger.info(f"[PLAYERS_BROADCAST] Dados enviados: {players_data}")
+        
+        # Serializar uma vez para todos os destinatários (numerada no buffer de replay)
+        frame = self.replay.record(message)
         
-        # Enviar para TODOS os jogadores ativos
-        for player_id in self.active_players:
+        # Enviar para TODOS os jogadores ativos (ligados)
+        for player_id in self.player_order:
+            player = self.players[player_id]
+            if player.websocket is None:
+                continue
             try:
-                if player_id in self.players_info:
-                    player_ws = self.players_info[player_id]['websocket']
-                    asyncio.create_task(player_ws.send(json.dumps(message)))
-                    logger.info(f"[PLAYERS_BROADCAST] Broadcast enviado para {self.players_info[player_id]['name']} ({self.players_info[player_id]['color']})")
+                if self.send_hook:
+                    self.send_hook(player.websocket, frame)
+                else:
+                    asyncio.create_task(player.websocket.send(frame.data))
+                players_logger.info(f"[PLAYERS_BROADCAST] Broadcast enviado para {player.name} ({player.color.value})")
             except Exception as e:
-                logger.error(f"[PLAYERS_BROADCAST] ❌ Erro enviando para {player_id}: {e}")
+                players_logger.error(f"[PLAYERS_BROADCAST] ❌ Erro enviando para {player_id}: {e}")
     
     def get_players_summary(self) -> str:
         """Retorna resumo dos jogadores para logs"""
-        if not self.players_info or not self.active_players:
+        if not self.player_order:
             return "Nenhum jogador ativo"
-            
-        summary = []
-        for player_id in self.active_players:
-            if player_id in self.players_info:
-                info = self.players_info[player_id]
-                summary.append(f"{info['name']}({info['color']})")
-                
-        return ", ".join(summary)
+        return ", ".join(f"{self.players[pid].name}({self.players[pid].color.value})" for pid in self.player_order)
+    
+    def waiting_time_left(self, now: Optional[datetime] = None) -> int:
+        """Segundos de espera restantes (0 fora do estado WAITING) - calculado no momento do envio"""
+        if self.state != GameState.WAITING:
+            return 0
+        return max(0, int((self.waiting_expires_at - (now or datetime.now())).total_seconds()))
+    
+    def players_view(self) -> dict:
+        """Jogadores serializados (player_id -> Player.to_dict()), em cache por versão"""
+        return self.cached_view('players', lambda: {pid: player.to_dict() for pid, player in self.players.items()})
+    
+    def players_info_view(self) -> dict:
+        """Jogadores ativos no formato do players_info_sync, em cache por versão"""
+        return self.cached_view('players_info', lambda: {
+            player_id: {'color': self.players[player_id].color.value, 'name': self.players[player_id].name,
+                        'is_active': True}
+            for player_id in self.player_order
+        })
+    
+    def lobby_view(self) -> dict:
+        """Sessão serializada sem campos dependentes do tempo atual, em cache por versão (entrada do lobby)"""
+        return self.cached_view('lobby', self.build_lobby_view)
     
     def to_dict(self):
-        """Converte para dict serializável"""
+        """Converte para dict serializável (vista em cache + waiting_time_left calculado agora)"""
+        return {**self.lobby_view(), 'waiting_time_left': self.waiting_time_left()}
+    
+    def build_lobby_view(self) -> dict:
+        """Constrói a vista sem waiting_time_left (chamado uma vez por versão)"""
         return {
             'id': self.id,
             'host_player_id': self.host_player_id,
-            'players': {pid: player.to_dict() for pid, player in self.players.items()},
+            'players': self.players_view(),
             'state': self.state.value,
             'created_at': self.created_at.isoformat(),
             'expires_at': self.expires_at.isoformat(),
@@ -294,51 +556,1067 @@ class GameSession:
             'current_players': len(self.players),
             'is_full': self.is_full(),
             'available_colors': [color.value for color in self.get_available_colors()],
-            'waiting_time_left': max(0, int((self.waiting_expires_at - datetime.now()).total_seconds())) if self.state == GameState.WAITING else 0,
-            'player_order': self.player_order or [],
+            'player_order': list(self.player_order),
             'current_turn_index': self.current_turn_index,
             'current_player_id': self.get_current_player_id()
         }
+    
+    def to_record(self, timer: Optional[dict] = None) -> dict:
+        """Estado completo para o WAL/snapshot (sem websockets nem campos derivados)"""
+        return {
+            'id': self.id,
+            'host_player_id': self.host_player_id,
+            'players': {pid: {'id': player.id, 'name': player.name, 'color': player.color.value,
+                              'position': player.position, 'score': player.score, 'resume_token': player.resume_token,
+                              'joined_at': player.joined_at}
+                        for pid, player in self.players.items()},
+            'state': self.state.value,
+            'created_at': self.created_at.isoformat(),
+            'expires_at': self.expires_at.isoformat(),
+            'waiting_expires_at': self.waiting_expires_at.isoformat(),
+            'max_players': self.max_players,
+            'duration_minutes': self.duration_minutes,
+            'player_order': list(self.player_order),
+            'current_turn_index': self.current_turn_index,
+            'pending_cards': {color: [mailbox_record(envelope) for envelope in envelopes]
+                              for color, envelopes in self.pending_cards.items()},
+            'mailbox_seq': self.mailbox_seq,
+            'timer_finished': self.timer_finished,
+            'seed': self.seed,
+            'deck_ops': self.engine.to_record() if self.engine else [],
+            # Só o prazo absoluto - o relógio monotónico não sobrevive a um reinício
+            'timer': {key: timer[key] for key in ('start_time', 'duration_seconds', 'deadline')} if timer else None
+        }
+    
+    @classmethod
+    def from_record(cls, record: dict, send_hook: Optional[Callable] = None) -> 'GameSession':
+        """Reconstrói uma sessão persistida (jogadores sem websocket e desligados)"""
+        players = {pid: Player(id=data['id'], name=data['name'], color=PlayerColor(data['color']),
+                               websocket=None, connected=False, position=data['position'], score=data['score'],
+                               resume_token=data.get('resume_token'), joined_at=data.get('joined_at', 0))
+                   for pid, data in record['players'].items()}
+        # Registos antigos guardavam a carta sem envelope: atribuir delivery_ids a seguir ao último conhecido
+        mailbox_seq = record.get('mailbox_seq', 0)
+        pending_cards = {}
+        for color, entries in record.get('pending_cards', {}).items():
+            envelopes = []
+            for entry in entries:
+                if 'delivery_id' not in entry:
+                    mailbox_seq += 1
+                    entry = {'delivery_id': mailbox_seq, 'card': entry, 'stored_at': time.time()}
+                envelopes.append({**entry, 'card': dict(entry['card']), 'attempts': 0})
+            if envelopes:
+                pending_cards[color] = envelopes
+        # Registos antigos: cartas devolvidas à Store ('actions'/'events') voltam ao baralho neutral do tipo
+        seed = record.get('seed', 0)
+        deck_ops = list(record.get('deck_ops', []))
+        for deck, cards in record.get('store_decks', {}).items():
+            deck_ops += [('r', netmaster_engine.deck_key(netmaster_engine.NEUTRAL, deck), card_path) for card_path in cards]
+        return cls(
+            id=record['id'],
+            host_player_id=record['host_player_id'],
+            players=players,
+            state=GameState(record['state']),
+            created_at=datetime.fromisoformat(record['created_at']),
+            expires_at=datetime.fromisoformat(record['expires_at']),
+            waiting_expires_at=datetime.fromisoformat(record['waiting_expires_at']),
+            max_players=record['max_players'],
+            duration_minutes=record['duration_minutes'],
+            player_order=list(record['player_order']),
+            current_turn_index=record['current_turn_index'],
+            pending_cards=pending_cards,
+            mailbox_seq=mailbox_seq,
+            timer_finished=record['timer_finished'],
+            seed=seed,
+            engine=netmaster_engine.SessionEngine(seed, log=deck_ops) if deck_ops else None,
+            send_hook=send_hook
+        )
+
+@dataclass
+class ShardConfig:
+    """Identidade de um processo worker no modo multi-processo"""
+    index: int
+    count: int
+    base_port: int = SHARD_BASE_PORT
+    
+    @staticmethod
+    def owner_of(session_id: str, count: int) -> int:
+        """Shard dono da sessão (crc32 é estável entre processos, ao contrário de hash())"""
+        return zlib.crc32(session_id.encode()) % count
+    
+    def owns(self, session_id: str) -> bool:
+        """Verifica se a sessão pertence a este shard"""
+        return self.owner_of(session_id, self.count) == self.index
+    
+    def port_of(self, index: int) -> int:
+        """Porta dedicada de um shard (usada nos redirecionamentos)"""
+        return self.base_port + index
+    
+    @property
+    def port(self) -> int:
+        return self.port_of(self.index)
+
+class DeadlineScheduler:
+    """
+    Agenda central de prazos (min-heap) servida por um único loop de ticks.
+    
+    Cada prazo é identificado por uma chave (ex: ('timer_expire', session_id)).
+    Reagendar uma chave invalida a entrada anterior de forma preguiçosa: as
+    entradas obsoletas ficam no heap e são descartadas quando chegam ao topo.
+    Os tempos são medidos em relógio monotónico (time.monotonic()).
+    """
+    
+    def __init__(self):
+        self._heap: List[tuple] = []  # (when, seq, key)
+        self._entries: Dict[tuple, tuple] = {}  # key -> (when, seq, callback)
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: Set[asyncio.Task] = set()  # Referências fortes das tarefas dos prazos (o loop só guarda fracas)
+        self.running = False
+    
+    @staticmethod
+    def now() -> float:
+        """Relógio monotónico usado por todos os prazos"""
+        return time.monotonic()
+    
+    def schedule(self, key: tuple, when: float, callback):
+        """Agenda (ou reagenda) callback para o instante monotónico when"""
+        seq = next(self._seq)
+        self._entries[key] = (when, seq, callback)
+        heapq.heappush(self._heap, (when, seq, key))
+        
+        # Compactar o heap se acumular demasiadas entradas obsoletas
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [(w, s, k) for k, (w, s, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+        
+        # Acordar o loop se este passou a ser o prazo mais próximo
+        if self._wakeup is not None and self._heap[0][1] == seq:
+            self._wakeup.set()
+    
+    def schedule_in(self, key: tuple, delay: float, callback):
+        """Agenda callback para daqui a delay segundos"""
+        self.schedule(key, self.now() + delay, callback)
+    
+    def cancel(self, key: tuple):
+        """Cancela o prazo associado à chave (se existir)"""
+        self._entries.pop(key, None)
+    
+    def deadline(self, key: tuple) -> Optional[float]:
+        """Retorna o instante monotónico agendado para a chave"""
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _fire(self, key: tuple, callback):
+        """Executa callback; corrotinas correm em tarefas próprias para não bloquear o loop"""
+        try:
+            result = callback()
+            if asyncio.iscoroutine(result):
+                task = asyncio.create_task(result)
+                self._tasks.add(task)
+                task.add_done_callback(lambda task: self._task_done(key, task))
+        except Exception as e:
+            timer_logger.error(f"[SCHEDULER] Erro ao executar prazo {key}: {e}")
+    
+    def _task_done(self, key: tuple, task: asyncio.Task):
+        """Liberta a tarefa de um prazo e regista a exceção, se a houver"""
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            timer_logger.error(f"[SCHEDULER] Erro na tarefa do prazo {key}: {task.exception()}")
+    
+    async def run(self):
+        """Loop único que dispara todos os prazos vencidos"""
+        self._wakeup = asyncio.Event()
+        self.running = True
+        
+        while self.running:
+            now = self.now()
+            while self._heap and self._heap[0][0] <= now:
+                when, seq, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is None or entry[1] != seq:
+                    continue  # Entrada cancelada ou reagendada
+                del self._entries[key]
+                self._fire(key, entry[2])
+            
+            timeout = (self._heap[0][0] - self.now()) if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    def stop(self):
+        """Pára o loop de ticks"""
+        self.running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+@dataclass(frozen=True)
+class EncodedFrame:
+    """Mensagem serializada uma única vez e partilhada (imutável) por todos os destinatários"""
+    type: str
+    data: str
+    message: Optional[dict] = field(default=None, compare=False, repr=False)
+    variants: dict = field(default_factory=dict, compare=False, repr=False)  # codec -> payload
+    
+    @classmethod
+    def encode(cls, message: dict) -> 'EncodedFrame':
+        """Serializa a mensagem para JSON (levanta TypeError se não for serializável)"""
+        return cls(type=message.get('type', 'UNKNOWN'), data=json.dumps(message), message=message)
+    
+    def for_codec(self, codec: str):
+        """Payload no codec negociado pela ligação (codificado no máximo uma vez por codec)"""
+        if codec == netmaster_codec.CODEC_JSON or self.message is None:
+            return self.data
+        payload = self.variants.get(codec)
+        if payload is None:
+            payload = self.variants[codec] = netmaster_codec.encode(self.message, codec)
+        return payload
+
+class ReplayBuffer:
+    """
+    Últimas mensagens de uma sessão, numeradas por 'seq'.
+    
+    Um jogador que retoma a ligação indica o último seq recebido e recebe só as
+    mensagens seguintes. Quando o buffer já não as cobre é preciso enviar o estado completo.
+    O anel cresce até 'size' entradas, por isso sessões paradas ocupam pouca memória.
+    Guarda-se só o JSON de cada frame (a retoma é rara; todos os clientes descodificam JSON).
+    """
+    
+    __slots__ = ('size', 'entries', 'seq', 'recording', 'spectators')
+    
+    def __init__(self, size: int = REPLAY_BUFFER_SIZE):
+        self.size = size
+        self.entries: list = []  # Anel de (seq, tipo, JSON, jogador excluído); entrada do seq n em (n - 1) % size
+        self.seq = 0
+        self.recording: Optional[netmaster_recording.SessionRecording] = None  # Gravação da sessão (--record)
+        self.spectators: Optional['SpectatorGroup'] = None  # Espectadores da sessão (watch_session)
+    
+    def record(self, message: dict, exclude_player: str = None) -> EncodedFrame:
+        """Numera a mensagem, serializa-a e guarda o frame"""
+        self.seq += 1
+        frame = EncodedFrame.encode(dict(message, seq=self.seq))
+        entry = (self.seq, frame.type, frame.data, exclude_player)
+        if len(self.entries) < self.size:
+            self.entries.append(entry)
+        else:
+            self.entries[(self.seq - 1) % self.size] = entry
+        if self.recording is not None:
+            self.recording.broadcast(frame.data)
+        if self.spectators is not None:
+            self.spectators.send_frame(frame)
+        return frame
+    
+    def since(self, last_seq: int, player_id: str) -> Optional[List[EncodedFrame]]:
+        """Frames posteriores a last_seq destinados ao jogador (None se já saíram do buffer)"""
+        if last_seq > self.seq:
+            return None  # seq de outra instância do servidor (reinício)
+        oldest = self.seq - len(self.entries) + 1
+        if last_seq < self.seq and oldest > last_seq + 1:
+            return None
+        frames = []
+        for seq in range(last_seq + 1, self.seq + 1):
+            entry = self.entries[(seq - 1) % self.size]
+            if entry is None or entry[0] != seq:
+                return None  # Lacuna no anel restaurado: a retoma envia o estado completo
+            _, message_type, data, excluded = entry
+            if excluded != player_id:
+                frames.append(EncodedFrame(type=message_type, data=data))
+        return frames
+
+    def to_record(self) -> dict:
+        """Numeração e entradas do anel por ordem de seq (handoff para o processo seguinte)"""
+        oldest = self.seq - len(self.entries) + 1
+        entries = (self.entries[(seq - 1) % self.size] for seq in range(oldest, self.seq + 1))
+        return {'seq': self.seq, 'entries': [entry for entry in entries if entry is not None]}
+
+    def restore(self, record: dict):
+        """Continua a numeração de outro processo - quem retoma recebe só as mensagens em falta"""
+        self.seq = record['seq']
+        entries = [tuple(entry) for entry in record['entries']][-self.size:]
+        if len(entries) == self.seq:
+            self.entries = entries  # Anel ainda a crescer (seq 1..n nas posições 0..n-1)
+            return
+        # Anel completo, cada entrada na posição do seu seq; posições sem entrada (buffer de outro
+        # tamanho no processo anterior) ficam None e since() pede o estado completo
+        self.entries = [None] * self.size
+        for entry in entries:
+            self.entries[(entry[0] - 1) % self.size] = entry
+
+class SpectatorGroup:
+    """
+    Espectadores de uma sessão: recebem os mesmos EncodedFrame que os jogadores.
+    
+    O frame é serializado uma vez por codec (cache do EncodedFrame), por isso cada
+    espectador custa só um enqueue. Os tipos de SPECTATOR_MIN_INTERVALS seguem no
+    máximo uma vez por intervalo; o último frame suprimido é enviado no fim do intervalo.
+    """
+    
+    __slots__ = ('session_id', 'members', 'send', 'scheduler', 'sent_at', 'pending')
+    
+    def __init__(self, session_id: str, send: Callable, scheduler: DeadlineScheduler):
+        self.session_id = session_id
+        self.members: Dict[str, object] = {}  # client_id -> websocket
+        self.send = send  # Enfileira um frame para um websocket (enqueue_message)
+        self.scheduler = scheduler
+        self.sent_at: Dict[str, float] = {}  # tipo -> último envio (relógio monotónico)
+        self.pending: Dict[str, EncodedFrame] = {}  # tipo -> último frame suprimido
+    
+    def __len__(self):
+        return len(self.members)
+    
+    def send_frame(self, frame: EncodedFrame):
+        """Entrega o frame a todos os espectadores (tipos frequentes a ritmo reduzido)"""
+        if not self.members:
+            return
+        interval = SPECTATOR_MIN_INTERVALS.get(frame.type)
+        if interval:
+            now = self.scheduler.now()
+            last = self.sent_at.get(frame.type)
+            if last is not None and now - last < interval:
+                if frame.type not in self.pending:
+                    self.scheduler.schedule(('spectator_flush', self.session_id, frame.type), last + interval,
+                                            lambda message_type=frame.type: self.flush(message_type))
+                self.pending[frame.type] = frame
+                return
+            self.sent_at[frame.type] = now
+        for websocket in self.members.values():
+            self.send(websocket, frame)
+    
+    def flush(self, message_type: str):
+        """Fim do intervalo: envia o último frame suprimido"""
+        frame = self.pending.pop(message_type, None)
+        if frame is not None:
+            self.sent_at.pop(message_type, None)
+            self.send_frame(frame)
+    
+    def close(self):
+        """Cancela os envios adiados (sessão removida)"""
+        for message_type in self.pending:
+            self.scheduler.cancel(('spectator_flush', self.session_id, message_type))
+        self.pending.clear()
+        self.members.clear()
+
+class Histogram:
+    """Histograma com buckets fixos (contagens cumulativas na exportação, como no Prometheus)"""
+    
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+    
+    def render(self, name: str, labels: str = '') -> List[str]:
+        """Linhas _bucket/_sum/_count no formato de texto Prometheus"""
+        prefix = f"{labels}," if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ''
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+def metric_label(name: str, value) -> str:
+    """Label Prometheus com o valor escapado"""
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{name}="{escaped}"'
+
+class ServerMetrics:
+    """
+    Métricas de execução do servidor, exportadas em texto Prometheus.
+    
+    Contadores e histogramas são atualizados nos caminhos críticos (dispatch,
+    filas de saída, fan-out); os gauges (sessões, clientes, cartas pendentes)
+    são calculados a partir do estado do servidor no momento da leitura.
+    """
+    
+    def __init__(self):
+        self.handler_latency: Dict[str, Histogram] = {}  # tipo de mensagem -> latência do handler
+        self.messages_received: Dict[str, int] = {}  # tipo de mensagem -> mensagens recebidas
+        self.messages_rejected: Dict[tuple, int] = {}  # (tipo, motivo) -> mensagens rejeitadas antes do handler
+        self.messages_throttled: Dict[str, int] = {}  # tipo de mensagem -> mensagens acima do limite de débito
+        self.card_delivery_latency = Histogram(MAILBOX_LATENCY_BUCKETS)  # carta guardada -> ack do destinatário
+        self.card_deliveries: Dict[str, int] = {}  # 'pushed' / 'acked' / 'returned_to_store' -> cartas
+        self.match_wait = Histogram(MATCHMAKING_WAIT_BUCKETS)  # queue_for_match -> sessão criada
+        self.match_tickets: Dict[str, int] = {'matched': 0, 'cancelled': 0}  # Saídas da fila de matchmaking
+        self.outbound_messages: Dict[str, int] = {}  # tipo de mensagem -> mensagens enviadas
+        self.outbound_bytes: Dict[str, int] = {}  # tipo de mensagem -> bytes enviados
+        self.fanout_duration: Dict[str, Histogram] = {}  # 'session' / 'lobby' -> duração do fan-out
+        self.loop_lag = Histogram()
+        self.loop_lag_last = 0.0
+    
+    def observe_handler(self, message_type: str, seconds: float):
+        histogram = self.handler_latency.get(message_type)
+        if histogram is None:
+            histogram = self.handler_latency[message_type] = Histogram()
+        histogram.observe(seconds)
+        self.messages_received[message_type] = self.messages_received.get(message_type, 0) + 1
+    
+    def count_rejected(self, message_type: str, reason: str):
+        key = (message_type, reason)
+        self.messages_rejected[key] = self.messages_rejected.get(key, 0) + 1
+    
+    def count_throttled(self, message_type: str):
+        self.messages_throttled[message_type] = self.messages_throttled.get(message_type, 0) + 1
+    
+    def count_card_deliveries(self, outcome: str, cards: int = 1):
+        self.card_deliveries[outcome] = self.card_deliveries.get(outcome, 0) + cards
+    
+    def count_match(self, outcome: str, wait_seconds: Optional[float] = None):
+        self.match_tickets[outcome] = self.match_tickets.get(outcome, 0) + 1
+        if wait_seconds is not None:
+            self.match_wait.observe(wait_seconds)
+    
+    def match_rate(self) -> Optional[float]:
+        """Fração dos jogadores que saíram da fila com sessão (None se ainda nenhum saiu)"""
+        total = self.match_tickets['matched'] + self.match_tickets['cancelled']
+        return self.match_tickets['matched'] / total if total else None
+    
+    def count_outbound(self, message_type: str, size: int, messages: int = 1):
+        self.outbound_messages[message_type] = self.outbound_messages.get(message_type, 0) + messages
+        self.outbound_bytes[message_type] = self.outbound_bytes.get(message_type, 0) + size * messages
+    
+    def observe_fanout(self, kind: str, seconds: float):
+        histogram = self.fanout_duration.get(kind)
+        if histogram is None:
+            histogram = self.fanout_duration[kind] = Histogram()
+        histogram.observe(seconds)
+    
+    def observe_loop_lag(self, seconds: float):
+        self.loop_lag_last = seconds
+        self.loop_lag.observe(seconds)
+    
+    def render(self, server: 'NetMasterServer') -> str:
+        """Exporta todas as métricas (contadores + estado atual do servidor)"""
+        lines = []
+        
+        lines.append("# HELP netmaster_handler_latency_seconds Duração dos handlers de process_message")
+        lines.append("# TYPE netmaster_handler_latency_seconds histogram")
+        for message_type, histogram in sorted(self.handler_latency.items()):
+            lines.extend(histogram.render("netmaster_handler_latency_seconds", metric_label('handler', message_type)))
+        
+        lines.append("# HELP netmaster_messages_received_total Mensagens recebidas por tipo")
+        lines.append("# TYPE netmaster_messages_received_total counter")
+        for message_type, count in sorted(self.messages_received.items()):
+            lines.append(f"netmaster_messages_received_total{{{metric_label('type', message_type)}}} {count}")
+        
+        lines.append("# HELP netmaster_messages_rejected_total Mensagens rejeitadas antes do handler (tipo desconhecido, schema)")
+        lines.append("# TYPE netmaster_messages_rejected_total counter")
+        for (message_type, reason), count in sorted(self.messages_rejected.items()):
+            lines.append(f"netmaster_messages_rejected_total{{{metric_label('type', message_type)},{metric_label('reason', reason)}}} {count}")
+        
+        lines.append("# HELP netmaster_messages_throttled_total Mensagens descartadas pelo limite de débito por cliente")
+        lines.append("# TYPE netmaster_messages_throttled_total counter")
+        for message_type, count in sorted(self.messages_throttled.items()):
+            lines.append(f"netmaster_messages_throttled_total{{{metric_label('type', message_type)}}} {count}")
+        
+        lines.append("# HELP netmaster_sessions Sessões ativas por estado")
+        lines.append("# TYPE netmaster_sessions gauge")
+        by_state = {state.value: 0 for state in GameState}
+        for session in server.sessions.values():
+            by_state[session.state.value] += 1
+        for state, count in by_state.items():
+            lines.append(f"netmaster_sessions{{{metric_label('state', state)}}} {count}")
+        
+        lines.append("# HELP netmaster_connected_clients Ligações WebSocket abertas")
+        lines.append("# TYPE netmaster_connected_clients gauge")
+        lines.append(f"netmaster_connected_clients {len(server.registry.clients)}")
+        
+        # RTT atual de cada ligação (medido pelo keepalive ping/pong, sem mensagens da aplicação)
+        rtt = Histogram()
+        for state in server.registry.states.values():
+            if state.rtt is not None:
+                rtt.observe(state.rtt)
+        lines.append("# HELP netmaster_connection_rtt_seconds RTT do último ping/pong de cada ligação")
+        lines.append("# TYPE netmaster_connection_rtt_seconds histogram")
+        lines.extend(rtt.render("netmaster_connection_rtt_seconds"))
+        
+        lines.append("# HELP netmaster_outbound_messages_total Mensagens enviadas por tipo")
+        lines.append("# TYPE netmaster_outbound_messages_total counter")
+        for message_type, count in sorted(self.outbound_messages.items()):
+            lines.append(f"netmaster_outbound_messages_total{{{metric_label('type', message_type)}}} {count}")
+        
+        lines.append("# HELP netmaster_outbound_bytes_total Bytes enviados por tipo de mensagem")
+        lines.append("# TYPE netmaster_outbound_bytes_total counter")
+        for message_type, size in sorted(self.outbound_bytes.items()):
+            lines.append(f"netmaster_outbound_bytes_total{{{metric_label('type', message_type)}}} {size}")
+        
+        lines.append("# HELP netmaster_outbound_queue_depth Mensagens pendentes nas filas de saída")
+        lines.append("# TYPE netmaster_outbound_queue_depth gauge")
+        lines.append(f"netmaster_outbound_queue_depth {sum(len(outbound.queue) for outbound in server.outbound_queues.values())}")
+        
+        lines.append("# HELP netmaster_fanout_duration_seconds Duração do fan-out de broadcasts")
+        lines.append("# TYPE netmaster_fanout_duration_seconds histogram")
+        for kind, histogram in sorted(self.fanout_duration.items()):
+            lines.extend(histogram.render("netmaster_fanout_duration_seconds", metric_label('kind', kind)))
+        
+        lines.append("# HELP netmaster_event_loop_lag_seconds Atraso do event loop face ao instante agendado")
+        lines.append("# TYPE netmaster_event_loop_lag_seconds histogram")
+        lines.extend(self.loop_lag.render("netmaster_event_loop_lag_seconds"))
+        lines.append("# HELP netmaster_event_loop_lag_last_seconds Último atraso medido do event loop")
+        lines.append("# TYPE netmaster_event_loop_lag_last_seconds gauge")
+        lines.append(f"netmaster_event_loop_lag_last_seconds {self.loop_lag_last}")
+        
+        mailbox_sizes = [len(cards) for session in server.sessions.values()
+                         for cards in (session.pending_cards or {}).values() if cards]
+        lines.append("# HELP netmaster_pending_cards Cartas pendentes em todas as caixas de correio")
+        lines.append("# TYPE netmaster_pending_cards gauge")
+        lines.append(f"netmaster_pending_cards {sum(mailbox_sizes)}")
+        lines.append("# HELP netmaster_pending_card_mailboxes Caixas de correio com cartas pendentes")
+        lines.append("# TYPE netmaster_pending_card_mailboxes gauge")
+        lines.append(f"netmaster_pending_card_mailboxes {len(mailbox_sizes)}")
+        lines.append("# HELP netmaster_pending_card_mailbox_max Maior caixa de correio de cartas pendentes")
+        lines.append("# TYPE netmaster_pending_card_mailbox_max gauge")
+        lines.append(f"netmaster_pending_card_mailbox_max {max(mailbox_sizes, default=0)}")
+        lines.append("# HELP netmaster_card_delivery_seconds Tempo entre guardar uma carta e o ack do destinatário")
+        lines.append("# TYPE netmaster_card_delivery_seconds histogram")
+        lines.extend(self.card_delivery_latency.render("netmaster_card_delivery_seconds"))
+        lines.append("# HELP netmaster_card_deliveries_total Cartas da caixa de correio por resultado")
+        lines.append("# TYPE netmaster_card_deliveries_total counter")
+        for outcome, count in sorted(self.card_deliveries.items()):
+            lines.append(f"netmaster_card_deliveries_total{{{metric_label('outcome', outcome)}}} {count}")
+        
+        lines.append("# HELP netmaster_match_queue_size Jogadores na fila de matchmaking")
+        lines.append("# TYPE netmaster_match_queue_size gauge")
+        lines.append(f"netmaster_match_queue_size {len(server.matchmaker)}")
+        lines.append("# HELP netmaster_match_wait_seconds Tempo na fila de matchmaking até à sessão criada")
+        lines.append("# TYPE netmaster_match_wait_seconds histogram")
+        lines.extend(self.match_wait.render("netmaster_match_wait_seconds"))
+        lines.append("# HELP netmaster_match_tickets_total Saídas da fila de matchmaking por resultado")
+        lines.append("# TYPE netmaster_match_tickets_total counter")
+        for outcome, count in sorted(self.match_tickets.items()):
+            lines.append(f"netmaster_match_tickets_total{{{metric_label('outcome', outcome)}}} {count}")
+        
+        return "\n".join(lines) + "\n"
+
+metrics = ServerMetrics()
+
+class OutboundQueue:
+    """
+    Fila de saída limitada de uma ligação, servida pela sua própria tarefa de escrita.
+    
+    O fan-out apenas enfileira mensagens, por isso um cliente lento só atrasa a
+    sua própria fila. Quando a fila enche aplica-se a política de overflow:
+      - drop_oldest: descarta a mensagem descartável (COALESCE_MESSAGE_TYPES) mais antiga
+      - coalesce: substitui a mensagem pendente do mesmo tipo (COALESCE_MESSAGE_TYPES),
+        caso contrário descarta como drop_oldest
+      - disconnect: fecha a ligação do consumidor lento
+    Mensagens com estado (turnos, cartas, fim de jogo) nunca são descartadas: sem
+    nenhuma descartável na fila, a ligação é fechada (1008) e o cliente retoma a
+    sessão com resume_session, recebendo as mensagens perdidas do buffer de replay.
+    O mesmo acontece num timeout de envio, em qualquer política.
+    """
+    
+    def __init__(self, websocket, client_id: str, maxsize: int = OUTBOUND_QUEUE_SIZE,
+                 policy: str = OUTBOUND_OVERFLOW_POLICY):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.maxsize = maxsize
+        self.policy = policy
+        self.codec = netmaster_codec.CODEC_JSON  # Codec negociado (select_codec)
+        self.queue = deque()  # (message_type, payload)
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self.stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'coalesced': 0,
+            'send_errors': 0,
+            'max_depth': 0
+        }
+    
+    def start(self):
+        """Inicia a tarefa de escrita da ligação"""
+        self.task = asyncio.create_task(self._writer())
+    
+    def put(self, message_type: str, payload) -> bool:
+        """Enfileira uma mensagem já serializada. Retorna False se a ligação está fechada"""
+        if self.closed:
+            return False
+        
+        if len(self.queue) >= self.maxsize:
+            if not self._handle_overflow(message_type, payload):
+                return not self.closed  # Coalescida, descartada ou ligação fechada
+        else:
+            self.queue.append((message_type, payload))
+        
+        self.stats['enqueued'] += 1
+        depth = len(self.queue)
+        if depth > self.stats['max_depth']:
+            self.stats['max_depth'] = depth
+        self._ready.set()
+        return True
+    
+    def _handle_overflow(self, message_type: str, payload) -> bool:
+        """Aplica a política de overflow. Retorna True se a mensagem foi acrescentada à fila"""
+        if self.policy == 'coalesce' and message_type in COALESCE_MESSAGE_TYPES:
+            # Substituir a mensagem pendente mais recente do mesmo tipo
+            for index in range(len(self.queue) - 1, -1, -1):
+                if self.queue[index][0] == message_type:
+                    self.queue[index] = (message_type, payload)
+                    self.stats['coalesced'] += 1
+                    return False
+        
+        if self.policy != 'disconnect':
+            # Descartar a mensagem descartável mais antiga (as mensagens com estado ficam)
+            for index, (queued_type, _) in enumerate(self.queue):
+                if queued_type in COALESCE_MESSAGE_TYPES:
+                    del self.queue[index]
+                    self.stats['dropped'] += 1
+                    self.queue.append((message_type, payload))
+                    return True
+            if message_type in COALESCE_MESSAGE_TYPES:
+                self.stats['dropped'] += 1  # A própria mensagem nova é a descartável
+                return False
+        
+        broadcast_logger.warning(f"[OUTBOUND] Cliente {self.client_id} lento ({len(self.queue)} mensagens pendentes) - desconectando")
+        self.stats['dropped'] += 1
+        self.close(disconnect=True)
+        return False
+    
+    async def _writer(self):
+        """Envia as mensagens da fila pela ordem de chegada"""
+        while not self.closed:
+            if not self.queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            
+            message_type, payload = self.queue.popleft()
+            try:
+                await asyncio.wait_for(self.websocket.send(payload), timeout=OUTBOUND_SEND_TIMEOUT)
+                self.stats['sent'] += 1
+                metrics.count_outbound(message_type, len(payload))
+            except asyncio.TimeoutError:
+                self.stats['send_errors'] += 1
+                broadcast_logger.error(f"[OUTBOUND] Timeout ao enviar {message_type} para {self.client_id}")
+                # A mensagem perdeu-se: fechar para o cliente retomar a sessão pelo buffer de replay
+                self.close(disconnect=True)
+            except websockets.exceptions.ConnectionClosed:
+                self.close()
+            except Exception as e:
+                self.stats['send_errors'] += 1
+                broadcast_logger.error(f"[OUTBOUND] Erro ao enviar {message_type} para {self.client_id}: {e}")
+    
+    def close(self, disconnect: bool = False):
+        """Fecha a fila; com disconnect=True fecha também o websocket"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._ready.set()
+        if disconnect:
+            asyncio.create_task(self.websocket.close(code=1008, reason='slow consumer'))
+    
+    def snapshot(self) -> dict:
+        """Estatísticas da fila para introspeção"""
+        return {
+            'client_id': self.client_id,
+            'depth': len(self.queue),
+            'closed': self.closed,
+            'policy': self.policy,
+            **self.stats
+        }
+
+class LobbyIndex:
+    """
+    Índice versionado das sessões disponíveis no lobby.
+    
+    Cada alteração a uma sessão joinable gera um delta com um número de versão
+    sequencial, enviado apenas aos clientes subscritos. Um cliente que detete uma
+    falha na sequência pede um snapshot completo (lobby_resync).
+    """
+    
+    def __init__(self):
+        self.version = 0
+        self.entries: Dict[str, dict] = {}  # session_id -> entrada do lobby
+        self.subscribers: Set[str] = set()  # client_ids subscritos aos deltas
+        self.http_cache: Optional[tuple] = None  # (versão, JSON de GET /sessions)
+    
+    @staticmethod
+    def is_joinable(session: Optional[GameSession]) -> bool:
+        """Sessão aparece no lobby se está à espera, não expirou e não está cheia"""
+        return (session is not None and
+                session.state in [GameState.WAITING, GameState.STARTING] and
+                not session.is_expired() and
+                not session.is_full())
+    
+    @staticmethod
+    def make_entry(session: GameSession) -> dict:
+        """Entrada do lobby: vista da sessão sem campos dependentes do tempo atual"""
+        return session.lobby_view()
+    
+    def update(self, session_id: str, session: Optional[GameSession]) -> Optional[dict]:
+        """Atualiza a entrada da sessão e retorna o delta (None se nada mudou)"""
+        if not self.is_joinable(session):
+            if session_id not in self.entries:
+                return None
+            del self.entries[session_id]
+            self.version += 1
+            return {'type': 'session_removed', 'version': self.version, 'session_id': session_id}
+        
+        entry = self.make_entry(session)
+        previous = self.entries.get(session_id)
+        if previous is entry or previous == entry:  # Mesma versão da sessão: a vista é o mesmo objeto
+            return None
+        
+        self.entries[session_id] = entry
+        self.version += 1
+        return {
+            'type': 'session_added' if previous is None else 'session_updated',
+            'version': self.version,
+            'session': entry
+        }
+    
+    def apply_remote(self, delta: dict) -> Optional[dict]:
+        """Aplica um delta de outro shard e retorna o delta local equivalente (versão deste índice)"""
+        if delta['type'] == 'session_removed':
+            session_id = delta['session_id']
+            if self.entries.pop(session_id, None) is None:
+                return None
+            self.version += 1
+            return {'type': 'session_removed', 'version': self.version, 'session_id': session_id}
+        
+        entry = delta['session']
+        previous = self.entries.get(entry['id'])
+        if previous == entry:
+            return None
+        
+        self.entries[entry['id']] = entry
+        self.version += 1
+        return {
+            'type': 'session_added' if previous is None else 'session_updated',
+            'version': self.version,
+            'session': entry
+        }
+    
+    def full_list(self, sessions: Dict[str, GameSession]) -> List[dict]:
+        """Lista completa do lobby, com waiting_time_left calculado no momento do envio"""
+        now = datetime.now()
+        result = []
+        for session_id, entry in self.entries.items():
+            session = sessions.get(session_id)
+            waiting_left = 0
+            if session:
+                waiting_left = session.waiting_time_left(now)
+            elif session is None and entry.get('state') == GameState.WAITING.value:
+                # Sessão de outro shard: calcular a partir da entrada recebida
+                waiting_expires_at = datetime.fromisoformat(entry['waiting_expires_at'])
+                waiting_left = max(0, int((waiting_expires_at - now).total_seconds()))
+            result.append({**entry, 'waiting_time_left': waiting_left})
+        return result
+    
+    def http_body(self) -> str:
+        """Lobby em JSON para GET /sessions (serializado uma vez por versão; waiting_expires_at em vez do tempo restante)"""
+        if self.http_cache is None or self.http_cache[0] != self.version:
+            self.http_cache = (self.version, json.dumps({'version': self.version, 'sessions': list(self.entries.values())}))
+        return self.http_cache[1]
+    
+    def snapshot(self, sessions: Dict[str, GameSession]) -> dict:
+        """Mensagem de snapshot completo para (re)sincronizar um cliente"""
+        return {
+            'type': 'lobby_snapshot',
+            'version': self.version,
+            'sessions': self.full_list(sessions)
+        }
+
+class ConnectionState:
+    """
+    Estado de uma ligação: liveness e RTT vêm do keepalive ping/pong do WebSocket.
+    
+    O websockets envia um ping a cada KEEPALIVE_PING_INTERVAL e fecha a ligação sem
+    pong ao fim de KEEPALIVE_PING_TIMEOUT; 'latency' é o RTT do último ping respondido.
+    """
+    
+    __slots__ = ('websocket', 'connected_at', 'last_seen', 'legacy_heartbeats')
+    
+    def __init__(self, websocket, now: float):
+        self.websocket = websocket
+        self.connected_at = now  # time.monotonic()
+        self.last_seen = now  # Última mensagem recebida
+        self.legacy_heartbeats = 0  # Heartbeats JSON recebidos (clientes antigos)
+    
+    @property
+    def rtt(self) -> Optional[float]:
+        """RTT do último ping/pong em segundos (None antes do primeiro pong)"""
+        return getattr(self.websocket, 'latency', None) or None
+    
+    def snapshot(self, now: float) -> dict:
+        """Estado para introspeção"""
+        rtt = self.rtt
+        return {
+            'connected_seconds': round(now - self.connected_at, 3),
+            'idle_seconds': round(now - self.last_seen, 3),
+            'rtt_ms': round(rtt * 1000, 3) if rtt is not None else None,
+            'legacy_heartbeats': self.legacy_heartbeats
+        }
+
+class ConnectionRegistry:
+    """
+    Registo das ligações com mapas inversos para pesquisas O(1).
+    
+    Mantém client_id -> websocket, websocket -> client_id, client_id <-> player_id,
+    (session_id, cor) -> player_id e o estado de cada ligação (ConnectionState).
+    Os mapas são atualizados em conjunto nas operações de join/leave/remove, sem
+    percorrer sessões ou jogadores.
+    """
+    
+    def __init__(self):
+        self.clients: Dict[str, object] = {}  # client_id -> websocket
+        self.states: Dict[str, ConnectionState] = {}  # client_id -> estado da ligação
+        self.client_by_websocket: Dict[object, str] = {}  # websocket -> client_id
+        self.player_by_client: Dict[str, str] = {}  # client_id -> player_id
+        self.client_by_player: Dict[str, str] = {}  # player_id -> client_id
+        self.player_by_color: Dict[tuple, str] = {}  # (session_id, cor) -> player_id
+    
+    def add_client(self, client_id: str, websocket) -> ConnectionState:
+        """Regista uma nova ligação"""
+        self.clients[client_id] = websocket
+        self.client_by_websocket[websocket] = client_id
+        state = self.states[client_id] = ConnectionState(websocket, time.monotonic())
+        return state
+    
+    def remove_client(self, client_id: str):
+        """Remove a ligação e a associação ao jogador (o jogador em si é tratado pela sessão)"""
+        self.states.pop(client_id, None)
+        websocket = self.clients.pop(client_id, None)
+        if websocket is not None:
+            self.client_by_websocket.pop(websocket, None)
+        player_id = self.player_by_client.pop(client_id, None)
+        if player_id is not None and self.client_by_player.get(player_id) == client_id:
+            del self.client_by_player[player_id]
+        return websocket
+    
+    def client_id_for(self, websocket) -> Optional[str]:
+        """client_id de um websocket"""
+        return self.client_by_websocket.get(websocket)
+    
+    def bind_player(self, client_id: str, player_id: str, session_id: str, color: str):
+        """Associa jogador à ligação e à sua cor na sessão"""
+        previous_client = self.client_by_player.get(player_id)
+        if previous_client is not None and previous_client != client_id:
+            # Retoma numa nova ligação: a anterior deixa de representar o jogador
+            self.player_by_client.pop(previous_client, None)
+        if client_id in self.clients:
+            self.player_by_client[client_id] = player_id
+            self.client_by_player[player_id] = client_id
+        self.player_by_color[(session_id, color)] = player_id
+    
+    def unbind_player(self, player_id: str, session_id: str, color: str):
+        """Remove as associações de um jogador que saiu da sessão"""
+        client_id = self.client_by_player.pop(player_id, None)
+        if client_id is not None and self.player_by_client.get(client_id) == player_id:
+            del self.player_by_client[client_id]
+        if self.player_by_color.get((session_id, color)) == player_id:
+            del self.player_by_color[(session_id, color)]
+    
+    def find_player(self, session_id: str, color: str) -> Optional[str]:
+        """player_id com a cor indicada na sessão"""
+        return self.player_by_color.get((session_id, color))
 
 class NetMasterServer:
     """Servidor principal do NetMaster"""
     
-    def __init__(self):
+    def __init__(self, shard: Optional[ShardConfig] = None):
         self.sessions: Dict[str, GameSession] = {}
-        self.connected_clients: Dict[str, object] = {}  # websocket connections
+        self.registry = ConnectionRegistry()  # Ligações e mapas inversos cliente/jogador/cor
+        self.connected_clients: Dict[str, object] = self.registry.clients  # client_id -> websocket (só leitura)
         self.player_to_session: Dict[str, str] = {}  # player_id -> session_id mapping
+        self.outbound_queues: Dict[object, OutboundQueue] = {}  # websocket -> fila de saída
+        self.lobby = LobbyIndex()  # Índice versionado das sessões disponíveis
         self.running = False
         self.session_timers: Dict[str, dict] = {}  # session_id -> timer_info
+        self.scheduler = DeadlineScheduler()  # Prazos de todas as sessões num único loop
+        self.shard = shard  # None no modo de processo único
+        self.shard_link = None  # Ligação ao coordenador do lobby (netmaster_shards.ShardLink)
+        self.persistence: Optional[netmaster_persistence.SessionStore] = None  # WAL + snapshots das sessões
+        self.session_send_hook = self.enqueue_message  # Um só bound method partilhado por todas as sessões
+        self.rate_limiters: Dict[str, netmaster_inbound.ClientRateLimiter] = {}  # client_id -> buckets por tipo
+        self.dispatch_table = self.build_dispatch_table()  # tipo -> (handler, validador do schema)
+        self.http_routes = {  # Caminho HTTP -> handler (pedidos sem upgrade para WebSocket)
+            METRICS_PATH: self.http_metrics,
+            HEALTH_PATH: self.http_health,
+            STATUS_PATH: self.http_status,
+            SESSIONS_PATH: self.http_sessions
+        }
+        self.started_at: Optional[float] = None  # time.monotonic() do arranque (uptime em /status)
+        self.draining = False  # SIGTERM recebido: sem sessões novas até o processo terminar
+        self.drain_timeout = DRAIN_TIMEOUT_SECONDS
+        self.port = SERVER_PORT  # Porta WebSocket/HTTP (--port)
+        self.stop_event = asyncio.Event()  # Fim do encerramento gracioso (start_server retorna)
+        self.recording_enabled = RECORDING_ENABLED
+        self.recording_dir = RECORDING_DIR
+        self.recordings: Dict[str, netmaster_recording.SessionRecording] = {}  # session_id -> gravação em curso
+        self.spectators: Dict[str, SpectatorGroup] = {}  # session_id -> espectadores
+        self.watching: Dict[str, str] = {}  # client_id do espectador -> session_id
+        self.matchmaker = netmaster_matchmaking.Matchmaker(
+            [color.value for color in PlayerColor], MATCHMAKING_MATCH_SIZE, MATCHMAKING_MIN_PLAYERS,
+            MATCHMAKING_MAX_WAIT_SECONDS)
         
     async def start_server(self):
         """Inicia o servidor WebSocket"""
-        logger.info(f"Iniciando NetMaster Server em {SERVER_HOST}:{SERVER_PORT}")
+        logger.info(f"Iniciando NetMaster Server em {SERVER_HOST}:{self.port}")
         logger.info(f"Configurações:")
         logger.info(f"   - Máximo {MAX_PLAYERS_PER_SESSION} jogadores por sessão")
         logger.info(f"   - Duração máxima: {SESSION_DURATION_MINUTES} minutos")
         logger.info(f"   - Tempo de espera para outros jogadores: {WAITING_TIMEOUT_MINUTES} minuto(s)")
-        logger.info(f"   - Heartbeat: {HEARTBEAT_INTERVAL} segundos")
+        logger.info(f"   - Keepalive: ping a cada {KEEPALIVE_PING_INTERVAL}s, ligação fechada sem pong em {KEEPALIVE_PING_TIMEOUT}s")
+        logger.info(f"   - Ressincronização do timer: {TIMER_RESYNC_INTERVAL} segundos")
+        logger.info(f"   - Event loop: {running_event_loop()}")
         
         self.running = True
+        self.started_at = time.monotonic()
+        
+        # Catálogo das cartas lido uma vez (os baralhos de cada sessão são baralhados a partir dele)
+        catalog = netmaster_engine.load_catalog()
+        logger.info(f"   - Cartas: {len(set().union(*catalog.values()))} em {len(catalog)} baralhos (cor, tipo)")
+        
+        # Recuperar as sessões persistidas antes de aceitar ligações
+        records = {}
+        if PERSISTENCE_ENABLED and self.persistence is None:
+            directory = PERSISTENCE_DIR
+            if self.shard:
+                directory = os.path.join(PERSISTENCE_DIR, f"shard-{self.shard.index}")
+            self.persistence = netmaster_persistence.SessionStore(directory)
+            records = self.persistence.load()
+            self.persistence.start()
+        # Sessões entregues por um processo anterior em encerramento (estado mais recente do que o WAL)
+        handoff = self.load_handoff()
+        self.restore_sessions({**records, **handoff})
+        for session_id in handoff:
+            self.persist_session(session_id)
+        
+        # SIGTERM: encerramento gracioso em vez de terminar de imediato
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.begin_drain)
         
         # Iniciar tarefas de background
-        asyncio.create_task(self.cleanup_expired_sessions())
-        asyncio.create_task(self.heartbeat_monitor())
-        
-        # Iniciar servidor WebSocket
-        async with websockets.serve(
-            self.handle_client, 
-            SERVER_HOST, 
-            SERVER_PORT
-        ):
-            logger.info(f"Servidor NetMaster ativo em ws://{SERVER_HOST}:{SERVER_PORT}")
+        # Expiração de sessões e timeouts de espera são prazos no scheduler (a liveness é o ping/pong)
+        asyncio.create_task(self.scheduler.run())
+        self.schedule_loop_lag_probe()
+        
+        # Iniciar servidor WebSocket (pedidos HTTP a self.http_routes são respondidos por process_request)
+        async with contextlib.AsyncExitStack() as stack:
+            if self.shard:
+                # Porta pública partilhada entre workers (SO_REUSEPORT) + porta dedicada para redirecionamentos
+                listeners = [await stack.enter_async_context(websockets.serve(
+                    self.handle_client, SERVER_HOST, self.port, reuse_port=True,
+                    process_request=self.process_http_request, **WS_SERVE_OPTIONS))]
+                listeners.append(await stack.enter_async_context(websockets.serve(
+                    self.handle_client, SERVER_HOST, self.shard.port,
+                    process_request=self.process_http_request, **WS_SERVE_OPTIONS)))
+                logger.info(f"Shard {self.shard.index}/{self.shard.count} ativo em ws://{SERVER_HOST}:{self.port} "
+                            f"(porta dedicada {self.shard.port})")
+            else:
+                listeners = [await stack.enter_async_context(websockets.serve(
+                    self.handle_client, SERVER_HOST, self.port,
+                    process_request=self.process_http_request, **WS_SERVE_OPTIONS))]
+                logger.info(f"Servidor NetMaster ativo em ws://{SERVER_HOST}:{self.port}")
+            logger.info(f"Métricas em http://{SERVER_HOST}:{self.port}{METRICS_PATH} "
+                        f"(também {HEALTH_PATH}, {STATUS_PATH} e {SESSIONS_PATH})")
             logger.info(f"Acesso público: ws://netmaster.vps.tecnico.ulisboa.pt:8000")
-            await asyncio.Future()  # run forever
+            try:
+                await self.stop_event.wait()  # Até ao fim do encerramento gracioso
+            finally:
+                # Fechar o WAL antes das ligações: as saídas causadas pelo encerramento não são persistidas
+                self.close_persistence()
+                self.close_recordings()
+                if self.draining:
+                    # Deixar de aceitar ligações antes de fechar as existentes: quem religa vai para o processo seguinte
+                    for listener in listeners:
+                        listener.close(close_connections=False)
+                    await self.close_client_connections()
+    
+    def process_http_request(self, *args):
+        """
+        Hook process_request do websockets: responde aos pedidos HTTP simples (self.http_routes).
+        
+        Suporta a API nova (connection, request) e a API legacy (path, request_headers).
+        Retorna None para os restantes pedidos, que seguem o handshake WebSocket normal.
+        """
+        legacy_api = isinstance(args[0], str)
+        path = args[0] if legacy_api else args[1].path
+        route = self.http_routes.get(path.split('?', 1)[0])
+        if route is None:
+            return None
+        
+        status, content_type, body = route()
+        if legacy_api:
+            return status, [('Content-Type', content_type)], body.encode()
+        response = args[0].respond(status, body)
+        del response.headers['Content-Type']
+        response.headers['Content-Type'] = content_type
+        return response
+    
+    def http_metrics(self) -> tuple:
+        """GET /metrics: formato de texto Prometheus"""
+        return HTTPStatus.OK, "text/plain; version=0.0.4; charset=utf-8", metrics.render(self)
+    
+    def http_health(self) -> tuple:
+        """GET /healthz: 503 durante o encerramento para o load balancer deixar de enviar ligações"""
+        if self.draining:
+            return HTTPStatus.SERVICE_UNAVAILABLE, "application/json", '{"status":"draining"}'
+        return HTTPStatus.OK, "application/json", '{"status":"ok"}'
+    
+    def http_status(self) -> tuple:
+        """GET /status: contadores mantidos pelo servidor (sem percorrer sessões nem ligações)"""
+        return HTTPStatus.OK, "application/json", json.dumps({
+            'status': 'draining' if self.draining else 'ok',
+            'uptime_seconds': round(time.monotonic() - self.started_at, 3) if self.started_at else 0.0,
+            'shard': self.shard.index if self.shard else None,
+            'sessions': len(self.sessions),
+            'lobby_sessions': len(self.lobby.entries),
+            'lobby_version': self.lobby.version,
+            'players': len(self.player_to_session),
+            'connections': len(self.registry.clients),
+            'lobby_subscribers': len(self.lobby.subscribers),
+            'spectators': len(self.watching),
+            'match_queue': len(self.matchmaker),
+            'match_rate': metrics.match_rate(),
+            'deadlines': len(self.scheduler),
+            'event_loop': running_event_loop(),
+            'event_loop_lag_seconds': metrics.loop_lag_last
+        })
+    
+    def http_sessions(self) -> tuple:
+        """GET /sessions: sessões disponíveis no lobby (também as de outros shards)"""
+        return HTTPStatus.OK, "application/json", self.lobby.http_body()
+    
+    def schedule_loop_lag_probe(self):
+        """Agenda a próxima medição do atraso do event loop"""
+        when = self.scheduler.now() + LOOP_LAG_INTERVAL
+        self.scheduler.schedule(('loop_lag',), when, lambda: self.on_loop_lag_probe(when))
+    
+    def on_loop_lag_probe(self, scheduled_at: float):
+        """Atraso entre o instante agendado e o disparo efetivo do prazo"""
+        metrics.observe_loop_lag(max(0.0, self.scheduler.now() - scheduled_at))
+        self.schedule_loop_lag_probe()
     
     async def handle_client(self, websocket):
         """Lida com conexões de clientes"""
         client_id = str(uuid.uuid4())
-        self.connected_clients[client_id] = websocket
+        connection = self.registry.add_client(client_id, websocket)
+        self.rate_limiters[client_id] = netmaster_inbound.ClientRateLimiter(RATE_LIMITS)
+        outbound = OutboundQueue(websocket, client_id)
+        self.outbound_queues[websocket] = outbound
+        outbound.start()
         
         try:
             logger.info(f"Cliente conectado: {client_id} de {websocket.remote_address}")
@@ -351,18 +1629,27 @@ class NetMasterServer:
                     'name': 'NetMaster Server',
                     'version': '1.0.0',
                     'max_players_per_session': MAX_PLAYERS_PER_SESSION,
-                    'session_duration_minutes': SESSION_DURATION_MINUTES
-                }
+                    'session_duration_minutes': SESSION_DURATION_MINUTES,
+                    # Liveness por ping/pong do WebSocket: clientes novos deixam de enviar heartbeat JSON
+                    'keepalive': {'ping_interval': KEEPALIVE_PING_INTERVAL, 'ping_timeout': KEEPALIVE_PING_TIMEOUT}
+                },
+                # Negociação de codec: o cliente responde com select_codec (JSON até lá)
+                'codecs': netmaster_codec.available_codecs(),
+                'codec_dictionary': netmaster_codec.CODEC_DICTIONARY_VERSION
             })
             
             # Processar mensagens do cliente
             async for message in websocket:
+                connection.last_seen = time.monotonic()
                 try:
-                    data = json.loads(message)
-                    await self.process_message(client_id, websocket, data)
-                except json.JSONDecodeError:
-                    logger.error(f"Mensagem JSON inválida de {client_id}: {message}")
+                    data = netmaster_codec.decode(message)
+                except ValueError:
+                    logger.error(f"Mensagem inválida de {client_id}: {message!r:.200}")
                     await self.send_error(websocket, "Formato de mensagem inválido")
+                    continue
+                
+                try:
+                    await self.process_message(client_id, websocket, data)
                 except Exception as e:
                     logger.error(f"Erro ao processar mensagem de {client_id}: {e}")
                     await self.send_error(websocket, f"Erro interno: {str(e)}")
@@ -373,12 +1660,15 @@ class NetMasterServer:
             logger.error(f"Erro na conexão {client_id}: {e}")
         finally:
             await self.cleanup_client(client_id)
+            self.rate_limiters.pop(client_id, None)
+            outbound = self.outbound_queues.pop(websocket, None)
+            if outbound:
+                outbound.close()
+                if outbound.stats['dropped'] or outbound.stats['coalesced']:
+                    broadcast_logger.info(f"[OUTBOUND] Fila de {client_id} fechada: {outbound.snapshot()}")
     
-    async def process_message(self, client_id: str, websocket, data: dict):
-        """Processa mensagens recebidas dos clientes"""
-        message_type = data.get('type')
-        logger.info(f"Mensagem de {client_id}: {message_type}")
-        
+    def build_dispatch_table(self) -> Dict[str, tuple]:
+        """Tabela de dispatch construída uma vez: tipo -> (handler, validador compilado do schema)"""
         handlers = {
             'create_session': self.handle_create_session,
             'join_session': self.handle_join_session,
@@ -386,21 +1676,96 @@ class NetMasterServer:
             'list_sessions': self.handle_list_sessions,
             'start_game': self.handle_start_game,
             'game_action': self.handle_game_action,
-            'heartbeat': self.handle_heartbeat,
             'get_session_info': self.handle_get_session_info,
             'end_turn': self.handle_end_turn,
             'timer_sync': self.handle_timer_sync,  # NOVO: Handler para sincronização do timer
             'store_card_for_player': self.handle_store_card_for_player,  # NOVO: Handler para armazenar carta
             'get_pending_cards': self.handle_get_pending_cards,  # NOVO: Handler para obter cartas pendentes
-            'update_player_score': self.handle_update_player_score  # NOVO: Handler para atualizar saldo do jogador
+            'update_player_score': self.handle_update_player_score,  # NOVO: Handler para atualizar saldo do jogador
+            'ack_pending_cards': self.handle_ack_pending_cards,
+            'subscribe_lobby': self.handle_subscribe_lobby,
+            'unsubscribe_lobby': self.handle_unsubscribe_lobby,
+            'lobby_resync': self.handle_lobby_resync,
+            'watch_session': self.handle_watch_session,
+            'unwatch_session': self.handle_unwatch_session,
+            'queue_for_match': self.handle_queue_for_match,
+            'leave_match_queue': self.handle_leave_match_queue,
+            'select_codec': self.handle_select_codec,
+            'resume_session': self.handle_resume_session
         }
+        if LEGACY_HEARTBEAT_ENABLED:
+            handlers['heartbeat'] = self.handle_heartbeat
+        return {message_type: (handler, netmaster_inbound.compile_schema(netmaster_inbound.MESSAGE_SCHEMAS.get(message_type, {})))
+                for message_type, handler in handlers.items()}
+    
+    async def process_message(self, client_id: str, websocket, data: dict):
+        """Processa mensagens recebidas dos clientes (dispatch -> limite de débito -> schema -> handler)"""
+        message_type = data.get('type') if isinstance(data, dict) else None
+        if dispatch_logger.isEnabledFor(logging.DEBUG):
+            dispatch_logger.debug(f"Mensagem de {client_id}: {message_type}")
+        
+        route = self.dispatch_table.get(message_type) if isinstance(message_type, str) else None
+        if route is None:
+            # Tipo fora da tabela: um só bucket e um só rótulo nas métricas (o tipo vem do cliente).
+            # Com o bucket vazio descarta sem responder - o erro não pode amplificar o flood
+            limiter = self.rate_limiters.get(client_id)
+            if limiter is not None and not limiter.bucket('unknown').allow(time.monotonic()):
+                metrics.count_throttled('unknown')
+                return
+            metrics.count_rejected('unknown', 'unknown_type')
+            dispatch_logger.warning(f"Tipo de mensagem desconhecido de {client_id}: {message_type!r:.64}")
+            await self.send_error(websocket, f"Tipo de mensagem não suportado: {message_type!r:.64}")
+            return
+        handler, validate = route
+        
+        if self.draining and message_type in DRAIN_REFUSED_TYPES:
+            metrics.count_rejected(message_type, 'draining')
+            await self.send_message(websocket, {
+                'type': 'error',
+                'message': 'Servidor em reinício - não aceita sessões novas de momento',
+                'code': 'server_draining',
+                'timestamp': time.time()
+            })
+            return
+        
+        limiter = self.rate_limiters.get(client_id)
+        if limiter is not None:
+            bucket = limiter.bucket(message_type)
+            if not bucket.allow(time.monotonic()):
+                metrics.count_throttled(message_type)
+                if not bucket.notified:
+                    # Avisar só a primeira mensagem de cada sequência - o aviso não pode amplificar o flood
+                    bucket.notified = True
+                    dispatch_logger.warning(f"[RATE_LIMIT] Cliente {client_id} excedeu o limite de {message_type}")
+                    await self.send_message(websocket, {
+                        'type': 'error',
+                        'message': f"Demasiados pedidos {message_type} - tente novamente mais tarde",
+                        'code': 'rate_limited',
+                        'retry_after': round(bucket.retry_after(), 3),
+                        'timestamp': time.time()
+                    })
+                return
+        
+        error = validate(data)
+        if error is not None:
+            metrics.count_rejected(message_type, 'schema')
+            dispatch_logger.warning(f"[SCHEMA] {message_type} de {client_id} rejeitada: {error}")
+            await self.send_error(websocket, f"Mensagem {message_type} inválida: {error}")
+            return
         
-        handler = handlers.get(message_type)
-        if handler:
+        start = time.perf_counter()
+        recording = None
+        if self.recording_enabled:
+            received_at = time.monotonic()
+            recording = self.recording_for(client_id, data)
+            if recording is not None:
+                recording.inbound(client_id, data, received_at)
+        try:
             await handler(client_id, websocket, data)
-        else:
-            logger.warning(f"Tipo de mensagem desconhecido: {message_type}")
-            await self.send_error(websocket, f"Tipo de mensagem não suportado: {message_type}")
+        finally:
+            metrics.observe_handler(message_type, time.perf_counter() - start)
+        if self.recording_enabled and message_type in RECORDING_BIND_TYPES:
+            self.record_binding(client_id, data, received_at, recording)
     
     async def handle_create_session(self, client_id: str, websocket, data: dict):
         """Cria uma nova sessão de jogo"""
@@ -422,7 +1787,7 @@ class NetMasterServer:
                 return
             
             # Criar nova sessão
-            session_id = str(uuid.uuid4())[:8]  # ID curto para facilitar compartilhamento
+            session_id = self.new_session_id()
             player_id = str(uuid.uuid4())
             
             # Criar jogador host
@@ -432,30 +1797,35 @@ class NetMasterServer:
                 color=color_enum,
                 websocket=websocket,
                 connected=True,
-                last_heartbeat=time.time()
+                last_heartbeat=time.time(),
+                resume_token=secrets.token_urlsafe(16)
             )
             
             # Criar sessão
             session = GameSession(
                 id=session_id,
                 host_player_id=player_id,
-                players={player_id: host_player},
+                players={},
                 state=GameState.WAITING,
                 created_at=datetime.now(),
                 expires_at=datetime.now() + timedelta(minutes=duration_minutes),
                 waiting_expires_at=datetime.now() + timedelta(minutes=WAITING_TIMEOUT_MINUTES),
-                duration_minutes=duration_minutes
+                duration_minutes=duration_minutes,
+                send_hook=self.session_send_hook
             )
+            if self.recording_enabled:
+                self.start_recording(session)
             
-            # CORREÇÃO: Adicionar host à ordem de turnos imediatamente
-            session.add_player_to_order(player_id)
+            # *** ADICIONAR HOST À SESSÃO (tabela de jogadores + ordem de turnos + broadcast) ***
+            session.add_player(host_player)
             logger.info(f"Host {player_name} adicionado à ordem de turnos: {session.player_order}")
             
-            # *** ADICIONAR HOST AO SISTEMA DE BROADCAST ***
-            session.add_player_info(player_id, player_color, player_name, websocket)
-            
             self.sessions[session_id] = session
             self.player_to_session[player_id] = session_id
+            self.registry.bind_player(client_id, player_id, session_id, color_enum.value)
+            self.leave_lobby_roles(client_id)
+            self.schedule_session_deadlines(session)
+            self.persist_session(session_id)
             
             logger.info(f"Nova sessão criada: {session_id} por {player_name} ({player_color}) - Duração: {duration_minutes}min")
             
@@ -469,7 +1839,9 @@ class NetMasterServer:
                     'type': 'session_created',
                     'session': session_dict,
                     'player_id': player_id,
-                    'player_info': player_dict
+                    'player_info': player_dict,
+                    'resume_token': host_player.resume_token,
+                    'seq': session.replay.seq
                 })
                 
                 logger.info(f"Resposta enviada com sucesso")
@@ -480,7 +1852,7 @@ class NetMasterServer:
             # Broadcast para outros clientes sobre nova sessão disponível
             try:
                 logger.info(f"Fazendo broadcast da lista de sessões...")
-                await self.broadcast_session_list_update()
+                await self.broadcast_session_list_update(session_id)
                 logger.info(f"Broadcast concluído com sucesso")
             except Exception as broadcast_error:
                 logger.error(f"Erro no broadcast: {broadcast_error}")
@@ -497,6 +1869,11 @@ class NetMasterServer:
             player_name = data.get('player_name', 'Player')
             player_color = data.get('color')
             
+            # Modo multi-processo: a sessão pode pertencer a outro shard
+            if self.shard and session_id and not self.shard.owns(session_id):
+                await self.send_redirect(websocket, session_id, data)
+                return
+            
             # Verificar se sessão existe
             session = self.sessions.get(session_id)
             if not session:
@@ -539,30 +1916,33 @@ class NetMasterServer:
                 color=color_enum,
                 websocket=websocket,
                 connected=True,
-                last_heartbeat=time.time()
+                last_heartbeat=time.time(),
+                resume_token=secrets.token_urlsafe(16)
             )
             
             # Adicionar à sessão
-            session.players[player_id] = new_player
             self.player_to_session[player_id] = session_id
+            self.registry.bind_player(client_id, player_id, session_id, color_enum.value)
+            self.leave_lobby_roles(client_id)
             
             # Limpar marcação de sessão vazia se existir
-            if hasattr(session, 'empty_since') and session.empty_since:
+            if session.empty_since:
                 session.empty_since = None
+                self.scheduler.cancel(('empty_removal', session_id))
                 logger.info(f"Sessão {session_id} não está mais vazia - cancelando remoção automática")
             
-            # Adicionar jogador à ordem de turnos
-            session.add_player_to_order(player_id)
-            
-            # *** ADICIONAR JOGADOR AO SISTEMA DE BROADCAST ***
-            session.add_player_info(player_id, color_enum.value, player_name, websocket)
+            # *** ADICIONAR JOGADOR À SESSÃO (tabela de jogadores + ordem de turnos + broadcast) ***
+            session.add_player(new_player)
             
             # Se é o segundo jogador, estender o tempo de espera
             if len(session.players) == 2 and session.state == GameState.WAITING:
                 # Estender o tempo de espera para permitir mais jogadores se juntarem
                 session.waiting_expires_at = datetime.now() + timedelta(minutes=1)  # 1 minuto adicional
+                session.touch()
+                self.schedule_waiting_deadline(session)
                 logger.info(f"Segundo jogador juntou-se à sessão {session_id}. Tempo de espera estendido para 1 minuto.")
             
+            self.persist_session(session_id)
             logger.info(f"{player_name} ({color_enum.value}) juntou-se à sessão {session_id}")
             
             # Responder ao novo jogador
@@ -570,7 +1950,9 @@ class NetMasterServer:
                 'type': 'session_joined',
                 'session': session.to_dict(),
                 'player_id': player_id,
-                'player_info': new_player.to_dict()
+                'player_info': new_player.to_dict(),
+                'resume_token': new_player.resume_token,
+                'seq': session.replay.seq
             }
             logger.info(f"*** ENVIANDO SESSION_JOINED PARA {player_name} (ID: {player_id}) ***")
             logger.info(f"*** WEBSOCKET VÁLIDO: {not self.is_websocket_closed(websocket)} ***")
@@ -578,12 +1960,7 @@ class NetMasterServer:
             logger.info(f"*** CLIENT_ID MAPEADO: {client_id} ***")
             
             # Verificar se o client está na lista de conexões ativas
-            connected_client = None
-            for connected_id, connected_ws in self.connected_clients.items():
-                if connected_id == client_id:
-                    connected_client = connected_ws
-                    logger.info(f"*** FOUND CLIENT {client_id} IN CONNECTED_CLIENTS: {connected_ws} ***")
-                    break
+            connected_client = self.registry.clients.get(client_id)
             
             if connected_client is None:
                 logger.error(f"*** ERRO: CLIENT {client_id} NÃO ENCONTRADO EM CONNECTED_CLIENTS! ***")
@@ -592,10 +1969,10 @@ class NetMasterServer:
             else:
                 logger.info(f"*** WEBSOCKET MATCH OK - USANDO WEBSOCKET CORRETO ***")
             
-            # TESTE: Verificar serialização JSON antes de enviar
+            # Serializar uma única vez (também valida a mensagem antes de enviar)
             try:
-                test_json = json.dumps(session_joined_message)
-                logger.info(f"*** JSON SERIALIZATION TEST: PASSED - {len(test_json)} chars ***")
+                session_joined_message = EncodedFrame.encode(session_joined_message)
+                logger.info(f"*** JSON SERIALIZATION: PASSED - {len(session_joined_message.data)} chars ***")
             except Exception as json_error:
                 logger.error(f"*** JSON SERIALIZATION ERROR: {json_error} ***")
                 logger.error(f"*** PROBLEMATIC MESSAGE: {session_joined_message} ***")
@@ -613,20 +1990,15 @@ class NetMasterServer:
             original_websocket = websocket
             
             # Verificar qual cliente está enviando o join
-            sender_client_id = None
-            for cid, ws in self.connected_clients.items():
-                if ws == websocket:
-                    sender_client_id = cid
-                    break
+            sender_client_id = self.registry.client_id_for(websocket)
             
             if sender_client_id:
                 logger.info(f"*** JOIN de cliente identificado: {sender_client_id} ***")
                 # Usar SEMPRE o websocket do cliente que enviou a mensagem
-                target_websocket = self.connected_clients[sender_client_id]
+                target_websocket = self.registry.clients[sender_client_id]
                 logger.info(f"*** USANDO WEBSOCKET DO SENDER: {target_websocket} ***")
             else:
                 logger.error(f"*** ERRO CRÍTICO: Cliente não encontrado para websocket {websocket} ***")
-                logger.error(f"*** CONNECTED_CLIENTS: {list(self.connected_clients.keys())} ***")
                 target_websocket = websocket
             
             # TESTE: Enviar uma mensagem simples primeiro para verificar conectividade
@@ -637,19 +2009,6 @@ class NetMasterServer:
                 logger.info(f"*** TESTE DE CONECTIVIDADE PASSOU! ***")
             except Exception as test_error:
                 logger.error(f"*** TESTE DE CONECTIVIDADE FALHOU: {test_error} ***")
-                # Tentar encontrar outro websocket para este cliente
-                logger.error(f"*** PROCURANDO WEBSOCKET ALTERNATIVO ***")
-                for alt_cid, alt_ws in self.connected_clients.items():
-                    if alt_cid != sender_client_id:
-                        continue
-                    try:
-                        logger.info(f"*** TENTANDO WEBSOCKET ALTERNATIVO: {alt_ws} ***")
-                        await self.send_message(alt_ws, test_message)
-                        target_websocket = alt_ws
-                        logger.info(f"*** WEBSOCKET ALTERNATIVO FUNCIONOU! ***")
-                        break
-                    except:
-                        continue
 
             await self.send_message(target_websocket, session_joined_message)
             logger.info(f"*** SESSION_JOINED ENVIADO PARA {player_name} VIA WEBSOCKET: {target_websocket} ***")
@@ -662,7 +2021,7 @@ class NetMasterServer:
             }, exclude_player=player_id)
             
             # Broadcast atualização da lista de sessões
-            await self.broadcast_session_list_update()
+            await self.broadcast_session_list_update(session_id)
             
         except Exception as e:
             logger.error(f"Erro ao juntar à sessão: {e}")
@@ -713,6 +2072,11 @@ class NetMasterServer:
                 else:
                     logger.info(f"  ❌ Sessão {session_id} EXCLUÍDA da lista")
             
+            if self.shard:
+                # Sessões dos outros shards, conhecidas através do coordenador
+                available_sessions.extend(entry for entry in self.lobby.full_list(self.sessions)
+                                          if entry['id'] not in self.sessions)
+            
             logger.info(f"*** RESULTADO: {len(available_sessions)} sessões disponíveis de {len(self.sessions)} totais ***")
 
             await self.send_message(websocket, {
@@ -726,6 +2090,146 @@ class NetMasterServer:
             logger.error(f"Erro ao listar sessões: {e}")
             await self.send_error(websocket, f"Erro ao listar sessões: {str(e)}")
     
+    async def handle_queue_for_match(self, client_id: str, websocket, data: dict):
+        """Põe o cliente na fila de matchmaking (a sessão é criada num tick seguinte: match_found)"""
+        duration_minutes = data.get('duration_minutes', SESSION_DURATION_MINUTES)
+        if duration_minutes < 15 or duration_minutes > 120:
+            await self.send_error(websocket, f"Duração inválida: {duration_minutes}. Deve ser entre 15 e 120 minutos.")
+            return
+        color = data.get('color')
+        if color:
+            try:
+                color = PlayerColor(color.lower()).value
+            except ValueError:
+                await self.send_error(websocket, f"Cor inválida: {color}")
+                return
+        if client_id in self.registry.player_by_client:
+            await self.send_error(websocket, "Jogador já está numa sessão")
+            return
+        
+        self.matchmaker.add(netmaster_matchmaking.MatchTicket(
+            client_id, data.get('player_name', 'Player'), duration_minutes, (color,) if color else (),
+            self.scheduler.now()))
+        self.schedule_matchmaking()
+        logger.info(f"[MATCHMAKING] Cliente {client_id} na fila ({duration_minutes}min, cor {color or 'qualquer'}) - "
+                    f"{len(self.matchmaker)} na fila")
+        await self.send_message(websocket, {
+            'type': 'match_queued',
+            'duration_minutes': duration_minutes,
+            'color': color,
+            'queue_size': len(self.matchmaker),
+            'max_wait_seconds': MATCHMAKING_MAX_WAIT_SECONDS
+        })
+    
+    async def handle_leave_match_queue(self, client_id: str, websocket, data: dict):
+        """Sai da fila de matchmaking"""
+        ticket = self.matchmaker.remove(client_id)
+        if ticket:
+            metrics.count_match('cancelled')
+        await self.send_message(websocket, {
+            'type': 'match_queue_left',
+            'queued': ticket is not None
+        })
+    
+    def schedule_matchmaking(self):
+        """Agenda o próximo tick enquanto houver jogadores na fila"""
+        if len(self.matchmaker) and self.scheduler.deadline(('matchmaking',)) is None:
+            self.scheduler.schedule_in(('matchmaking',), MATCHMAKING_TICK_INTERVAL, self.on_matchmaking_tick)
+    
+    async def on_matchmaking_tick(self):
+        """Tick do matchmaking: cria as sessões de todos os grupos prontos e atualiza o lobby uma vez"""
+        if self.draining:
+            return  # Sem sessões novas; as ligações em fila fecham com o processo
+        try:
+            groups = self.matchmaker.tick(self.scheduler.now())
+            session_ids = []
+            for group in groups:
+                session = self.create_match_session(group)
+                session_ids.append(session.id)
+                for player_id in session.player_order:
+                    player = session.players[player_id]
+                    self.enqueue_message(player.websocket, {
+                        'type': 'match_found',
+                        'session': session.to_dict(),
+                        'player_id': player_id,
+                        'player_info': player.to_dict(),
+                        'resume_token': player.resume_token,
+                        'is_host': player_id == session.host_player_id,
+                        'seq': session.replay.seq
+                    })
+            if session_ids:
+                logger.info(f"[MATCHMAKING] {len(session_ids)} sessões criadas ({sum(map(len, groups))} jogadores), "
+                            f"{len(self.matchmaker)} na fila")
+                await self.broadcast_session_list_update(*session_ids)
+        except Exception as e:
+            logger.error(f"[MATCHMAKING] Erro no tick do matchmaking: {e}")
+        finally:
+            self.schedule_matchmaking()  # Um tick falhado não pode parar a fila
+    
+    def create_match_session(self, group: list) -> GameSession:
+        """Sessão de um grupo do matchmaking: o primeiro da fila é o host e há um só players_info_sync"""
+        now, queued_until = datetime.now(), self.scheduler.now()
+        duration_minutes = group[0][0].duration_minutes
+        session = GameSession(
+            id=self.new_session_id(),
+            host_player_id='',
+            players={},
+            state=GameState.WAITING,
+            created_at=now,
+            expires_at=now + timedelta(minutes=duration_minutes),
+            waiting_expires_at=now + timedelta(minutes=WAITING_TIMEOUT_MINUTES),
+            duration_minutes=duration_minutes,
+            send_hook=self.session_send_hook
+        )
+        if self.recording_enabled:
+            self.start_recording(session)
+        
+        for ticket, color in group:
+            player = Player(
+                id=str(uuid.uuid4()),
+                name=ticket.player_name,
+                color=PlayerColor(color),
+                websocket=self.registry.clients.get(ticket.client_id),
+                connected=True,
+                last_heartbeat=time.time(),
+                resume_token=secrets.token_urlsafe(16)
+            )
+            session.host_player_id = session.host_player_id or player.id
+            session.add_player(player, broadcast=False)
+            self.player_to_session[player.id] = session.id
+            self.registry.bind_player(ticket.client_id, player.id, session.id, color)
+            self.stop_watching(ticket.client_id)
+            if session.replay.recording is not None:
+                session.replay.recording.bind(ticket.client_id, player.id, session.id)
+            metrics.count_match('matched', queued_until - ticket.queued_at)
+        
+        self.sessions[session.id] = session
+        self.schedule_session_deadlines(session)
+        self.persist_session(session.id)
+        session.broadcast_players_info()
+        logger.info(f"[MATCHMAKING] Sessão {session.id} criada para {session.get_players_summary()} - "
+                    f"Duração: {duration_minutes}min")
+        return session
+    
+    def new_session_id(self) -> str:
+        """ID curto para facilitar compartilhamento (no modo multi-processo, sempre de uma sessão deste shard)"""
+        while True:
+            session_id = str(uuid.uuid4())[:8]
+            if session_id not in self.sessions and (not self.shard or self.shard.owns(session_id)):
+                return session_id
+    
+    async def send_redirect(self, websocket, session_id: str, data: dict):
+        """Indica ao cliente a porta do shard dono da sessão; o cliente religa-se e repete o pedido"""
+        owner = ShardConfig.owner_of(session_id, self.shard.count)
+        logger.info(f"Sessão {session_id} pertence ao shard {owner} - redirecionando cliente")
+        await self.send_message(websocket, {
+            'type': 'redirect',
+            'session_id': session_id,
+            'shard': owner,
+            'port': self.shard.port_of(owner),
+            'retry': data
+        })
+    
     async def handle_start_game(self, client_id: str, websocket, data: dict):
         """Inicia o jogo (apenas o host pode fazer isso)"""
         try:
@@ -758,20 +2262,21 @@ class NetMasterServer:
             
             # Definir o primeiro jogador como atual (índice 0)
             session.current_turn_index = 0
+            session.touch()
             first_player_id = session.get_current_player_id()
             logger.info(f"Primeiro jogador definido: {first_player_id}")
             
             logger.info(f"Jogo iniciado na sessão {session_id} com {len(session.players)} jogadores")
             
             # CRÍTICO: Preparar mensagem game_started
-            game_started_message = {
+            game_started_message = session.replay.record({
                 'type': 'game_started',
                 'session': session.to_dict(),
                 'message': 'O jogo começou!'
-            }
+            })
             logger.info(f"*** ENVIANDO MENSAGEM game_started para sessão {session_id} ***")
             logger.info(f"Players na sessão: {list(session.players.keys())}")
-            logger.info(f"Dados da mensagem: {game_started_message['type']}")
+            logger.info(f"Dados da mensagem: {game_started_message.type}")
             
             # NOVA ABORDAGEM: Enviar game_started com retry individual e verificação de conexão
             successful_sends = 0
@@ -841,6 +2346,7 @@ class NetMasterServer:
                             player.connected = False
                             failed_players.append(player_id)
             
+            session.touch()  # Jogadores que falharam ficaram marcados como desconectados
             logger.info(f"GAME_STARTED: {successful_sends} envios bem-sucedidos de {len(session.players)} jogadores")
             if failed_players:
                 logger.warning(f"GAME_STARTED: Falhas para jogadores: {failed_players}")
@@ -854,9 +2360,10 @@ class NetMasterServer:
             # Iniciar timer controlado pelo servidor
             await self.start_session_timer(session_id, session.duration_minutes)
             logger.info(f"Timer do servidor iniciado para sessão {session_id} - {session.duration_minutes} minutos")
+            self.persist_session(session_id)
             
             # Atualizar lista de sessões (sessão não estará mais disponível)
-            await self.broadcast_session_list_update()
+            await self.broadcast_session_list_update(session_id)
             
         except Exception as e:
             logger.error(f"Erro ao iniciar jogo: {e}")
@@ -871,14 +2378,14 @@ class NetMasterServer:
             
             session_id = self.player_to_session.get(player_id)
             if not session_id or session_id not in self.sessions:
-                await self.send_error(websocket, "Sessão não encontrada")
+                await self.send_error(websocket, "Sessão não encontrada", action_type=action_type)
                 return
             
             session = self.sessions[session_id]
             
             # Verificar se jogo está ativo
             if session.state != GameState.PLAYING:
-                await self.send_error(websocket, "Jogo não está ativo")
+                await self.send_error(websocket, "Jogo não está ativo", action_type=action_type)
                 return
             
             # Processar ação específica
@@ -903,18 +2410,19 @@ class NetMasterServer:
             
         except Exception as e:
             logger.error(f"Erro ao processar ação de jogo: {e}")
-            await self.send_error(websocket, f"Erro na ação: {str(e)}")
+            await self.send_error(websocket, f"Erro na ação: {str(e)}", action_type=data.get('action_type'))
     
     async def handle_heartbeat(self, client_id: str, websocket, data: dict):
-        """Processa heartbeat de jogadores"""
+        """Heartbeat JSON dos clientes antigos - a liveness é o keepalive ping/pong da ligação"""
         try:
-            player_id = data.get('player_id')
-            session_id = self.player_to_session.get(player_id)
-            
-            if session_id and session_id in self.sessions:
-                session = self.sessions[session_id]
-                if player_id in session.players:
-                    session.players[player_id].last_heartbeat = time.time()
+            connection = self.registry.states.get(client_id)
+            if connection is not None:
+                connection.legacy_heartbeats += 1
+            player_id = self.registry.player_by_client.get(client_id)
+            session = self.sessions.get(self.player_to_session.get(player_id)) if player_id else None
+            if session and player_id in session.players:
+                # Sem touch(): last_heartbeat não justifica descartar as vistas em cache da sessão
+                session.players[player_id].last_heartbeat = time.time()
             
             await self.send_message(websocket, {
                 'type': 'heartbeat_ack',
@@ -972,6 +2480,7 @@ class NetMasterServer:
             
             # Avançar para o próximo jogador
             session.next_turn()
+            self.persist('turn', session_id, index=session.current_turn_index)
             
             # Obter dados do novo jogador atual
             new_current_player_id = session.get_current_player_id()
@@ -991,8 +2500,8 @@ class NetMasterServer:
             logger.info(f"Enviando turn_changed: novo jogador {new_current_player.name} ({new_current_player_id})")
             await self.broadcast_to_session(session_id, turn_changed_message)
             
-            # NOTA: Com o novo sistema, as cartas pendentes são obtidas automaticamente 
-            # quando o jogador inicia sua interface (playerdashboard_interface)
+            # Reentregar ao novo jogador as cartas que ainda não confirmou
+            await self.deliver_pending_cards(session_id, new_current_player.color.value, 'turn')
             
             # Enviar confirmação para o jogador que terminou o turno
             await self.send_message(websocket, {
@@ -1007,74 +2516,95 @@ class NetMasterServer:
             await self.send_error(websocket, f"Erro ao processar fim de turno: {str(e)}")
     
     async def start_session_timer(self, session_id: str, duration_minutes: int):
-        """Inicia um timer controlado pelo servidor para uma sessão"""
+        """Inicia o timer controlado pelo servidor para uma sessão (prazo no scheduler central)"""
         try:
             total_seconds = duration_minutes * 60
-            timer_info = {
-                'task': None,
+            deadline_monotonic = self.scheduler.now() + total_seconds
+            
+            # Substituir timer anterior se existir
+            self.cancel_session_timer(session_id)
+            
+            self.session_timers[session_id] = {
                 'start_time': time.time(),
                 'duration_seconds': total_seconds,
-                'remaining_seconds': total_seconds
+                'deadline': time.time() + total_seconds,  # Prazo absoluto enviado aos clientes
+                'deadline_monotonic': deadline_monotonic
             }
             
-            # Cancelar timer anterior se existir
-            if session_id in self.session_timers:
-                old_timer = self.session_timers[session_id]
-                if old_timer.get('task') and not old_timer['task'].done():
-                    old_timer['task'].cancel()
+            self.scheduler.schedule(('timer_expire', session_id), deadline_monotonic,
+                                    lambda: self.on_session_timer_expired(session_id))
+            self.schedule_timer_resync(session_id)
             
-            # Criar nova tarefa de timer
-            timer_task = asyncio.create_task(self.run_session_timer(session_id, total_seconds))
-            timer_info['task'] = timer_task
-            self.session_timers[session_id] = timer_info
+            timer_logger.info(f"[SERVER_TIMER] Timer iniciado para sessão {session_id}: {duration_minutes}min ({total_seconds}s)")
             
-            logger.info(f"[SERVER_TIMER] Timer iniciado para sessão {session_id}: {duration_minutes}min ({total_seconds}s)")
+            # Enviar o prazo absoluto uma vez - os clientes contam localmente até à próxima ressincronização
+            await self.send_timer_sync(session_id)
             
         except Exception as e:
             logger.error(f"Erro ao iniciar timer da sessão {session_id}: {e}")
     
-    async def run_session_timer(self, session_id: str, total_seconds: int):
-        """Executa o timer da sessão enviando atualizações a cada segundo"""
-        try:
-            remaining = total_seconds
-            
-            while remaining > 0 and session_id in self.sessions:
-                session = self.sessions.get(session_id)
-                if not session or session.state != GameState.PLAYING:
-                    logger.info(f"[SERVER_TIMER] Sessão {session_id} não está mais a jogar - parando timer")
-                    break
-                
-                # Atualizar info do timer
-                if session_id in self.session_timers:
-                    self.session_timers[session_id]['remaining_seconds'] = remaining
-                
-                # Enviar atualização do timer para todos os jogadores
-                timer_message = {
-                    'type': 'timer_sync',
-                    'time_remaining': remaining,
-                    'source': 'server'
-                }
-                
-                await self.broadcast_to_session(session_id, timer_message)
-                logger.info(f"[SERVER_TIMER] Enviado timer_sync para sessão {session_id}: {remaining}s restantes")
-                
-                # Aguardar 1 segundo
-                await asyncio.sleep(1)
-                remaining -= 1
-            
-            # Timer expirou
-            if remaining <= 0:
-                logger.info(f"[SERVER_TIMER] Timer expirou para sessão {session_id}")
-                await self.handle_session_timeout(session_id)
-            
-        except asyncio.CancelledError:
-            logger.info(f"[SERVER_TIMER] Timer cancelado para sessão {session_id}")
-        except Exception as e:
-            logger.error(f"[SERVER_TIMER] Erro no timer da sessão {session_id}: {e}")
-        finally:
-            # Limpar timer
-            if session_id in self.session_timers:
-                del self.session_timers[session_id]
+    def cancel_session_timer(self, session_id: str):
+        """Cancela os prazos do timer de uma sessão"""
+        self.scheduler.cancel(('timer_expire', session_id))
+        self.scheduler.cancel(('timer_resync', session_id))
+        self.session_timers.pop(session_id, None)
+    
+    def get_session_time_remaining(self, session_id: str) -> int:
+        """Segundos restantes do timer de uma sessão (0 se não houver timer)"""
+        timer_info = self.session_timers.get(session_id)
+        if not timer_info:
+            return 0
+        return max(0, int(round(timer_info['deadline_monotonic'] - self.scheduler.now())))
+    
+    def schedule_timer_resync(self, session_id: str):
+        """Agenda a próxima ressincronização de baixa frequência do timer"""
+        timer_info = self.session_timers.get(session_id)
+        if not timer_info:
+            return
+        next_resync = self.scheduler.now() + TIMER_RESYNC_INTERVAL
+        if next_resync < timer_info['deadline_monotonic']:
+            self.scheduler.schedule(('timer_resync', session_id), next_resync,
+                                    lambda: self.on_timer_resync(session_id))
+    
+    async def send_timer_sync(self, session_id: str):
+        """Envia o prazo absoluto e o tempo restante para todos os jogadores da sessão"""
+        timer_info = self.session_timers.get(session_id)
+        if not timer_info:
+            return
+        
+        remaining = self.get_session_time_remaining(session_id)
+        await self.broadcast_to_session(session_id, {
+            'type': 'timer_sync',
+            'time_remaining': remaining,
+            'deadline': timer_info['deadline'],
+            'resync_interval': TIMER_RESYNC_INTERVAL,
+            'source': 'server'
+        })
+        timer_logger.debug(f"[SERVER_TIMER] Enviado timer_sync para sessão {session_id}: {remaining}s restantes")
+    
+    async def on_timer_resync(self, session_id: str):
+        """Prazo de ressincronização: reenviar timer_sync e agendar o próximo"""
+        session = self.sessions.get(session_id)
+        if not session or session.state != GameState.PLAYING:
+            timer_logger.info(f"[SERVER_TIMER] Sessão {session_id} não está mais a jogar - parando timer")
+            self.cancel_session_timer(session_id)
+            return
+        
+        self.schedule_timer_resync(session_id)
+        await self.send_timer_sync(session_id)
+    
+    async def on_session_timer_expired(self, session_id: str):
+        """Prazo final do timer da sessão"""
+        self.scheduler.cancel(('timer_resync', session_id))
+        self.session_timers.pop(session_id, None)
+        
+        session = self.sessions.get(session_id)
+        if not session or session.state != GameState.PLAYING:
+            timer_logger.info(f"[SERVER_TIMER] Sessão {session_id} não está mais a jogar - timer ignorado")
+            return
+        
+        timer_logger.info(f"[SERVER_TIMER] Timer expirou para sessão {session_id}")
+        await self.handle_session_timeout(session_id)
     
     async def handle_session_timeout(self, session_id: str):
         """Lida com o timeout de uma sessão"""
@@ -1083,14 +2613,16 @@ class NetMasterServer:
             if not session:
                 return
             
-            logger.info(f"[SERVER_TIMER] Sessão {session_id} expirou por timeout")
+            timer_logger.info(f"[SERVER_TIMER] Sessão {session_id} expirou por timeout")
             
             # Marcar como processado pelo timer para evitar processamento duplo pelo cleanup
             session.timer_finished = True
-            logger.info(f"[SERVER_TIMER] Sessão {session_id} marcada como timer_finished")
+            timer_logger.info(f"[SERVER_TIMER] Sessão {session_id} marcada como timer_finished")
             
             # Marcar sessão como expirada
             session.state = GameState.EXPIRED
+            session.touch()
+            self.persist_session(session_id)
             
             # CORREÇÃO: Calcular vencedor e enviar game_finished ao invés de session_timeout
             if len(session.players) > 0:
@@ -1109,7 +2641,7 @@ class NetMasterServer:
                     }
                     
                     await self.broadcast_to_session(session_id, game_finished_message)
-                    logger.info(f"[SERVER_TIMER] ✓ Enviado game_finished para sessão {session_id}")
+                    timer_logger.info(f"[SERVER_TIMER] ✓ Enviado game_finished para sessão {session_id}")
                     
                     # Aguardar um pouco para garantir que a mensagem é entregue
                     await asyncio.sleep(2)
@@ -1122,7 +2654,7 @@ class NetMasterServer:
                     }
                     
                     await self.broadcast_to_session(session_id, fallback_message)
-                    logger.info(f"[SERVER_TIMER] ✓ Enviado game_finished (fallback) para sessão {session_id}")
+                    timer_logger.info(f"[SERVER_TIMER] ✓ Enviado game_finished (fallback) para sessão {session_id}")
             
             # Remover sessão após algum tempo
             await asyncio.sleep(3)
@@ -1138,24 +2670,25 @@ class NetMasterServer:
                 session = self.sessions[session_id]
                 
                 # Remover jogadores do mapeamento
-                for player_id in list(session.players.keys()):
+                for player_id, player in list(session.players.items()):
+                    self.scheduler.cancel(('resume_grace', player_id))
+                    self.registry.unbind_player(player_id, session_id, player.color.value)
                     if player_id in self.player_to_session:
                         del self.player_to_session[player_id]
                 
                 # Remover sessão
                 del self.sessions[session_id]
+                self.stop_recording(session_id)
+                self.drop_spectators(session_id)
+                self.persist_session(session_id)
                 
-                # Cancelar timer se existir
-                if session_id in self.session_timers:
-                    timer_info = self.session_timers[session_id]
-                    if timer_info.get('task') and not timer_info['task'].done():
-                        timer_info['task'].cancel()
-                    del self.session_timers[session_id]
+                # Cancelar timer e restantes prazos da sessão
+                self.cancel_session_deadlines(session_id)
                 
-                logger.info(f"[SERVER_TIMER] Sessão {session_id} removida completamente")
+                timer_logger.info(f"[SERVER_TIMER] Sessão {session_id} removida completamente")
                 
                 # Atualizar lista de sessões
-                await self.broadcast_session_list_update()
+                await self.broadcast_session_list_update(session_id)
                 
         except Exception as e:
             logger.error(f"Erro ao limpar sessão {session_id}: {e}")
@@ -1164,7 +2697,7 @@ class NetMasterServer:
         """Handler para timer_sync - agora controlado pelo servidor, ignora tentativas dos clientes"""
         try:
             # O timer é agora controlado pelo servidor, ignorar tentativas dos clientes
-            logger.info(f"[SERVER_TIMER] Cliente {client_id} tentou enviar timer_sync - ignorado (timer controlado pelo servidor)")
+            timer_logger.info(f"[SERVER_TIMER] Cliente {client_id} tentou enviar timer_sync - ignorado (timer controlado pelo servidor)")
             
             # Enviar resposta informativa
             await self.send_message(websocket, {
@@ -1191,44 +2724,41 @@ class NetMasterServer:
             card_path = card_data.get('card_path', '')
             card_type = card_data.get('card_type', '')
             
-            logger.info(f"[RETURN_TO_STORE] Devolvendo carta à Store:")
-            logger.info(f"[RETURN_TO_STORE]   Carta: {card_path}")
-            logger.info(f"[RETURN_TO_STORE]   Tipo: {card_type}")
-            logger.info(f"[RETURN_TO_STORE]   Sessão: {session_id}")
+            card_logger.info(f"[RETURN_TO_STORE] Devolvendo carta à Store:")
+            card_logger.info(f"[RETURN_TO_STORE]   Carta: {card_path}")
+            card_logger.info(f"[RETURN_TO_STORE]   Tipo: {card_type}")
+            card_logger.info(f"[RETURN_TO_STORE]   Sessão: {session_id}")
             
             # Obter a sessão
             if session_id not in self.sessions:
-                logger.error(f"[RETURN_TO_STORE] Sessão {session_id} não encontrada")
+                card_logger.error(f"[RETURN_TO_STORE] Sessão {session_id} não encontrada")
                 return False
                 
             session = self.sessions[session_id]
             
-            # Devolver carta ao baralho correspondente na Store da sessão
-            if card_type == 'actions':
-                # Actions voltam para o baralho Actions da Store
-                if not hasattr(session, 'store_actions_deck'):
-                    session.store_actions_deck = []
-                session.store_actions_deck.append(card_path)
-                logger.info(f"[RETURN_TO_STORE] Action devolvida ao baralho Actions da Store")
-                
-            elif card_type == 'events':
-                # Events voltam para o baralho Events da Store  
-                if not hasattr(session, 'store_events_deck'):
-                    session.store_events_deck = []
-                session.store_events_deck.append(card_path)
-                logger.info(f"[RETURN_TO_STORE] Event devolvido ao baralho Events da Store")
-                
-            else:
-                logger.error(f"[RETURN_TO_STORE] Tipo de carta desconhecido: {card_type}")
+            # Devolver carta ao fundo do baralho (cor, tipo) de onde saiu
+            if card_type not in netmaster_engine.CARD_TYPES or not card_path:
+                card_logger.error(f"[RETURN_TO_STORE] Tipo de carta desconhecido: {card_type}")
                 return False
-            
-            logger.info(f"[RETURN_TO_STORE] SUCCESS: Carta devolvida com sucesso")
+            card_path = netmaster_engine.relative_card_path(card_path)
+            color = card_data.get('card_color')
+            if color not in netmaster_engine.COLORS:
+                color = netmaster_engine.card_color(card_path)
+            deck = session.decks().return_card(color, card_type, card_path)
+            self.persist_deck_op(session_id, session)
+            card_logger.info(f"[RETURN_TO_STORE] Carta devolvida ao baralho {deck} da Store")
+            
+            card_logger.info(f"[RETURN_TO_STORE] SUCCESS: Carta devolvida com sucesso")
             return True
             
         except Exception as e:
-            logger.error(f"[RETURN_TO_STORE] ERRO: {e}")
+            card_logger.error(f"[RETURN_TO_STORE] ERRO: {e}")
             return False
     
+    def persist_deck_op(self, session_id: str, session: GameSession):
+        """Regista no WAL a última operação sobre os baralhos da sessão"""
+        self.persist('deck', session_id, entry=list(session.engine.log[-1]))
+    
     async def handle_store_card_for_player(self, client_id: str, websocket, data: dict):
         """NOVO SISTEMA: Handler para armazenar carta no servidor para entrega posterior"""
         try:
@@ -1238,40 +2768,36 @@ class NetMasterServer:
             target_player_id = data.get('target_player_id')
             card_data = data.get('card_data', {})
             
-            logger.info(f"[CARD_STORAGE] Armazenando carta de {sender_color} para {target_player_color}")
-            logger.info(f"[CARD_STORAGE] Carta: {card_data.get('card_path', 'Unknown')}")
+            card_logger.info(f"[CARD_STORAGE] Armazenando carta de {sender_color} para {target_player_color}")
+            card_logger.info(f"[CARD_STORAGE] Carta: {card_data.get('card_path', 'Unknown')}")
             
             # Verificar dados necessários
             if not all([sender_player_id, sender_color, target_player_color, card_data]):
-                logger.error(f"[CARD_STORAGE] Dados incompletos")
+                card_logger.error(f"[CARD_STORAGE] Dados incompletos")
                 await self.send_error(websocket, "Dados incompletos para armazenar carta")
                 return
             
             # Encontrar a sessão do jogador remetente
             session_id = self.player_to_session.get(sender_player_id)
             if not session_id or session_id not in self.sessions:
-                logger.error(f"[CARD_STORAGE] Sessão não encontrada para jogador {sender_color}")
+                card_logger.error(f"[CARD_STORAGE] Sessão não encontrada para jogador {sender_color}")
                 await self.send_error(websocket, "Sessão não encontrada")
                 return
             
             session = self.sessions[session_id]
             
-            # Verificar se o jogador alvo existe na mesma sessão
-            target_player_found = False
-            for player in session.players.values():
-                if player.color.value == target_player_color:
-                    target_player_found = True
-                    break
+            # Verificar se o jogador alvo existe na mesma sessão (lookup O(1) por cor)
+            target_player_found = self.registry.find_player(session_id, target_player_color) in session.players
             
             if not target_player_found:
-                logger.error(f"[CARD_STORAGE] Jogador alvo {target_player_color} não encontrado na sessão")
-                logger.info(f"[CARD_STORAGE] SOLUÇÃO: Devolvendo carta ao baralho da Store")
+                card_logger.error(f"[CARD_STORAGE] Jogador alvo {target_player_color} não encontrado na sessão")
+                card_logger.info(f"[CARD_STORAGE] SOLUÇÃO: Devolvendo carta ao baralho da Store")
                 
                 # CORREÇÃO CRÍTICA: Devolver carta à Store em vez de perder
                 success = self.return_card_to_store(card_data, session_id)
                 
                 if success:
-                    logger.info(f"[CARD_STORAGE] SUCCESS: Carta devolvida à Store com sucesso")
+                    card_logger.info(f"[CARD_STORAGE] SUCCESS: Carta devolvida à Store com sucesso")
                     await self.send_message(websocket, {
                         'type': 'card_returned_to_store',
                         'reason': 'target_player_not_in_session',
@@ -1281,62 +2807,155 @@ class NetMasterServer:
                         'status': 'returned_to_store'
                     })
                 else:
-                    logger.error(f"[CARD_STORAGE] ERRO: Falha ao devolver carta à Store")
+                    card_logger.error(f"[CARD_STORAGE] ERRO: Falha ao devolver carta à Store")
                     await self.send_error(websocket, "Failed to return card to store")
                 
                 return
             
-            # Armazenar carta na sessão
-            session.store_card_for_player(target_player_color, card_data)
+            # Armazenar carta na caixa de correio do destinatário (só sai com o ack)
+            envelope = session.store_card_for_player(target_player_color, card_data)
+            self.persist('card_stored', session_id, color=target_player_color, card=mailbox_record(envelope))
             
             # Confirmar sucesso para o remetente
             await self.send_message(websocket, {
                 'type': 'card_stored_confirmation',
                 'target_player_color': target_player_color,
                 'card_type': card_data.get('card_type', 'Unknown'),
+                'delivery_id': envelope['delivery_id'],
                 'status': 'stored',
                 'message': f"Carta armazenada para {target_player_color}"
             })
             
+            # Entregar de imediato se o destinatário estiver ligado
+            await self.deliver_pending_cards(session_id, target_player_color, 'arrival', [envelope])
+            
         except Exception as e:
-            logger.error(f"[CARD_STORAGE] Erro ao armazenar carta: {e}")
+            card_logger.error(f"[CARD_STORAGE] Erro ao armazenar carta: {e}")
             await self.send_error(websocket, f"Erro ao armazenar carta: {str(e)}")
     
-    async def handle_get_pending_cards(self, client_id: str, websocket, data: dict):
-        """NOVO SISTEMA: Handler para obter cartas pendentes de um jogador"""
+    async def handle_get_pending_cards(self, client_id: str, websocket, data: dict):
+        """NOVO SISTEMA: Handler para obter cartas pendentes de um jogador"""
+        try:
+            player_id = data.get('player_id')
+            player_color = data.get('player_color')
+            
+            card_logger.info(f"[CARD_DELIVERY] Solicitação de cartas pendentes de {player_color}")
+            
+            # Verificar dados necessários
+            if not all([player_id, player_color]):
+                card_logger.error(f"[CARD_DELIVERY] Dados incompletos")
+                await self.send_error(websocket, "Dados incompletos para obter cartas")
+                return
+            
+            # Encontrar a sessão do jogador
+            session_id = self.player_to_session.get(player_id)
+            if not session_id or session_id not in self.sessions:
+                card_logger.error(f"[CARD_DELIVERY] Sessão não encontrada para jogador {player_color}")
+                await self.send_error(websocket, "Sessão não encontrada")
+                return
+            
+            session = self.sessions[session_id]
+            
+            # Cartas por confirmar - só saem da caixa de correio com ack_pending_cards.
+            # O poll não conta como tentativa: o cliente está vivo e o ack pode ainda estar a caminho
+            envelopes = session.get_pending_cards(player_color)
+            if envelopes:
+                card_logger.info(f"[CARD_DELIVERY] Entregando {len(envelopes)} cartas pendentes para jogador {player_color}")
+            await self.send_message(websocket, self.mailbox_message(session_id, envelopes, 'poll'))
+            
+        except Exception as e:
+            card_logger.error(f"[CARD_DELIVERY] Erro ao obter cartas pendentes: {e}")
+            await self.send_error(websocket, f"Erro ao obter cartas pendentes: {str(e)}")
+    
+    def mailbox_message(self, session_id: str, envelopes: List[Dict], source: str) -> dict:
+        """Mensagem pending_cards com os envelopes"""
+        return {
+            'type': 'pending_cards',
+            'session_id': session_id,
+            'cards': [delivery_card(envelope) for envelope in envelopes],
+            'delivery_ids': [envelope['delivery_id'] for envelope in envelopes],
+            'source': source  # 'arrival', 'turn', 'resume' ou 'poll'
+        }
+    
+    async def deliver_pending_cards(self, session_id: str, player_color: str, source: str,
+                                    envelopes: Optional[List[Dict]] = None) -> int:
+        """Push das cartas por confirmar para o dono da caixa de correio (se estiver ligado)"""
+        session = self.sessions.get(session_id)
+        if not session:
+            return 0
+        player = session.players.get(self.registry.find_player(session_id, player_color))
+        if player is None or player.websocket is None or not player.connected:
+            return 0  # Fica na caixa: entregue no próximo turno, na retoma ou por get_pending_cards
+        if envelopes is None:
+            envelopes = session.get_pending_cards(player_color)
+        
+        # Cartas que já foram enviadas demasiadas vezes sem ack voltam à Store
+        exhausted = [envelope for envelope in envelopes if envelope.get('attempts', 0) >= MAILBOX_MAX_ATTEMPTS]
+        if exhausted:
+            card_logger.warning(f"[CARD_DELIVERY] {len(exhausted)} cartas para {player_color} sem ack após "
+                                f"{MAILBOX_MAX_ATTEMPTS} envios - devolvendo à Store")
+            self.return_pending_cards_to_store(session_id, player_color, exhausted)
+            envelopes = [envelope for envelope in envelopes if envelope not in exhausted]
+        if not envelopes:
+            return 0
+        
+        # Só os envios do servidor contam para MAILBOX_MAX_ATTEMPTS (os polls do cliente não)
+        for envelope in envelopes:
+            envelope['attempts'] = envelope.get('attempts', 0) + 1
+        await self.send_message(player.websocket, self.mailbox_message(session_id, envelopes, source))
+        metrics.count_card_deliveries('pushed', len(envelopes))
+        return len(envelopes)
+    
+    def return_pending_cards_to_store(self, session_id: str, player_color: str,
+                                      envelopes: Optional[List[Dict]] = None) -> int:
+        """Devolve à Store cartas que não podem ser entregues (todas as da cor se envelopes=None)"""
+        session = self.sessions.get(session_id)
+        if not session:
+            return 0
+        if envelopes is None:
+            envelopes = session.take_pending_cards(player_color)
+            if envelopes:
+                self.persist('cards_taken', session_id, color=player_color)
+        else:
+            delivery_ids = {envelope['delivery_id'] for envelope in envelopes}
+            envelopes = session.ack_pending_cards(player_color, delivery_ids)
+            if envelopes:
+                self.persist('cards_acked', session_id, color=player_color, delivery_ids=sorted(delivery_ids))
+        
+        for envelope in envelopes:
+            self.return_card_to_store(envelope['card'], session_id)
+        if envelopes:
+            metrics.count_card_deliveries('returned_to_store', len(envelopes))
+            card_logger.info(f"[CARD_DELIVERY] {len(envelopes)} cartas de {player_color} devolvidas à Store")
+        return len(envelopes)
+    
+    async def handle_ack_pending_cards(self, client_id: str, websocket, data: dict):
+        """Confirmação do cliente: as cartas entregues saem da caixa de correio"""
         try:
             player_id = data.get('player_id')
-            player_color = data.get('player_color')
-            
-            logger.info(f"[CARD_DELIVERY] Solicitação de cartas pendentes de {player_color}")
-            
-            # Verificar dados necessários
-            if not all([player_id, player_color]):
-                logger.error(f"[CARD_DELIVERY] Dados incompletos")
-                await self.send_error(websocket, "Dados incompletos para obter cartas")
-                return
-            
-            # Encontrar a sessão do jogador
             session_id = self.player_to_session.get(player_id)
-            if not session_id or session_id not in self.sessions:
-                logger.error(f"[CARD_DELIVERY] Sessão não encontrada para jogador {player_color}")
+            session = self.sessions.get(session_id) if session_id else None
+            if not session or player_id not in session.players:
                 await self.send_error(websocket, "Sessão não encontrada")
                 return
             
-            session = self.sessions[session_id]
-            
-            # Obter cartas pendentes
-            pending_cards = session.get_pending_cards(player_color)
+            player_color = session.players[player_id].color.value
+            delivery_ids = {delivery_id for delivery_id in data['delivery_ids'] if isinstance(delivery_id, int)}
+            acked = session.ack_pending_cards(player_color, delivery_ids)
+            if not acked:
+                return  # Ack repetido (reentrega) - nada a fazer
             
-            # Enviar resposta com cartas pendentes
-            await self.send_message(websocket, {
-                'type': 'pending_cards',
-                'cards': pending_cards
-            })
+            self.persist('cards_acked', session_id, color=player_color,
+                         delivery_ids=[envelope['delivery_id'] for envelope in acked])
+            now = time.time()
+            for envelope in acked:
+                metrics.card_delivery_latency.observe(max(0.0, now - envelope['stored_at']))
+            metrics.count_card_deliveries('acked', len(acked))
+            card_logger.info(f"[CARD_DELIVERY] {player_color} confirmou {len(acked)} cartas")
             
         except Exception as e:
-            logger.error(f"[CARD_DELIVERY] Erro ao obter cartas pendentes: {e}")
-            await self.send_error(websocket, f"Erro ao obter cartas pendentes: {str(e)}")
+            card_logger.error(f"[CARD_DELIVERY] Erro ao processar ack de cartas: {e}")
+            await self.send_error(websocket, f"Erro ao confirmar cartas: {str(e)}")
     
     async def handle_update_player_score(self, client_id: str, websocket, data: dict):
         """Atualiza o saldo/score de um jogador"""
@@ -1371,6 +2990,8 @@ class NetMasterServer:
             # Atualizar o saldo do jogador no servidor
             old_score = player.score
             player.score = new_score
+            session.touch()
+            self.persist('player', session_id, player_id=player_id, fields={'score': new_score})
             
             logger.info(f"[SCORE_SYNC] ✓ Saldo atualizado: {player.name} ({player_id}): {old_score} → {new_score}")
             
@@ -1399,19 +3020,66 @@ class NetMasterServer:
         
         # Implementar lógica específica baseada no tipo de ação
         if action_type == "move":
-            # Movimento no tabuleiro
-            new_position = action_data.get('position', player.position)
+            # Movimento no tabuleiro: 'steps' calculado no servidor, ou 'position' absoluta (clientes antigos)
+            steps = action_data.get('steps')
+            if isinstance(steps, int) and not isinstance(steps, bool):
+                new_position = netmaster_engine.advance(player.position, steps)
+            else:
+                new_position = action_data.get('position', player.position)
             player.position = new_position
+            session.touch()
+            self.persist('player', session_id, player_id=player_id, fields={'position': new_position})
+            if isinstance(new_position, int):
+                return {'new_position': new_position, 'square': netmaster_engine.square(new_position)}
             return {'new_position': new_position}
         
+        elif action_type == "draw_card":
+            # Carta tirada no servidor: do baralho pedido ou do da casa onde o jogador está
+            card_type, color = self.deck_from_action(player, action_data)
+            drawn = session.decks().draw(color, card_type)
+            if drawn is None:
+                raise ValueError(f"Baralho {color}/{card_type} vazio")
+            self.persist_deck_op(session_id, session)
+            deck, card_path = drawn
+            card_logger.info(f"[DECKS] {player.name} tirou {card_path} do baralho {deck}")
+            return {'card_path': card_path, 'card_type': card_type, 'deck': deck}
+        
+        elif action_type == "return_card":
+            # Carta devolvida ao fundo do baralho de onde saiu
+            card_data = {'card_path': action_data.get('card_path', ''), 'card_type': action_data.get('card_type', ''),
+                         'card_color': action_data.get('color')}
+            if not self.return_card_to_store(card_data, session_id):
+                raise ValueError("Carta inválida")
+            return {'returned': True}
+        
+        elif action_type == "store_inventory":
+            # Cartas restantes por tipo e cor; com card_type, também as primeiras cartas desse baralho
+            engine = session.decks()
+            result = {'inventory': engine.inventory()}
+            if 'card_type' in action_data:
+                card_type, color = self.deck_from_action(player, action_data)
+                limit = action_data.get('limit', STORE_PAGE_LIMIT)
+                limit = min(limit, STORE_PAGE_LIMIT) if isinstance(limit, int) else STORE_PAGE_LIMIT
+                result['cards'] = engine.top(color, card_type, limit)
+            return result
+        
         elif action_type == "buy_card":
-            # Compra de carta
+            # Compra de carta (com card_path, a carta sai do baralho da Store da sessão)
             card_id = action_data.get('card_id')
             cost = action_data.get('cost', 0)
             
             if player.score >= cost:
+                card_path = action_data.get('card_path')
+                if isinstance(card_path, str):
+                    card_type, color = self.deck_from_action(player, action_data)
+                    card_path = netmaster_engine.relative_card_path(card_path)
+                    if session.decks().take(color, card_type, card_path) is None:
+                        raise ValueError("Carta já não está disponível na Store")
+                    self.persist_deck_op(session_id, session)
                 player.score -= cost
-                return {'card_purchased': card_id, 'new_score': player.score}
+                session.touch()
+                self.persist('player', session_id, player_id=player_id, fields={'score': player.score})
+                return {'card_purchased': card_id, 'card_path': card_path, 'new_score': player.score}
             else:
                 raise ValueError("Saldo insuficiente")
         
@@ -1431,6 +3099,7 @@ class NetMasterServer:
                 
                 next_player_id = session.next_turn()
                 next_player = session.get_current_player()
+                self.persist('turn', session_id, index=session.current_turn_index)
                 
                 logger.info(f"Próximo jogador: {next_player_id} ({next_player.name if next_player else 'Unknown'})")
                 logger.info(f"Novo turn index: {session.current_turn_index}")
@@ -1447,6 +3116,8 @@ class NetMasterServer:
                 
                 logger.info(f"Enviando turn_changed: {turn_changed_message}")
                 await self.broadcast_to_session(session_id, turn_changed_message)
+                if next_player:
+                    await self.deliver_pending_cards(session_id, next_player.color.value, 'turn')
                 
                 return {
                     'message': 'Turno finalizado',
@@ -1460,6 +3131,16 @@ class NetMasterServer:
         else:
             return {'message': f'Ação {action_type} processada'}
     
+    def deck_from_action(self, player: Player, action_data: dict) -> tuple:
+        """(tipo, cor) do baralho de uma ação - por omissão o da casa onde o jogador está"""
+        square_type, square_color = netmaster_engine.square(player.position) if isinstance(player.position, int) \
+            else (None, netmaster_engine.NEUTRAL)
+        card_type = action_data.get('card_type', square_type)
+        color = action_data.get('color', square_color)
+        if card_type not in netmaster_engine.CARD_TYPES or color not in netmaster_engine.COLORS:
+            raise ValueError(f"Baralho inválido: {color}/{card_type}")
+        return card_type, color
+    
     def is_websocket_closed(self, websocket):
         """Verifica se websocket está fechado (compatível com diferentes versões)"""
         try:
@@ -1473,33 +3154,38 @@ class NetMasterServer:
                 # Fallback: assumir que está aberto
                 return False
     
-    async def send_message(self, websocket, message: dict):
-        """Envia mensagem para um websocket"""
+    async def send_message(self, websocket, message):
+        """Envia mensagem (dict ou EncodedFrame já serializado) para um websocket"""
+        frame = None
+        message_type = 'UNKNOWN'
         try:
-            message_type = message.get('type', 'UNKNOWN')
+            # Serializar uma única vez - a serialização também valida a mensagem
+            frame = message if isinstance(message, EncodedFrame) else EncodedFrame.encode(message)
+            message_type = frame.type
             
             # Log especial para session_joined
             if message_type == 'session_joined':
                 logger.info(f"*** SEND_MESSAGE: Enviando SESSION_JOINED ***")
                 logger.info(f"*** WEBSOCKET: {websocket} ***")
                 logger.info(f"*** WEBSOCKET CLOSED: {self.is_websocket_closed(websocket)} ***")
-                logger.info(f"*** MESSAGE: {message} ***")
+                logger.info(f"*** JSON_MESSAGE: {frame.data[:200]}... ***")
             
             # Verificar se websocket ainda está aberto
             if self.is_websocket_closed(websocket):
-                logger.error(f"SEND_MESSAGE: WebSocket está fechado - não é possível enviar")
+                broadcast_logger.error(f"SEND_MESSAGE: WebSocket está fechado - não é possível enviar")
                 raise websockets.exceptions.ConnectionClosed(None, None)
             
-            # Testar serialização JSON antes de enviar
-            json_message = json.dumps(message)
-            
-            if message_type == 'session_joined':
-                logger.info(f"*** JSON_MESSAGE: {json_message[:200]}... ***")
-            
-            # Enviar com timeout
-            logger.info(f"*** INICIANDO WEBSOCKET.SEND() PARA {message_type} ***")
-            await asyncio.wait_for(websocket.send(json_message), timeout=5.0)
-            logger.info(f"*** WEBSOCKET.SEND() COMPLETADO PARA {message_type} ***")
+            outbound = self.outbound_queues.get(websocket)
+            if outbound:
+                # Enfileirar na fila da ligação - a tarefa de escrita faz o envio
+                if not outbound.put(message_type, frame.for_codec(outbound.codec)):
+                    raise websockets.exceptions.ConnectionClosed(None, None)
+            else:
+                # Ligação sem fila (não registada) - enviar diretamente com timeout
+                logger.info(f"*** INICIANDO WEBSOCKET.SEND() PARA {message_type} ***")
+                await asyncio.wait_for(websocket.send(frame.data), timeout=OUTBOUND_SEND_TIMEOUT)
+                metrics.count_outbound(message_type, len(frame.data))
+                logger.info(f"*** WEBSOCKET.SEND() COMPLETADO PARA {message_type} ***")
             
             if message_type == 'session_joined':
                 logger.info(f"*** SESSION_JOINED ENVIADO COM SUCESSO! ***")
@@ -1512,24 +3198,58 @@ class NetMasterServer:
                     logger.info("*** POST-SEND: WEBSOCKET STATE: Não disponível ***")
             
         except asyncio.TimeoutError:
-            logger.error(f"SEND_MESSAGE: Timeout ao enviar mensagem tipo {message.get('type', 'UNKNOWN')}")
+            broadcast_logger.error(f"SEND_MESSAGE: Timeout ao enviar mensagem tipo {message_type}")
             raise Exception("Timeout ao enviar mensagem")
         except websockets.exceptions.ConnectionClosed:
-            logger.error(f"SEND_MESSAGE: Conexão WebSocket fechada para mensagem tipo {message.get('type', 'UNKNOWN')}")
+            broadcast_logger.error(f"SEND_MESSAGE: Conexão WebSocket fechada para mensagem tipo {message_type}")
             raise Exception("Conexão WebSocket fechada")
         except TypeError as json_error:
-            logger.error(f"SEND_MESSAGE: Erro de serialização JSON: {json_error}")
-            logger.error(f"SEND_MESSAGE: Mensagem problemática: {message}")
+            broadcast_logger.error(f"SEND_MESSAGE: Erro de serialização JSON: {json_error}")
+            broadcast_logger.error(f"SEND_MESSAGE: Mensagem problemática: {message}")
             raise json_error
         except Exception as e:
-            logger.error(f"SEND_MESSAGE: Erro geral ao enviar mensagem: {e}")
+            broadcast_logger.error(f"SEND_MESSAGE: Erro geral ao enviar mensagem: {e}")
             raise e
     
-    async def send_error(self, websocket, error_message: str):
-        """Envia mensagem de erro"""
+    def enqueue_message(self, websocket, message) -> bool:
+        """Enfileira mensagem (dict ou EncodedFrame) sem aguardar - usado pelo fan-out das sessões"""
+        outbound = self.outbound_queues.get(websocket)
+        if not outbound:
+            return False
+        try:
+            frame = message if isinstance(message, EncodedFrame) else EncodedFrame.encode(message)
+        except TypeError as json_error:
+            broadcast_logger.error(f"[OUTBOUND] Erro de serialização JSON: {json_error}")
+            return False
+        return outbound.put(frame.type, frame.for_codec(outbound.codec))
+    
+    def native_broadcast(self, recipients: list, frame: EncodedFrame):
+        """websockets.broadcast agrupado por codec (um envio nativo por codec em uso)"""
+        by_codec: Dict[str, list] = {}
+        for websocket in recipients:
+            outbound = self.outbound_queues.get(websocket)
+            codec = outbound.codec if outbound else netmaster_codec.CODEC_JSON
+            by_codec.setdefault(codec, []).append(websocket)
+        for codec, group in by_codec.items():
+            payload = frame.for_codec(codec)
+            websockets.broadcast(group, payload)
+            metrics.count_outbound(frame.type, len(payload), len(group))
+    
+    def get_outbound_stats(self) -> List[dict]:
+        """Estatísticas das filas de saída de todas as ligações"""
+        return [outbound.snapshot() for outbound in self.outbound_queues.values()]
+    
+    def get_connection_stats(self) -> Dict[str, dict]:
+        """Estado das ligações (RTT do keepalive, tempo ligado e inativo) por client_id"""
+        now = time.monotonic()
+        return {client_id: state.snapshot(now) for client_id, state in self.registry.states.items()}
+    
+    async def send_error(self, websocket, error_message: str, **fields):
+        """Envia mensagem de erro (fields extra, ex: action_type para o cliente associar ao pedido)"""
         await self.send_message(websocket, {
             'type': 'error',
             'message': error_message,
+            **fields,
             'timestamp': time.time()
         })
     
@@ -1537,66 +3257,254 @@ class NetMasterServer:
         """Envia mensagem para todos os jogadores de uma sessão"""
         session = self.sessions.get(session_id)
         if not session:
-            logger.error(f"BROADCAST_ERROR: Sessão {session_id} não encontrada")
+            broadcast_logger.error(f"BROADCAST_ERROR: Sessão {session_id} não encontrada")
             return
         
-        logger.info(f"BROADCAST_TO_SESSION: Enviando {message.get('type')} para sessão {session_id}")
-        logger.info(f"BROADCAST_TO_SESSION: Players na sessão: {list(session.players.keys())}")
-        logger.info(f"BROADCAST_TO_SESSION: Exclude player: {exclude_player}")
+        verbose = broadcast_logger.isEnabledFor(logging.DEBUG)
+        if verbose:
+            broadcast_logger.debug(f"BROADCAST_TO_SESSION: Players na sessão: {list(session.players.keys())}, exclude: {exclude_player}")
         
+        # Serializar uma única vez - o mesmo frame é partilhado por todos os destinatários
+        # e fica no buffer de replay da sessão com o seu número de sequência
+        try:
+            frame = session.replay.record(message, exclude_player)
+        except TypeError as json_error:
+            broadcast_logger.error(f"BROADCAST_TO_SESSION: Erro de serialização JSON: {json_error}")
+            return
+        
+        start = time.perf_counter()
+        if BROADCAST_MODE == "native":
+            recipients = [player.websocket for player_id, player in session.players.items()
+                          if player_id != exclude_player and player.websocket and player.connected]
+            self.native_broadcast(recipients, frame)
+            metrics.observe_fanout('session', time.perf_counter() - start)
+            broadcast_logger.info(f"BROADCAST_TO_SESSION: {frame.type} para sessão {session_id} ({len(recipients)} destinatários)")
+            return
+        
+        sent = 0
         for player_id, player in session.players.items():
             if exclude_player and player_id == exclude_player:
-                logger.info(f"BROADCAST_TO_SESSION: Pulando player excluído: {player_id}")
+                if verbose:
+                    broadcast_logger.debug(f"BROADCAST_TO_SESSION: Pulando player excluído: {player_id}")
                 continue
             
-            logger.info(f"BROADCAST_TO_SESSION: Tentando enviar para {player.name} (ID: {player_id})")
-            logger.info(f"BROADCAST_TO_SESSION: - WebSocket exists: {player.websocket is not None}")
-            logger.info(f"BROADCAST_TO_SESSION: - Player connected: {player.connected}")
-            
             if player.websocket and player.connected:
                 try:
-                    await self.send_message(player.websocket, message)
-                    logger.info(f"BROADCAST_TO_SESSION: Mensagem enviada para {player.name}")
+                    await self.send_message(player.websocket, frame)
+                    sent += 1
+                    if verbose:
+                        broadcast_logger.debug(f"BROADCAST_TO_SESSION: Mensagem enviada para {player.name} (ID: {player_id})")
                 except Exception as send_error:
-                    logger.error(f"BROADCAST_TO_SESSION: ❌ Erro ao enviar para {player.name}: {send_error}")
+                    broadcast_logger.error(f"BROADCAST_TO_SESSION: ❌ Erro ao enviar para {player.name}: {send_error}")
                     # Marcar jogador como desconectado
                     player.connected = False
+                    session.touch()
             else:
-                logger.warning(f"BROADCAST_TO_SESSION: Player {player.name} sem websocket ou desconectado")
+                broadcast_logger.warning(f"BROADCAST_TO_SESSION: Player {player.name} sem websocket ou desconectado")
+        
+        metrics.observe_fanout('session', time.perf_counter() - start)
+        broadcast_logger.info(f"BROADCAST_TO_SESSION: {frame.type} para sessão {session_id} ({sent} destinatários)")
     
-    async def broadcast_session_list_update(self):
-        """Envia atualização da lista de sessões para todos os clientes conectados"""
+    async def broadcast_session_list_update(self, *session_ids: str):
+        """
+        Publica alterações do lobby para as sessões indicadas.
+        
+        Os clientes subscritos ao lobby recebem apenas deltas (session_added /
+        session_updated / session_removed) com número de versão. Clientes antigos
+        que nunca subscreveram continuam a receber a lista completa
+        (sessions_list_update) enquanto LOBBY_LEGACY_FULL_LIST estiver ativo.
+        """
         try:
-            available_sessions = []
-            for session in self.sessions.values():
-                if (session.state in [GameState.WAITING, GameState.STARTING] and 
-                    not session.is_expired() and 
-                    not session.is_full()):
-                    try:
-                        session_dict = session.to_dict()
-                        available_sessions.append(session_dict)
-                    except Exception as session_error:
-                        logger.error(f"Erro ao serializar sessão {session.id}: {session_error}")
-                        continue
+            # Sem sessões indicadas: reconciliar o índice com todas as sessões
+            if not session_ids:
+                local_entries = {session_id for session_id in self.lobby.entries
+                                 if not self.shard or self.shard.owns(session_id)}  # Entradas de outros shards não são nossas
+                session_ids = tuple(set(self.sessions) | local_entries)
+            
+            deltas = []
+            for session_id in session_ids:
+                try:
+                    delta = self.lobby.update(session_id, self.sessions.get(session_id))
+                except Exception as session_error:
+                    logger.error(f"Erro ao serializar sessão {session_id}: {session_error}")
+                    continue
+                if delta:
+                    deltas.append(delta)
+            
+            if not deltas:
+                return
+            
+            if self.shard_link:
+                self.shard_link.publish(deltas)
+            
+            await self.publish_lobby_deltas(deltas)
+                    
+        except Exception as e:
+            logger.error(f"Erro geral no broadcast_session_list_update: {e}")
+    
+    async def apply_remote_lobby_deltas(self, deltas: List[dict]):
+        """Aplica deltas do lobby vindos de outros shards (via coordenador) e reenvia aos clientes"""
+        try:
+            local_deltas = [delta for delta in map(self.lobby.apply_remote, deltas) if delta]
+            if local_deltas:
+                await self.publish_lobby_deltas(local_deltas)
+        except Exception as e:
+            logger.error(f"Erro ao aplicar deltas remotos do lobby: {e}")
+    
+    async def publish_lobby_deltas(self, deltas: List[dict]):
+        """Envia deltas aos subscritores do lobby e a lista completa aos clientes antigos"""
+        start = time.perf_counter()
+        try:
+            broadcast_logger.info(f"[LOBBY] {len(deltas)} delta(s) - versão {self.lobby.version}, {len(self.lobby.entries)} sessões disponíveis")
+            
+            # Deltas para os subscritores do lobby (cada delta serializado uma única vez)
+            subscribers = [self.connected_clients[client_id] for client_id in self.lobby.subscribers
+                           if client_id in self.connected_clients]
+            for delta in deltas:
+                frame = EncodedFrame.encode(delta)
+                for websocket in subscribers:
+                    self.enqueue_message(websocket, frame)
+            
+            if not LOBBY_LEGACY_FULL_LIST:
+                return
+            
+            legacy_clients = [(client_id, websocket) for client_id, websocket in self.connected_clients.items()
+                              if client_id not in self.lobby.subscribers]
+            if not legacy_clients:
+                return
             
-            message = {
+            # Lista completa (clientes antigos) construída a partir do índice, sem reserializar sessões
+            frame = EncodedFrame.encode({
                 'type': 'sessions_list_update',
-                'sessions': available_sessions
-            }
+                'sessions': self.lobby.full_list(self.sessions)
+            })
             
-            logger.info(f"Broadcasting lista de sessões: {len(available_sessions)} sessões disponíveis")
+            if BROADCAST_MODE == "native":
+                self.native_broadcast([websocket for _, websocket in legacy_clients], frame)
+                return
             
-            # Enviar para todos os clientes conectados
-            for client_id, websocket in list(self.connected_clients.items()):
+            for client_id, websocket in legacy_clients:
                 try:
-                    await self.send_message(websocket, message)
+                    await self.send_message(websocket, frame)
                 except Exception as send_error:
                     logger.error(f"Erro ao enviar para cliente {client_id}: {send_error}")
-                    # Remover cliente com problema
-                    self.connected_clients.pop(client_id, None)
+                    # A ligação é limpa por cleanup_client quando handle_client termina - removê-la
+                    # aqui perderia a associação ao jogador (e o lugar reservado para a retoma)
                     
         except Exception as e:
-            logger.error(f"Erro geral no broadcast_session_list_update: {e}")
+            logger.error(f"Erro ao publicar deltas do lobby: {e}")
+        finally:
+            metrics.observe_fanout('lobby', time.perf_counter() - start)
+    
+    async def handle_select_codec(self, client_id: str, websocket, data: dict):
+        """Muda o codec de saída da ligação (a confirmação ainda segue no codec anterior)"""
+        codec = data.get('codec')
+        outbound = self.outbound_queues.get(websocket)
+        if codec not in netmaster_codec.available_codecs() or not outbound:
+            await self.send_error(websocket, f"Codec não suportado: {codec}")
+            return
+        
+        await self.send_message(websocket, {'type': 'codec_selected', 'codec': codec})
+        outbound.codec = codec
+        logger.info(f"Cliente {client_id} passou a usar o codec {codec}")
+    
+    async def handle_subscribe_lobby(self, client_id: str, websocket, data: dict):
+        """Subscreve o cliente aos deltas do lobby e envia o snapshot atual"""
+        try:
+            self.lobby.subscribers.add(client_id)
+            broadcast_logger.info(f"[LOBBY] Cliente {client_id} subscreveu o lobby (versão {self.lobby.version})")
+            await self.send_message(websocket, self.lobby.snapshot(self.sessions))
+        except Exception as e:
+            broadcast_logger.error(f"[LOBBY] Erro ao subscrever lobby: {e}")
+            await self.send_error(websocket, f"Erro ao subscrever lobby: {str(e)}")
+    
+    async def handle_unsubscribe_lobby(self, client_id: str, websocket, data: dict):
+        """Cancela a subscrição do lobby"""
+        self.lobby.subscribers.discard(client_id)
+        await self.send_message(websocket, {
+            'type': 'lobby_unsubscribed',
+            'version': self.lobby.version
+        })
+    
+    async def handle_watch_session(self, client_id: str, websocket, data: dict):
+        """Espectador: envia o estado atual da sessão e subscreve a ligação aos broadcasts seguintes"""
+        session_id = data.get('session_id')
+        if self.shard and not self.shard.owns(session_id):
+            await self.send_redirect(websocket, session_id, data)
+            return
+        
+        session = self.sessions.get(session_id)
+        if not session:
+            await self.send_error(websocket, "Sessão não encontrada")
+            return
+        if client_id in self.registry.player_by_client:
+            await self.send_error(websocket, "Jogadores não podem ser espectadores")
+            return
+        
+        self.stop_watching(client_id)  # Uma sessão por ligação
+        group = self.spectators.get(session_id)
+        if group is None:
+            group = session.replay.spectators = self.spectators[session_id] = \
+                SpectatorGroup(session_id, self.enqueue_message, self.scheduler)
+        elif len(group) >= MAX_SPECTATORS_PER_SESSION:
+            await self.send_error(websocket, "Sessão com o máximo de espectadores")
+            return
+        
+        # O estado e o seq atuais seguem antes de qualquer broadcast (o enqueue não cede o loop)
+        timer_info = self.session_timers.get(session_id)
+        await self.send_message(websocket, {
+            'type': 'session_watch',
+            'session': session.to_dict(),
+            'seq': session.replay.seq,
+            'time_remaining': self.get_session_time_remaining(session_id),
+            'deadline': timer_info['deadline'] if timer_info else None,
+            'spectators': len(group) + 1
+        })
+        group.members[client_id] = websocket
+        self.watching[client_id] = session_id
+        broadcast_logger.info(f"[SPECTATOR] Cliente {client_id} a ver a sessão {session_id} ({len(group)} espectadores)")
+    
+    async def handle_unwatch_session(self, client_id: str, websocket, data: dict):
+        """Deixa de receber os broadcasts da sessão vista"""
+        session_id = self.stop_watching(client_id)
+        await self.send_message(websocket, {
+            'type': 'session_unwatched',
+            'session_id': session_id
+        })
+    
+    def stop_watching(self, client_id: str) -> Optional[str]:
+        """Retira o espectador da sessão que estava a ver (retorna o session_id)"""
+        session_id = self.watching.pop(client_id, None)
+        group = self.spectators.get(session_id) if session_id else None
+        if group is not None:
+            group.members.pop(client_id, None)
+        return session_id
+    
+    def leave_lobby_roles(self, client_id: str):
+        """Cliente passou a jogador: deixa de ver sessões e sai da fila de matchmaking"""
+        self.stop_watching(client_id)
+        if self.matchmaker.remove(client_id):
+            metrics.count_match('cancelled')
+    
+    def drop_spectators(self, session_id: str):
+        """Sessão removida: os espectadores deixam de a ver"""
+        group = self.spectators.pop(session_id, None)
+        if group is None:
+            return
+        frame = EncodedFrame.encode({'type': 'watch_ended', 'session_id': session_id})
+        for client_id, websocket in group.members.items():
+            self.watching.pop(client_id, None)
+            self.enqueue_message(websocket, frame)
+        group.close()
+    
+    async def handle_lobby_resync(self, client_id: str, websocket, data: dict):
+        """Envia snapshot completo quando o cliente deteta uma falha na sequência de versões"""
+        try:
+            broadcast_logger.info(f"[LOBBY] Resync pedido por {client_id}: versão do cliente {data.get('version')}, servidor {self.lobby.version}")
+            await self.send_message(websocket, self.lobby.snapshot(self.sessions))
+        except Exception as e:
+            broadcast_logger.error(f"[LOBBY] Erro no resync do lobby: {e}")
+            await self.send_error(websocket, f"Erro no resync do lobby: {str(e)}")
     
     async def remove_player_from_session(self, player_id: str):
         """Remove jogador de uma sessão"""
@@ -1611,18 +3519,20 @@ class NetMasterServer:
             return
         
         # Remover jogador
-        del session.players[player_id]
         del self.player_to_session[player_id]
+        self.registry.unbind_player(player_id, session_id, player.color.value)
+        self.scheduler.cancel(('resume_grace', player_id))
         
-        # Remover jogador da ordem de turnos
-        session.remove_player_from_order(player_id)
+        # *** REMOVER JOGADOR DA SESSÃO (tabela de jogadores + ordem de turnos + broadcast) ***
+        session.remove_player(player_id)
         
-        # *** REMOVER JOGADOR DO SISTEMA DE BROADCAST ***
-        session.remove_player_info(player_id)
+        # Cartas por confirmar já não têm destinatário - voltam à Store
+        self.return_pending_cards_to_store(session_id, player.color.value)
         
         # Ajustar current_turn_index se necessário
         if session.player_order and session.current_turn_index >= len(session.player_order):
             session.current_turn_index = 0
+            session.touch()
         
         logger.info(f"{player.name} saiu da sessão {session_id}")
         logger.info(f"Player order atualizada: {session.player_order}")
@@ -1632,6 +3542,7 @@ class NetMasterServer:
         if session.host_player_id == player_id and session.players:
             new_host_id = next(iter(session.players.keys()))
             session.host_player_id = new_host_id
+            session.touch()
             logger.info(f"Host transferido para {session.players[new_host_id].name}")
             
             # Notificar novo host
@@ -1646,19 +3557,21 @@ class NetMasterServer:
             # MUDANÇA: Não remover imediatamente - dar tempo para reconexão
             session.empty_since = time.time()
             session.state = GameState.WAITING  # Voltar para waiting para permitir novos joins
+            session.touch()
             logger.info(f"Sessão {session_id} ficou vazia - marcada para remoção em 30 segundos")
             
             # Agendar remoção após 30 segundos se ainda estiver vazia
             async def delayed_removal():
-                await asyncio.sleep(30)  # Aguardar 30 segundos
-                if (session_id in self.sessions and 
-                    not self.sessions[session_id].players and 
-                    hasattr(self.sessions[session_id], 'empty_since')):
+                if session_id in self.sessions and not self.sessions[session_id].players:
                     del self.sessions[session_id]
+                    self.stop_recording(session_id)
+                    self.drop_spectators(session_id)
+                    self.cancel_session_deadlines(session_id)
+                    self.persist_session(session_id)
                     logger.info(f"Sessão {session_id} removida após 30s vazia")
-                    await self.broadcast_session_list_update()
+                    await self.broadcast_session_list_update(session_id)
             
-            asyncio.create_task(delayed_removal())
+            self.scheduler.schedule_in(('empty_removal', session_id), 30, delayed_removal)
         else:
             # Se a sessão estava PLAYING e agora só tem 1 jogador, ajustar o estado
             if session.state == GameState.PLAYING and len(session.players) == 1:
@@ -1666,6 +3579,7 @@ class NetMasterServer:
                 # Manter o jogo ativo mas ajustar o turno para o jogador restante
                 remaining_player_id = next(iter(session.players.keys()))
                 session.current_turn_index = 0  # Reset para o primeiro (e único) jogador
+                session.touch()
                 
                 # Notificar o jogador restante que agora é a vez dele
                 await self.broadcast_to_session(session_id, {
@@ -1677,6 +3591,7 @@ class NetMasterServer:
                     'current_turn_index': session.current_turn_index,
                     'game_mode': 'solo'  # Indicar que agora é modo solo
                 })
+                await self.deliver_pending_cards(session_id, session.players[remaining_player_id].color.value, 'turn')
             
             # Notificar jogadores restantes sobre o jogador que saiu
             await self.broadcast_to_session(session_id, {
@@ -1686,124 +3601,432 @@ class NetMasterServer:
                 'session': session.to_dict()
             })
         
+        self.persist_session(session_id)
+        
         # Atualizar lista de sessões
-        await self.broadcast_session_list_update()
+        await self.broadcast_session_list_update(session_id)
     
     async def cleanup_client(self, client_id: str):
         """Limpa recursos quando cliente desconecta"""
-        # Remover da lista de clientes conectados
-        websocket = self.connected_clients.pop(client_id, None)
+        # Remover da lista de clientes conectados (e obter o jogador associado em O(1))
+        player_id = self.registry.player_by_client.get(client_id)
+        self.registry.remove_client(client_id)
+        self.lobby.subscribers.discard(client_id)
+        self.leave_lobby_roles(client_id)
         
-        # Encontrar jogador por websocket e remover da sessão
-        for player_id, session_id in list(self.player_to_session.items()):
+        session_id = self.player_to_session.get(player_id) if player_id else None
+        recording = self.recordings.get(session_id) if session_id else None
+        if recording is not None:
+            recording.client_closed(client_id)
+        session = self.sessions.get(session_id) if session_id else None
+        if session and player_id in session.players:
+            player = session.players[player_id]
+            if RESUME_GRACE_SECONDS > 0 and player.resume_token:
+                # Reservar o lugar: o jogador pode retomar com resume_session durante o período de graça
+                await self.hold_player_slot(session_id, player_id, RESUME_GRACE_SECONDS)
+                return
+            logger.info(f"Removendo jogador {player.name} (ID: {player_id}) da sessão {session_id} devido à desconexão")
+            await self.remove_player_from_session(player_id)
+    
+    async def hold_player_slot(self, session_id: str, player_id: str, grace_seconds: float):
+        """Jogador desligado mantém o lugar (e o turno) durante o período de graça"""
+        session = self.sessions[session_id]
+        player = session.players[player_id]
+        player.connected = False
+        player.websocket = None
+        session.touch()
+        self.scheduler.schedule_in(('resume_grace', player_id), grace_seconds,
+                                   lambda: self.on_resume_grace_expired(player_id))
+        logger.info(f"{player.name} desligou-se da sessão {session_id} - lugar reservado durante {grace_seconds}s")
+        
+        await self.broadcast_to_session(session_id, {
+            'type': 'player_disconnected',
+            'player_id': player_id,
+            'player_name': player.name,
+            'grace_seconds': grace_seconds
+        }, exclude_player=player_id)
+    
+    async def on_resume_grace_expired(self, player_id: str):
+        """Período de graça terminado sem retoma: remover o jogador da sessão"""
+        session_id = self.player_to_session.get(player_id)
+        session = self.sessions.get(session_id) if session_id else None
+        if not session or player_id not in session.players or session.players[player_id].connected:
+            return
+        logger.info(f"{session.players[player_id].name} não retomou a sessão {session_id} - removendo")
+        await self.remove_player_from_session(player_id)
+    
+    async def handle_resume_session(self, client_id: str, websocket, data: dict):
+        """Retoma o lugar de um jogador após quebra de ligação, reenviando só as mensagens perdidas"""
+        try:
+            session_id = data.get('session_id')
+            player_id = data.get('player_id')
+            resume_token = data.get('resume_token')
+            last_seq = data.get('last_seq', 0)
+            
+            # Modo multi-processo: a sessão pode pertencer a outro shard
+            if self.shard and session_id and not self.shard.owns(session_id):
+                await self.send_redirect(websocket, session_id, data)
+                return
+            
             session = self.sessions.get(session_id)
-            if session and player_id in session.players:
-                player = session.players[player_id]
-                # Comparar websockets diretamente
-                if player.websocket == websocket:
-                    logger.info(f"Removendo jogador {player.name} (ID: {player_id}) da sessão {session_id} devido à desconexão")
-                    await self.remove_player_from_session(player_id)
-                    break
+            player = session.players.get(player_id) if session else None
+            if (not player or not player.resume_token or not isinstance(resume_token, str)
+                    or not secrets.compare_digest(player.resume_token, resume_token)):
+                await self.send_message(websocket, {
+                    'type': 'resume_failed',
+                    'session_id': session_id,
+                    'message': 'Sessão ou token de retoma inválido - é necessário entrar de novo'
+                })
+                return
+            
+            # Reassociar o jogador à nova ligação (uma ligação antiga ainda aberta perde o lugar)
+            self.scheduler.cancel(('resume_grace', player_id))
+            player.websocket = websocket
+            player.connected = True
+            player.last_heartbeat = time.time()
+            session.touch()
+            self.registry.bind_player(client_id, player_id, session_id, player.color.value)
+            self.leave_lobby_roles(client_id)
+            
+            missed = session.replay.since(last_seq, player_id) if isinstance(last_seq, int) else None
+            resumed_message = {
+                'type': 'session_resumed',
+                'session_id': session_id,
+                'player_id': player_id,
+                'seq': session.replay.seq,
+                'replayed': len(missed) if missed is not None else 0,
+                'full_state': missed is None
+            }
+            if missed is None:
+                # Mensagens perdidas já não estão no buffer: enviar o estado atual da sessão
+                resumed_message['session'] = session.to_dict()
+                resumed_message['time_remaining'] = self.get_session_time_remaining(session_id)
+            await self.send_message(websocket, resumed_message)
+            for frame in missed or []:
+                await self.send_message(websocket, frame)
+            
+            logger.info(f"{player.name} retomou a sessão {session_id} (último seq {last_seq}, "
+                        f"{'estado completo' if missed is None else f'{len(missed)} mensagens reenviadas'})")
+            
+            await self.broadcast_to_session(session_id, {
+                'type': 'player_resumed',
+                'player_id': player_id,
+                'player_name': player.name
+            }, exclude_player=player_id)
+            
+            # Cartas que chegaram (ou ficaram por confirmar) enquanto esteve desligado
+            await self.deliver_pending_cards(session_id, player.color.value, 'resume')
+            
+        except Exception as e:
+            logger.error(f"Erro ao retomar sessão: {e}")
+            await self.send_error(websocket, f"Erro ao retomar sessão: {str(e)}")
     
-    async def cleanup_expired_sessions(self):
-        """Remove sessões expiradas periodicamente"""
-        while self.running:
-            try:
-                expired_sessions = []
-                waiting_timeout_sessions = []
+    def monotonic_deadline(self, when: datetime) -> float:
+        """Converte um instante (datetime) para o relógio monotónico do scheduler"""
+        return self.scheduler.now() + (when - datetime.now()).total_seconds()
+    
+    def schedule_session_deadlines(self, session: GameSession):
+        """Agenda os prazos de expiração total e de espera de uma sessão"""
+        session_id = session.id
+        self.scheduler.schedule(('session_expire', session_id), self.monotonic_deadline(session.expires_at),
+                                lambda: self.on_session_expired(session_id))
+        self.schedule_waiting_deadline(session)
+    
+    def schedule_waiting_deadline(self, session: GameSession):
+        """(Re)agenda o prazo de espera - O(log n) quando waiting_expires_at muda"""
+        session_id = session.id
+        self.scheduler.schedule(('waiting_expire', session_id), self.monotonic_deadline(session.waiting_expires_at),
+                                lambda: self.on_waiting_expired(session_id))
+    
+    def cancel_session_deadlines(self, session_id: str):
+        """Cancela todos os prazos associados a uma sessão"""
+        for kind in ('session_expire', 'waiting_expire', 'empty_removal'):
+            self.scheduler.cancel((kind, session_id))
+        self.cancel_session_timer(session_id)
+    
+    async def on_waiting_expired(self, session_id: str):
+        """Prazo de espera atingido: jogo solo (1 jogador) ou sessão desfeita"""
+        try:
+            session = self.sessions.get(session_id)
+            if not session or session.state != GameState.WAITING:
+                return
+            
+            logger.info(f"Sessão {session_id} expirou por timeout de espera (1 minuto)")
+            
+            # Se há apenas 1 jogador (criador da sessão), permitir jogo solo
+            if len(session.players) == 1:
+                # Mudar estado para permitir que o jogador continue sozinho
+                session.state = GameState.PLAYING  # Permitir continuar como jogo solo
+                session.touch()
+                self.persist_session(session_id)
                 
-                for session_id, session in self.sessions.items():
-                    if session.is_expired():
-                        expired_sessions.append(session_id)
-                    elif session.is_waiting_expired():
-                        waiting_timeout_sessions.append(session_id)
+                # Notificar o jogador sobre timeout mas permanecer na sessão
+                await self.broadcast_to_session(session_id, {
+                    'type': 'waiting_timeout',
+                    'message': 'Tempo limite de espera atingido. Pode iniciar um jogo solo.',
+                    'timeout_reason': 'waiting_expired',
+                    'allow_solo': True
+                })
                 
-                # Processar sessões com timeout de espera
-                for session_id in waiting_timeout_sessions:
-                    session = self.sessions[session_id]
-                    logger.info(f"Sessão {session_id} expirou por timeout de espera (1 minuto)")
-                    
-                    # Se há apenas 1 jogador (criador da sessão), permitir jogo solo
-                    if len(session.players) == 1:
-                        # Mudar estado para permitir que o jogador continue sozinho
-                        session.state = GameState.PLAYING  # Permitir continuar como jogo solo
-                        
-                        # Notificar o jogador sobre timeout mas permanecer na sessão
-                        await self.broadcast_to_session(session_id, {
-                            'type': 'waiting_timeout',
-                            'message': 'Tempo limite de espera atingido. Pode iniciar um jogo solo.',
-                            'timeout_reason': 'waiting_expired',
-                            'allow_solo': True
-                        })
-                        
-                        logger.info(f"Sessão {session_id} convertida para jogo solo")
-                    else:
-                        # Se há múltiplos jogadores, processar normalmente
-                        await self.broadcast_to_session(session_id, {
-                            'type': 'waiting_timeout',
-                            'message': 'Tempo limite de espera atingido.',
-                            'timeout_reason': 'waiting_expired'
-                        })
-                        
-                        # Remover jogadores apenas se há múltiplos
-                        for player_id in list(session.players.keys()):
-                            await self.remove_player_from_session(player_id)
+                logger.info(f"Sessão {session_id} convertida para jogo solo")
+            else:
+                # Se há múltiplos jogadores, processar normalmente
+                await self.broadcast_to_session(session_id, {
+                    'type': 'waiting_timeout',
+                    'message': 'Tempo limite de espera atingido.',
+                    'timeout_reason': 'waiting_expired'
+                })
                 
-                # Processar sessões expiradas normalmente
-                for session_id in expired_sessions:
-                    session = self.sessions[session_id]
-                    
-                    # NOVO: Verificar se esta sessão já foi processada pelo timer
-                    if getattr(session, 'timer_finished', False):
-                        logger.info(f"Sessão {session_id} já foi processada pelo timer, pulando cleanup")
-                        continue
-                        
-                    logger.info(f"Sessão {session_id} expirou por tempo total de jogo (cleanup)")
-                    
-                    # NOVA FUNCIONALIDADE: Calcular vencedor baseado no saldo
-                    if len(session.players) > 0:
-                        game_result = self.calculate_game_winner(session)
-                        
-                        if game_result:
-                            logger.info(f"Resultado final da sessão {session_id}:")
-                            logger.info(f"  Vencedor: {game_result['winner']['player_name']} ({game_result['winner']['score']} pontos)")
-                            
-                            # Notificar jogadores sobre o resultado final
-                            await self.broadcast_to_session(session_id, {
-                                'type': 'game_finished',
-                                'message': 'Jogo terminado! Vencedor determinado por maior saldo.',
-                                'timeout_reason': 'session_expired',
-                                'game_result': game_result
-                            })
-                            
-                            # Aguardar um pouco para garantir que a mensagem é entregue
-                            await asyncio.sleep(2)
-                        else:
-                            # Fallback para caso não seja possível calcular vencedor
-                            await self.broadcast_to_session(session_id, {
-                                'type': 'session_expired',
-                                'message': 'A sessão expirou',
-                                'timeout_reason': 'session_expired'
-                            })
-                    else:
-                        # Sessão sem jogadores
-                        await self.broadcast_to_session(session_id, {
-                            'type': 'session_expired',
-                            'message': 'A sessão expirou',
-                            'timeout_reason': 'session_expired'
-                        })
-                    
-                    # Remover jogadores após mostrar o resultado
-                    for player_id in list(session.players.keys()):
-                        await self.remove_player_from_session(player_id)
+                # Remover jogadores apenas se há múltiplos
+                for player_id in list(session.players.keys()):
+                    await self.remove_player_from_session(player_id)
+            
+            await self.broadcast_session_list_update(session_id)
+            
+        except Exception as e:
+            logger.error(f"Erro no timeout de espera da sessão {session_id}: {e}")
+    
+    async def on_session_expired(self, session_id: str):
+        """Prazo de duração total da sessão atingido"""
+        try:
+            session = self.sessions.get(session_id)
+            if not session:
+                return
+            
+            # Verificar se esta sessão já foi processada pelo timer
+            if session.timer_finished:
+                logger.info(f"Sessão {session_id} já foi processada pelo timer, pulando cleanup")
+                return
+                
+            logger.info(f"Sessão {session_id} expirou por tempo total de jogo (cleanup)")
+            
+            # Calcular vencedor baseado no saldo
+            if len(session.players) > 0:
+                game_result = self.calculate_game_winner(session)
                 
-                if expired_sessions or waiting_timeout_sessions:
-                    await self.broadcast_session_list_update()
+                if game_result:
+                    logger.info(f"Resultado final da sessão {session_id}:")
+                    logger.info(f"  Vencedor: {game_result['winner']['player_name']} ({game_result['winner']['score']} pontos)")
+                    
+                    # Notificar jogadores sobre o resultado final
+                    await self.broadcast_to_session(session_id, {
+                        'type': 'game_finished',
+                        'message': 'Jogo terminado! Vencedor determinado por maior saldo.',
+                        'timeout_reason': 'session_expired',
+                        'game_result': game_result
+                    })
                     
+                    # Aguardar um pouco para garantir que a mensagem é entregue
+                    await asyncio.sleep(2)
+                else:
+                    # Fallback para caso não seja possível calcular vencedor
+                    await self.broadcast_to_session(session_id, {
+                        'type': 'session_expired',
+                        'message': 'A sessão expirou',
+                        'timeout_reason': 'session_expired'
+                    })
+            else:
+                # Sessão sem jogadores
+                await self.broadcast_to_session(session_id, {
+                    'type': 'session_expired',
+                    'message': 'A sessão expirou',
+                    'timeout_reason': 'session_expired'
+                })
+            
+            # Remover jogadores após mostrar o resultado
+            for player_id in list(session.players.keys()):
+                await self.remove_player_from_session(player_id)
+            
+            await self.broadcast_session_list_update(session_id)
+            
+        except Exception as e:
+            logger.error(f"Erro na expiração da sessão {session_id}: {e}")
+    
+    def persist(self, op: str, session_id: str, **fields):
+        """Regista uma mutação no WAL (sem efeito com a persistência desativada)"""
+        if self.persistence:
+            self.persistence.append(op, session_id, **fields)
+    
+    def persist_session(self, session_id: str):
+        """Regista o estado completo de uma sessão, ou a sua remoção se já não existir"""
+        if not self.persistence:
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            self.persistence.append('remove', session_id)
+        else:
+            self.persistence.append('upsert', session_id, session=session.to_record(self.session_timers.get(session_id)))
+    
+    def start_recording(self, session: GameSession):
+        """Começa a gravar a sessão (mensagens recebidas e broadcasts)"""
+        path = os.path.join(self.recording_dir, f"{session.id}-{int(time.time())}{netmaster_recording.RECORDING_SUFFIX}")
+        recording = netmaster_recording.SessionRecording(path)
+        try:
+            recording.start(session.id, session.seed, session.duration_minutes, session.max_players)
+        except OSError as e:
+            logger.error(f"[RECORDING] Não foi possível gravar a sessão {session.id}: {e}")
+            return
+        session.replay.recording = self.recordings[session.id] = recording
+        logger.info(f"[RECORDING] Sessão {session.id} a ser gravada em {path}")
+    
+    def stop_recording(self, session_id: str):
+        """Fecha a gravação de uma sessão removida"""
+        recording = self.recordings.pop(session_id, None)
+        if recording is not None:
+            recording.close()
+            logger.info(f"[RECORDING] Gravação da sessão {session_id} fechada ({recording.records} registos)")
+    
+    def close_recordings(self):
+        """Fecha todas as gravações (encerramento do servidor)"""
+        for session_id in list(self.recordings):
+            self.stop_recording(session_id)
+    
+    def recording_for(self, client_id: str, data: dict) -> Optional[netmaster_recording.SessionRecording]:
+        """Gravação da sessão do cliente (ou da sessão indicada num join/resume)"""
+        session_id = self.player_to_session.get(self.registry.player_by_client.get(client_id))
+        if session_id is None and data.get('type') in RECORDING_BIND_TYPES:
+            session_id = data.get('session_id')
+        return self.recordings.get(session_id) if session_id else None
+    
+    def record_binding(self, client_id: str, data: dict, received_at: float,
+                       recorded: Optional[netmaster_recording.SessionRecording]):
+        """Associa a ligação ao jogador na gravação (create_session só é gravado depois de criar a sessão)"""
+        player_id = self.registry.player_by_client.get(client_id)
+        session_id = self.player_to_session.get(player_id) if player_id else None
+        recording = self.recordings.get(session_id) if session_id else None
+        if recording is None:
+            return
+        if recording is not recorded:
+            recording.inbound(client_id, data, received_at)
+        recording.bind(client_id, player_id, session_id)
+    
+    def close_persistence(self):
+        """Escreve os registos pendentes e o snapshot final; mutações seguintes deixam de ser registadas"""
+        if self.persistence:
+            self.persistence.close()
+            self.persistence = None
+    
+    def restore_sessions(self, records: Dict[str, dict]):
+        """Reconstrói self.sessions a partir do estado persistido (jogadores ficam desligados até voltarem)"""
+        restored = 0
+        for session_id, record in records.items():
+            try:
+                session = GameSession.from_record(record, send_hook=self.session_send_hook)
             except Exception as e:
-                logger.error(f"Erro na limpeza de sessões: {e}")
+                logger.error(f"[PERSISTENCE] Sessão {session_id} ignorada - registo inválido: {e}")
+                continue
+            if not session.players or session.state == GameState.EXPIRED or session.is_expired():
+                self.persist('remove', session_id)
+                continue
             
-            await asyncio.sleep(30)  # Verificar a cada 30 segundos para ser mais responsivo
+            self.sessions[session_id] = session
+            for player_id, player in session.players.items():
+                player.last_heartbeat = time.time()
+                self.player_to_session[player_id] = session_id
+                self.registry.bind_player(None, player_id, session_id, player.color.value)
+                self.scheduler.schedule_in(('resume_grace', player_id), RESTORE_GRACE_SECONDS,
+                                           lambda player_id=player_id: self.on_resume_grace_expired(player_id))
+            if record.get('replay'):
+                session.replay.restore(record['replay'])
+            self.schedule_session_deadlines(session)
+            if record.get('timer') and session.state == GameState.PLAYING:
+                self.resume_session_timer(session_id, record['timer'])
+            self.lobby.update(session_id, session)
+            restored += 1
+        
+        if records:
+            logger.info(f"[PERSISTENCE] {restored} sessões reconstruídas ({len(records) - restored} expiradas ou vazias descartadas)")
+    
+    def begin_drain(self):
+        """Handler do SIGTERM (um segundo sinal não reinicia o prazo)"""
+        if not self.draining:
+            asyncio.create_task(self.drain())
+    
+    async def drain(self, timeout: Optional[float] = None):
+        """Encerramento gracioso: recusa sessões novas, espera pelas existentes e entrega as restantes"""
+        if self.draining:
+            return
+        self.draining = True
+        timeout = self.drain_timeout if timeout is None else timeout
+        deadline = self.scheduler.now() + timeout
+        logger.info(f"[DRAIN] Encerramento iniciado - {len(self.sessions)} sessões ativas, prazo de {timeout}s")
+        
+        notice = EncodedFrame.encode({
+            'type': 'server_draining',
+            'message': 'O servidor vai reiniciar - as sessões em curso continuam no novo processo',
+            'deadline': time.time() + timeout,
+            'handoff': HANDOFF_ENABLED
+        })
+        for websocket in list(self.connected_clients.values()):
+            self.enqueue_message(websocket, notice)
+        
+        while self.sessions and self.scheduler.now() < deadline:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        
+        if self.sessions:
+            if HANDOFF_ENABLED:
+                self.write_handoff()
+            else:
+                logger.warning(f"[DRAIN] Prazo atingido com {len(self.sessions)} sessões ativas (handoff desativado)")
+        else:
+            logger.info("[DRAIN] Todas as sessões terminaram")
+        self.stop_event.set()
+    
+    def handoff_path(self) -> str:
+        """Ficheiro de handoff deste processo (um por shard no modo multi-processo)"""
+        return f"shard-{self.shard.index}-{HANDOFF_FILE}" if self.shard else HANDOFF_FILE
+    
+    def write_handoff(self):
+        """Grava as sessões ativas (com o buffer de retoma) para o processo seguinte"""
+        start = time.perf_counter()
+        path = self.handoff_path()
+        sessions = {session_id: {**session.to_record(self.session_timers.get(session_id)),
+                                 'replay': session.replay.to_record()}
+                    for session_id, session in self.sessions.items()}
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': HANDOFF_FORMAT, 'created_at': time.time(), 'sessions': sessions},
+                      f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        logger.info(f"[HANDOFF] {len(sessions)} sessões gravadas em {path} em {(time.perf_counter() - start) * 1000:.1f}ms")
+    
+    def load_handoff(self) -> Dict[str, dict]:
+        """Sessões deixadas pelo processo anterior (o ficheiro é consumido)"""
+        path = self.handoff_path()
+        if not HANDOFF_ENABLED or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                handoff = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"[HANDOFF] Erro ao ler {path}: {e}")
+            return {}
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        if handoff.get('format') != HANDOFF_FORMAT:
+            logger.warning(f"[HANDOFF] Formato não suportado em {path}: {handoff.get('format')}")
+            return {}
+        logger.info(f"[HANDOFF] {len(handoff['sessions'])} sessões recebidas do processo anterior "
+                    f"(gravadas há {time.time() - handoff['created_at']:.1f}s)")
+        return handoff['sessions']
+    
+    async def close_client_connections(self):
+        """Fecha as ligações com 'service restart' - os clientes religam e retomam no processo seguinte"""
+        websockets_open = list(self.connected_clients.values())
+        await asyncio.gather(*(websocket.close(SERVICE_RESTART_CLOSE_CODE, "service restart")
+                               for websocket in websockets_open), return_exceptions=True)
+        logger.info(f"[DRAIN] {len(websockets_open)} ligações fechadas")
+    
+    def resume_session_timer(self, session_id: str, timer: dict):
+        """Retoma o timer de uma sessão recuperada a partir do prazo absoluto"""
+        deadline_monotonic = self.scheduler.now() + (timer['deadline'] - time.time())
+        self.session_timers[session_id] = dict(timer, deadline_monotonic=deadline_monotonic)
+        self.scheduler.schedule(('timer_expire', session_id), deadline_monotonic,
+                                lambda: self.on_session_timer_expired(session_id))
+        self.schedule_timer_resync(session_id)
     
     def calculate_game_winner(self, session: GameSession):
         """Calcula o vencedor do jogo baseado no saldo"""
@@ -1832,7 +4055,7 @@ class NetMasterServer:
                 'is_winner': i == 0
             })
         
-        return {
+        game_result = {
             'winner': {
                 'player_id': winner.id,
                 'player_name': winner.name,
@@ -1842,34 +4065,42 @@ class NetMasterServer:
             'ranking': ranking,
             'total_players': len(session.players)
         }
-
-    async def heartbeat_monitor(self):
-        """Monitora heartbeats dos jogadores"""
-        while self.running:
-            try:
-                current_time = time.time()
-                disconnected_players = []
-                
-                for session_id, session in self.sessions.items():
-                    for player_id, player in session.players.items():
-                        # Se não recebeu heartbeat há mais de 2x o intervalo, considerar desconectado
-                        if (current_time - player.last_heartbeat) > (HEARTBEAT_INTERVAL * 2):
-                            disconnected_players.append(player_id)
-                            logger.warning(f"{player.name} sem heartbeat há {current_time - player.last_heartbeat:.1f}s")
-                
-                # Remover jogadores desconectados
-                for player_id in disconnected_players:
-                    await self.remove_player_from_session(player_id)
-                    
-            except Exception as e:
-                logger.error(f"Erro no monitor de heartbeat: {e}")
-            
-            await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if session.replay.recording is not None:
+            session.replay.recording.outcome(game_result)
+        return game_result
 
 # Função principal
-async def main():
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="NetMaster Server")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="Porta do servidor (WebSocket e HTTP)")
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT_SECONDS,
+                        help="Prazo para as sessões terminarem após SIGTERM (s)")
+    parser.add_argument('--record', action='store_true', default=RECORDING_ENABLED,
+                        help=f"Grava as sessões em {RECORDING_DIR}/ (ver netmaster_replay.py)")
+    parser.add_argument('--loop', choices=EVENT_LOOPS, default=EVENT_LOOP,
+                        help="Event loop (uvloop só se estiver instalado; caso contrário asyncio)")
+    return parser
+
+def install_event_loop(name: str) -> str:
+    """Define o event loop dos asyncio.run seguintes; retorna o que fica em uso"""
+    if name == "uvloop":
+        if uvloop is None:
+            logger.warning("uvloop não está instalado - a usar o event loop do asyncio")
+            return "asyncio"
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return name
+
+def running_event_loop() -> str:
+    """Nome do event loop em execução ('asyncio' ou 'uvloop')"""
+    return type(asyncio.get_running_loop()).__module__.split('.')[0]
+
+async def main(args: Optional[argparse.Namespace] = None):
     """Função principal do servidor"""
     server = NetMasterServer()
+    if args:
+        server.port = args.port
+        server.drain_timeout = args.drain_timeout
+        server.recording_enabled = args.record
     
     try:
         await server.start_server()
@@ -1879,9 +4110,12 @@ async def main():
         logger.error(f"Erro crítico no servidor: {e}")
     finally:
         server.running = False
+        server.scheduler.stop()
         logger.info("Servidor NetMaster finalizado")
 
 if __name__ == "__main__":
     print("NetMaster Server v1.0.0")
     print("=" * 50)
-    asyncio.run(main())
+    args = build_parser().parse_args()
+    install_event_loop(args.loop)
+    asyncio.run(main(args))
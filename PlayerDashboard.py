@@ -16,6 +16,8 @@ import asyncio
 import uuid
 import __main__
 from asyncio import Queue
+from urllib.parse import urlparse
+import netmaster_codec
 try:
     import websockets
 except ImportError:
@@ -79,7 +81,14 @@ game_flow = "create"
 clients = []
 CARD_TYPES = ["users", "actions", "equipments", "challenges", "activities", "events", "services"]
 COLORS = ["green", "yellow", "red", "blue", "neutral"]
+RETURN_CARD_TYPES = {"challenge": "challenges", "activity": "activities", "services": "services", "events": "events"}  # Tipo da UI -> baralho do servidor
 baralhos = {}
+SERVICE_RESTART_CLOSE_CODE = 1012  # Fecho "service restart" do servidor: religar e retomar a sessão
+SLOW_CONSUMER_CLOSE_CODE = 1008  # Fila de saída do servidor cheia: religar e receber o que faltou pelo replay
+RESTART_RECONNECT_DELAY = 0.25  # segundos entre tentativas de religação ao servidor reiniciado
+RESTART_RECONNECT_ATTEMPTS = 240
+KEEPALIVE_CHECK_INTERVAL = 20  # segundos entre verificações da ligação (ping WebSocket ou heartbeat JSON)
+KEEPALIVE_PONG_TIMEOUT = 30  # segundos à espera do pong antes de considerar a ligação perdida
 
 # Menu player class
 class MenuPlayer:
@@ -118,6 +127,28 @@ class NetMasterClient:
         # Flag para controle de join de sessões
         self.is_joining_session = False
         
+        # Codec de envio negociado com o servidor (welcome -> select_codec -> codec_selected)
+        self.codec = netmaster_codec.CODEC_JSON
+        
+        # Retoma da sessão após quebra de ligação (token recebido no join e último seq recebido)
+        self.resume_token = None
+        self.last_seq = 0
+        
+        # Liveness: servidores com keepalive (anunciado no welcome) dispensam o heartbeat JSON
+        self.transport_keepalive = False
+        self.rtt = None  # RTT do último ping/pong (segundos)
+        
+        # Cartas da caixa de correio já recebidas (o servidor reentrega até receber o ack)
+        self.received_deliveries = set()
+        
+        # Pedidos de request_game_action à espera do action_result (tipo -> callbacks por ordem de envio)
+        self.pending_actions = {}
+        
+        # Cópia local do lobby do servidor (atualizada por deltas versionados)
+        self.lobby_sessions = {}
+        self.lobby_version = 0
+        self._lobby_resync_pending = False
+        
         # *** NOVO: Registrar handlers globais automaticamente em TODAS as instâncias ***
         print(f"[NETMASTER_CLIENT] Nova instância criada - registrando handlers globais...")
         print(f"[NETMASTER_CLIENT] DEBUG: NetMasterClient._global_handlers = {NetMasterClient._global_handlers}")
@@ -232,8 +263,12 @@ class NetMasterClient:
                 self.server_url,
                 ping_interval=25,  # Ping a cada 25 segundos (antes do heartbeat de 30s)
                 ping_timeout=30,   # Timeout de 30 segundos para pong (mais tolerante)
-                close_timeout=15   # Timeout de 15 segundos para fechar
+                close_timeout=15,  # Timeout de 15 segundos para fechar
+                compression=None,  # permessage-deflate afinado (janela pequena, compressão rápida)
+                extensions=netmaster_codec.client_deflate_extensions()
             )
+            self.codec = netmaster_codec.CODEC_JSON  # Nova ligação começa sempre em JSON
+            self.transport_keepalive = False  # Até ao welcome do servidor
             self.connected = True
             print(f"[CONNECTION] *** CONEXÃO ESTABELECIDA! *** WebSocket: {self.websocket}")
             
@@ -257,6 +292,13 @@ class NetMasterClient:
             self._heartbeat_task = loop.create_task(self.start_heartbeat_loop())
             print(f"[CONNECTION] *** TASK start_heartbeat_loop() CRIADA: {self._heartbeat_task} ***")
 
+            # Subscrever os deltas do lobby (o servidor responde com lobby_snapshot)
+            loop.create_task(self.subscribe_lobby())
+            
+            # Religação durante uma sessão: retomar o lugar em vez de entrar de novo
+            if self.resume_token and self.session_id and self.player_id:
+                loop.create_task(self.resume_session())
+
             return True
             
         except Exception as e:
@@ -284,8 +326,8 @@ class NetMasterClient:
             return False
         
         try:
-            message_str = json.dumps(message)
-            print(f"[DEBUG] JSON serializado: {message_str}")
+            message_str = netmaster_codec.encode(message, self.codec)
+            print(f"[DEBUG] Serializado ({self.codec}): {message_str!r}")
             await self.websocket.send(message_str)
             print(f"[DEBUG] Mensagem enviada com sucesso")
             return True
@@ -312,13 +354,16 @@ class NetMasterClient:
                     print(f"[JOIN_CRITICAL] MESSAGE: {message}")
                     print(f"[JOIN_CRITICAL] TIMESTAMP: {time.time()}")
                 
+                # Frames binários (msgpack) não são inspecionados nos logs abaixo
+                text = message if isinstance(message, str) else ''
+                
                 # SPECIAL: Log para session_joined
-                if '"type": "session_joined"' in message:
+                if '"type": "session_joined"' in text or '"type":"session_joined"' in text:
                     print(f"[SINGLE_READER] *** SESSION_JOINED DETECTADO NA MENSAGEM #{message_count}! ***")
                     print(f"[SINGLE_READER] CONTENT: {message[:500]}...")
                 
                 # SPECIAL: Log para test_connectivity
-                if '"type": "test_connectivity"' in message:
+                if '"type": "test_connectivity"' in text or '"type":"test_connectivity"' in text:
                     print(f"[SINGLE_READER] *** TEST_CONNECTIVITY DETECTADO NA MENSAGEM #{message_count}! ***")
                     print(f"[SINGLE_READER] CONTENT: {message}")
                 
@@ -337,6 +382,12 @@ class NetMasterClient:
             self.connected = False
             
         print(f"[SINGLE_READER] *** LEITURA FINALIZADA - {message_count} mensagens ***")
+        
+        # Servidor a reiniciar (religar ao processo seguinte, que recebeu a sessão por handoff)
+        # ou ligação fechada por atraso (as mensagens em falta chegam pelo replay da retoma)
+        if getattr(self.websocket, 'close_code', None) in (SERVICE_RESTART_CLOSE_CODE, SLOW_CONSUMER_CLOSE_CODE) \
+                and self.resume_token:
+            asyncio.get_running_loop().create_task(self.reconnect_after_restart())
     
     async def _message_processor(self):
         """Processa mensagens da queue e executa handlers"""
@@ -354,9 +405,73 @@ class NetMasterClient:
                     print(f"[MESSAGE_PROCESSOR] Processando mensagem #{processed_count}: {message}")
                     
                     try:
-                        data = json.loads(message)
+                        data = netmaster_codec.decode(message)
                         message_type = data.get('type')
                         
+                        # Negociação de codec: escolher no welcome, mudar o envio quando o servidor confirmar
+                        if message_type == 'welcome':
+                            self.transport_keepalive = bool(data.get('server_info', {}).get('keepalive'))
+                            codec = netmaster_codec.choose_codec(data.get('codecs', []), data.get('codec_dictionary'))
+                            if codec != netmaster_codec.CODEC_JSON:
+                                asyncio.get_running_loop().create_task(self.send_message({'type': 'select_codec', 'codec': codec}))
+                        elif message_type == 'codec_selected':
+                            self.codec = data.get('codec', netmaster_codec.CODEC_JSON)
+                            print(f"[CODEC] Codec negociado: {self.codec}")
+                            self.message_queue.task_done()
+                            continue
+                        
+                        # Retoma de sessão: guardar o token e o último seq (as mensagens reenviadas seguem o fluxo normal)
+                        if message_type in ('session_created', 'session_joined'):
+                            self.resume_token = data.get('resume_token')
+                            self.last_seq = data.get('seq', 0)
+                            self.received_deliveries = set()
+                        elif message_type == 'session_resumed':
+                            # O seq do servidor manda (pode recuar se o buffer de replay foi reiniciado)
+                            self.last_seq = data.get('seq', self.last_seq)
+                        elif 'seq' in data:
+                            self.last_seq = max(self.last_seq, data['seq'])
+                        if message_type == 'resume_failed':
+                            print(f"[RESUME] Retoma recusada: {data.get('message')}")
+                            self.resume_token = None
+                        elif message_type == 'session_resumed':
+                            print(f"[RESUME] Sessão retomada - {data.get('replayed')} mensagens reenviadas, estado completo: {data.get('full_state')}")
+                            if data.get('full_state') and data.get('session'):
+                                self._apply_resumed_state(data)
+                        
+                        # Caixa de correio: ignorar reentregas e confirmar as cartas ao servidor.
+                        # O ack só é enviado no próximo await, depois do handler (síncrono) ter guardado as cartas
+                        if message_type == 'pending_cards' and data.get('delivery_ids'):
+                            delivery_ids = data['delivery_ids']
+                            new_cards = [card for card in data.get('cards', [])
+                                         if card.get('delivery_id') not in self.received_deliveries]
+                            self.received_deliveries.update(delivery_ids)
+                            asyncio.get_running_loop().create_task(self.ack_pending_cards(delivery_ids))
+                            if not new_cards:
+                                print(f"[PENDING_CARDS] Reentrega de cartas já recebidas {delivery_ids} - só ack")
+                                self.message_queue.task_done()
+                                continue
+                            data = {**data, 'cards': new_cards}
+                        
+                        # Resultado (ou erro) de um pedido feito com request_game_action
+                        if message_type == 'action_result':
+                            self._finish_game_action(data.get('action_type'), data.get('result') if data.get('success') else None)
+                        elif message_type == 'error' and data.get('action_type'):
+                            self._finish_game_action(data['action_type'], None)
+                        
+                        # Modo multi-processo: a sessão pertence a outro shard - religar e repetir o pedido
+                        if message_type == 'redirect':
+                            asyncio.get_running_loop().create_task(self._follow_redirect(data))
+                            self.message_queue.task_done()
+                            continue
+                        
+                        # Deltas do lobby: aplicar à cópia local e entregar aos handlers como sessions_list_update
+                        if message_type in ('lobby_snapshot', 'session_added', 'session_updated', 'session_removed'):
+                            data = self._apply_lobby_message(data)
+                            if data is None:
+                                self.message_queue.task_done()
+                                continue
+                            message_type = data['type']
+                        
                         print(f"[MESSAGE_PROCESSOR] Tipo: {message_type}")
                         
                         # DEBUG: Log ALL messages for join debugging
@@ -693,6 +808,53 @@ class NetMasterClient:
             'action_data': action_data
         }
         return await self.send_message(message)
+
+    # Baralhos da sessão no servidor: o resultado chega em action_result (e player_action para os outros)
+    async def move_by(self, steps):
+        """Avança 'steps' casas - o servidor calcula a nova posição e a casa"""
+        return await self.send_game_action('move', {'steps': steps})
+
+    async def draw_card(self, card_type=None, color=None):
+        """Tira uma carta do baralho da sessão (por omissão o da casa atual)"""
+        action_data = {key: value for key, value in (('card_type', card_type), ('color', color)) if value}
+        return await self.send_game_action('draw_card', action_data)
+
+    async def return_card(self, card_path, card_type, color=None):
+        """Devolve uma carta ao fundo do baralho da sessão"""
+        action_data = {'card_path': card_path, 'card_type': card_type}
+        if color:
+            action_data['color'] = color
+        return await self.send_game_action('return_card', action_data)
+
+    async def store_inventory(self, card_type=None, color=None, limit=None):
+        """Inventário da Store da sessão (e as primeiras cartas de um baralho, com card_type)"""
+        action_data = {key: value for key, value in (('card_type', card_type), ('color', color), ('limit', limit)) if value}
+        return await self.send_game_action('store_inventory', action_data)
+    
+    def request_game_action(self, action_type, action_data, callback):
+        """Envia uma game_action a partir da UI; callback(result) recebe o resultado (None se a ação falhar)"""
+        self.pending_actions.setdefault(action_type, []).append(callback)
+        loop = self.reader_task.get_loop() if self.reader_task and not self.reader_task.done() else None
+        if loop is None:
+            self._finish_game_action(action_type, None)
+            return False
+        asyncio.run_coroutine_threadsafe(self._send_game_action_request(action_type, action_data), loop)
+        return True
+    
+    async def _send_game_action_request(self, action_type, action_data):
+        if not await self.send_game_action(action_type, action_data):
+            self._finish_game_action(action_type, None)
+    
+    def _finish_game_action(self, action_type, result):
+        """Entrega o resultado ao pedido mais antigo desse tipo (o servidor responde pela ordem)"""
+        callbacks = self.pending_actions.get(action_type)
+        if not callbacks:
+            return
+        callback = callbacks.pop(0)
+        try:
+            callback(result)
+        except Exception as e:
+            print(f"[GAME_ACTION] Erro no callback de {action_type}: {e}")
     
     async def list_sessions(self):
         """Solicita lista de sessões disponíveis"""
@@ -705,6 +867,129 @@ class NetMasterClient:
         print(f"[DEBUG] Mensagem list_sessions enviada, resultado: {result}")
         return result
     
+    async def subscribe_lobby(self):
+        """Subscreve os deltas do lobby - substitui as listas completas de sessões"""
+        return await self.send_message({
+            'type': 'subscribe_lobby',
+            'version': self.lobby_version
+        })
+    
+    async def resume_session(self):
+        """Retoma o lugar na sessão após religação - o servidor reenvia só as mensagens perdidas"""
+        print(f"[RESUME] Retomando sessão {self.session_id} a partir do seq {self.last_seq}")
+        return await self.send_message({
+            'type': 'resume_session',
+            'session_id': self.session_id,
+            'player_id': self.player_id,
+            'resume_token': self.resume_token,
+            'last_seq': self.last_seq
+        })
+    
+    async def reconnect_after_restart(self):
+        """Religa após o fecho 1012/1008 - connect() retoma a sessão com o resume_token"""
+        for attempt in range(RESTART_RECONNECT_ATTEMPTS):
+            await asyncio.sleep(RESTART_RECONNECT_DELAY)
+            if self.connected:
+                return
+            if await self.connect():
+                print(f"[RESUME] Religado ao servidor reiniciado após {attempt + 1} tentativa(s)")
+                return
+        print(f"[RESUME] Servidor não voltou após {RESTART_RECONNECT_ATTEMPTS} tentativas")
+    
+    async def ack_pending_cards(self, delivery_ids):
+        """Confirma a receção de cartas da caixa de correio - o servidor só as remove com o ack"""
+        return await self.send_message({
+            'type': 'ack_pending_cards',
+            'player_id': self.player_id,
+            'delivery_ids': list(delivery_ids)
+        })
+    
+    async def _follow_redirect(self, data):
+        """Religa ao shard indicado pelo servidor e reenvia o pedido original"""
+        parsed = urlparse(self.server_url)
+        new_url = parsed._replace(netloc=f"{parsed.hostname}:{data.get('port')}").geturl()
+        print(f"[REDIRECT] Sessão {data.get('session_id')} está no shard {data.get('shard')} - religando a {new_url}")
+        
+        # Fechar a ligação atual sem notificar a UI (a nova ligação segue de imediato)
+        self.connected = False
+        if self.websocket:
+            await self.websocket.close()
+        
+        self.server_url = new_url
+        if await self.connect() and data.get('retry'):
+            await self.send_message(data['retry'])
+    
+    def _apply_resumed_state(self, data):
+        """Retoma sem replay: guarda o estado completo e entrega-o aos handlers da sessão"""
+        session = data['session']
+        self.session_data = session
+        self.session_id = session.get('id', self.session_id)
+        players = session.get('players', {})
+        # Mensagens sintetizadas no formato das do servidor (seguem pela queue, sem seq)
+        resumed = [{
+            'type': 'players_info_sync',
+            'players': {player_id: {'color': players[player_id]['color'], 'name': players[player_id]['name'],
+                                    'is_active': True}
+                        for player_id in session.get('player_order', []) if player_id in players},
+            'total_players': len(session.get('player_order', [])),
+            'session_id': session.get('id'),
+            'source': 'server'
+        }]
+        current_player = players.get(session.get('current_player_id'))
+        if session.get('state') == 'playing' and current_player:
+            resumed.append({
+                'type': 'turn_changed',
+                'current_player_id': current_player['id'],
+                'current_player_name': current_player['name'],
+                'current_player_color': current_player['color'],
+                'player_order': session.get('player_order', []),
+                'current_turn_index': session.get('current_turn_index', 0),
+                'session_id': session.get('id')
+            })
+        if data.get('time_remaining'):  # 0 = sessão sem timer
+            resumed.append({'type': 'timer_sync', 'time_remaining': data['time_remaining'], 'source': 'server'})
+        for message in resumed:
+            self.message_queue.put_nowait(json.dumps(message))
+    
+    def _apply_lobby_message(self, data):
+        """Aplica snapshot/delta do lobby e retorna um sessions_list_update sintetizado (ou None)"""
+        message_type = data.get('type')
+        version = data.get('version', 0)
+        
+        if message_type == 'lobby_snapshot':
+            self.lobby_sessions = {session['id']: session for session in data.get('sessions', [])}
+            self.lobby_version = version
+            self._lobby_resync_pending = False
+        elif self._lobby_resync_pending:
+            # À espera do snapshot - ignorar deltas até lá
+            return None
+        elif version <= self.lobby_version:
+            # Delta já aplicado (ex: chegou antes do snapshot)
+            return None
+        elif version != self.lobby_version + 1:
+            # Falha na sequência - pedir snapshot completo
+            print(f"[LOBBY] Falha na sequência de versões ({self.lobby_version} -> {version}) - pedindo resync")
+            self._lobby_resync_pending = True
+            asyncio.get_running_loop().create_task(self.send_message({
+                'type': 'lobby_resync',
+                'version': self.lobby_version
+            }))
+            return None
+        else:
+            if message_type == 'session_removed':
+                self.lobby_sessions.pop(data.get('session_id'), None)
+            else:
+                session = data.get('session', {})
+                self.lobby_sessions[session.get('id')] = session
+            self.lobby_version = version
+        
+        # Os handlers existentes alteram as sessões recebidas - entregar cópias
+        return {
+            'type': 'sessions_list_update',
+            'sessions': [dict(session) for session in self.lobby_sessions.values()],
+            'lobby_version': self.lobby_version
+        }
+    
     async def send_heartbeat(self):
         """Envia heartbeat para manter a conexão ativa"""
         if not self.connected or not self.websocket:
@@ -731,23 +1016,40 @@ class NetMasterClient:
             print(f"[HEARTBEAT] Erro ao enviar heartbeat: {e}")
             return False
     
+    async def send_keepalive_ping(self):
+        """Ping WebSocket (em vez do heartbeat JSON): confirma a ligação e mede o RTT"""
+        if not self.connected or not self.websocket:
+            return False
+        pong_waiter = await self.websocket.ping()
+        self.rtt = await asyncio.wait_for(pong_waiter, timeout=KEEPALIVE_PONG_TIMEOUT)
+        # O pong também conta como atividade para o watchdog de mensagens do dashboard
+        update_timestamp = getattr(self, '_update_message_timestamp', None)
+        if update_timestamp:
+            update_timestamp()
+        return True
+    
     async def start_heartbeat_loop(self):
         """Inicia o loop de heartbeat em background"""
         print(f"[HEARTBEAT] Iniciando loop de heartbeat...")
         
         while self.connected:
             try:
-                await self.send_heartbeat()
-                
-                # Aguardar 20 segundos antes do próximo heartbeat (mais frequente que ping_interval)
-                # Dividir em 20 esperas de 1 segundo para permitir parada mais rápida
-                for _ in range(20):
+                # Aguardar antes de cada verificação (o welcome diz se o servidor usa keepalive)
+                # Dividir em esperas de 1 segundo para permitir parada mais rápida
+                for _ in range(KEEPALIVE_CHECK_INTERVAL):
                     if not self.connected:
                         break
                     await asyncio.sleep(1)
+                if not self.connected:
+                    break
+                
+                if self.transport_keepalive:
+                    await self.send_keepalive_ping()
+                else:
+                    await self.send_heartbeat()  # Servidor antigo: heartbeat JSON
                     
-            except websockets.exceptions.ConnectionClosed:
-                print(f"[HEARTBEAT] Conexão WebSocket fechada")
+            except (websockets.exceptions.ConnectionClosed, asyncio.TimeoutError):
+                print(f"[HEARTBEAT] Conexão WebSocket fechada ou sem pong")
                 self.connected = False
                 break
             except Exception as e:
@@ -3700,6 +4002,9 @@ class IntegratedMenuSystem:
                                     print(f"[DEDICATED_JOIN] *** ANTES TRANSFER - join_client.session_id: {join_client.session_id} ***")
                                     print(f"[DEDICATED_JOIN] *** ANTES TRANSFER - netmaster_client.session_id: {getattr(netmaster_client, 'session_id', 'NONE')} ***")
                                     netmaster_client.session_id = join_client.session_id
+                                    netmaster_client.resume_token = join_client.resume_token
+                                    netmaster_client.last_seq = join_client.last_seq
+                                    netmaster_client.received_deliveries = join_client.received_deliveries
                                     print(f"[DEDICATED_JOIN] *** SESSION_ID TRANSFERIDO: {netmaster_client.session_id} ***")
                                     print(f"[DEDICATED_JOIN] *** VERIFICATION - netmaster_client.session_id: {netmaster_client.session_id} ***")
                                 else:
@@ -6840,16 +7145,39 @@ class IntegratedMenuSystem:
             
             print(f"[TIMER_SYNC] Recebida atualização do timer do SERVIDOR: {time_remaining:.1f}s")
             
-            # Atualizar estado local do timer (mas não executar countdown próprio)
+            # Atualizar estado local do timer
             self.session_time_remaining = time_remaining
             self.session_timer_active = True  # Timer sempre ativo se vem do servidor
             
+            # O servidor só ressincroniza de tempos a tempos - contar localmente a partir do prazo
+            self.session_timer_deadline = time.monotonic() + time_remaining
+            
             # Atualizar display imediatamente se existir
             if hasattr(self, 'session_timer_label') and self.session_timer_label:
                 self.update_timer_display()
+            
+            if not getattr(self, '_local_timer_job', None):
+                self._local_timer_job = self.root.after(1000, self._local_timer_tick)
                 
         except Exception as e:
             print(f"[TIMER_SYNC] Erro ao processar sincronização do timer: {e}")
+    
+    def _local_timer_tick(self):
+        """Countdown local entre ressincronizações, calculado a partir do prazo do servidor"""
+        deadline = getattr(self, 'session_timer_deadline', None)
+        if deadline is None or not getattr(self, 'session_timer_active', False):
+            self._local_timer_job = None
+            return
+        
+        self.session_time_remaining = max(0, deadline - time.monotonic())
+        if hasattr(self, 'session_timer_label') and self.session_timer_label:
+            self.update_timer_display()
+        
+        # O fim do jogo é anunciado pelo servidor (game_finished) - aqui só paramos o countdown
+        if self.session_time_remaining > 0:
+            self._local_timer_job = self.root.after(1000, self._local_timer_tick)
+        else:
+            self._local_timer_job = None
 
     def launch_player_dashboard(self, game_type):
         """Lançar o PlayerDashboard"""
@@ -19041,6 +19369,9 @@ class PlayerDashboard(tk.Toplevel):
             # CORREÇÃO: Normalizar tipo para maiúsculo para comparação
             card_type_normalized = card_type.capitalize() if isinstance(card_type, str) else str(card_type).capitalize()
             
+            # Multiplayer: devolver ao baralho da sessão no servidor (a Store local continua a ser atualizada abaixo)
+            self._devolver_carta_ao_servidor(carta_path, card_type_normalized)
+            
             if card_type_normalized == "Challenge":
                 # Challenge volta para o baralho da Store
                 self._devolver_challenge_para_baralho(carta_path)
@@ -19071,6 +19402,18 @@ class PlayerDashboard(tk.Toplevel):
             import traceback
             traceback.print_exc()
     
+    def _devolver_carta_ao_servidor(self, carta_path, card_type):
+        """Envia return_card ao servidor quando há uma sessão multiplayer em curso"""
+        server_type = RETURN_CARD_TYPES.get(card_type.lower())
+        if not server_type or not (netmaster_client.connected and netmaster_client.session_id):
+            return
+        
+        def resultado(result):
+            if result is None:
+                print(f"DEBUG: [DEVOLVER_STORE] Servidor recusou return_card de {os.path.basename(carta_path)}")
+        
+        netmaster_client.request_game_action('return_card', {'card_path': carta_path, 'card_type': server_type}, resultado)
+    
     def _devolver_challenge_para_baralho(self, carta_path):
         """
         Devolve Challenge completado para o baralho da Store
@@ -34508,17 +34851,40 @@ class PlayerDashboard(tk.Toplevel):
             
             print(f"[TIMER_SYNC] Recebida atualização do timer do SERVIDOR: {time_remaining:.1f}s")
             
-            # Atualizar estado local do timer (mas não executar countdown próprio)
+            # Atualizar estado local do timer
             self.session_time_remaining = time_remaining
             self.session_timer_active = True  # Timer sempre ativo se vem do servidor
             
+            # O servidor só ressincroniza de tempos a tempos - contar localmente a partir do prazo
+            self.session_timer_deadline = time.monotonic() + time_remaining
+            
             # Atualizar display imediatamente se existir
             if hasattr(self, 'session_timer_label') and self.session_timer_label:
                 self.update_timer_display()
+            
+            if not getattr(self, '_local_timer_job', None):
+                self._local_timer_job = self.after(1000, self._local_timer_tick)
                 
         except Exception as e:
             print(f"[TIMER_SYNC] Erro ao processar sincronização do timer: {e}")
     
+    def _local_timer_tick(self):
+        """Countdown local entre ressincronizações, calculado a partir do prazo do servidor"""
+        deadline = getattr(self, 'session_timer_deadline', None)
+        if deadline is None or not getattr(self, 'session_timer_active', False):
+            self._local_timer_job = None
+            return
+        
+        self.session_time_remaining = max(0, deadline - time.monotonic())
+        if hasattr(self, 'session_timer_label') and self.session_timer_label:
+            self.update_timer_display()
+        
+        # O fim do jogo é anunciado pelo servidor (game_finished) - aqui só paramos o countdown
+        if self.session_time_remaining > 0:
+            self._local_timer_job = self.after(1000, self._local_timer_tick)
+        else:
+            self._local_timer_job = None
+    
     def _verificar_cartas_pendentes(self):
         """
         NOVO SISTEMA: Verifica no servidor se há cartas Actions/Events armazenadas para este jogador
@@ -51,6 +51,7 @@ CARTAS_BASE_DIR = detect_cartas_base_dir()
 COIN_IMG = os.path.join(IMG_DIR, "picoin.png")
 AWNING_IMG = os.path.join(IMG_DIR, "Store_awning_v3.png")
 BELOWBAR_IMG = os.path.join(IMG_DIR, "BelowBar_store.png")
+SERVER_DRAW_TIMEOUT_MS = 3000  # Espera pelo action_result do draw_card antes de usar o baralho local
 
 KEY1_PIN = 23
 GPIO.setmode(GPIO.BCM)
@@ -252,6 +253,21 @@ def tirar_carta(cor, tipo):
     print(f"DEBUG: Nenhuma carta disponível para cor={cor}, tipo={tipo}")
     return None  # Não há cartas
 
+def cliente_sessao():
+    """Cliente NetMaster de uma sessão multiplayer em curso (None em jogo local)"""
+    import __main__
+    cliente = getattr(__main__, 'netmaster_client', None)
+    if cliente is not None and getattr(cliente, 'connected', False) and getattr(cliente, 'session_id', None):
+        return cliente
+    return None
+
+def caminho_local_carta(caminho_relativo):
+    """Caminho local de uma carta tirada no servidor (<tipo>/Residential-level[/<Cor>]/<ficheiro>)"""
+    tipo, resto = caminho_relativo.split('/', 1)
+    if universal_paths['environment'] == 'raspberry_pi':
+        return os.path.join(CARTAS_BASE_DIR, "img", "cartas", tipo, *resto.split('/'))
+    return os.path.join(CARTAS_BASE_DIR, tipo.capitalize(), *resto.split('/'))
+
 # Definição do tabuleiro (igual ao PlayerDashboard.py)
 BOARD = [
     # Top row (left to right)
@@ -2305,9 +2321,7 @@ class StoreWindow(tk.Toplevel):
             carta_lbl = tk.Label(center_frame, text="🂠", font=("Helvetica", 60), fg="white", bg="black")
             carta_lbl.pack(pady=(0, 12))
 
-        def revelar_carta():
-            carta_lbl.destroy()
-            go_btn.destroy()
+        def tirar_local():
             carta_path = None
             
             # Corrigir a lógica de tirar cartas
@@ -2329,7 +2343,9 @@ class StoreWindow(tk.Toplevel):
             else:
                 print(f"DEBUG: Tentar tirar carta do tipo '{tipo}'")
                 carta_path = tirar_carta(casa_cor, tipo)
-                
+            return carta_path
+
+        def mostrar_resultado(carta_path):
             print(f"DEBUG: carta_path={carta_path}")
             
             if carta_path and os.path.exists(carta_path):
@@ -2352,6 +2368,41 @@ class StoreWindow(tk.Toplevel):
                 # Botão para voltar
                 tk.Button(no_cards_frame, text="Back", font=("Helvetica", 14, "bold"), bg="#005c75", fg="white", command=self.voltar_para_store).pack(pady=10)
 
+        def revelar_carta():
+            carta_lbl.destroy()
+            go_btn.destroy()
+            
+            cliente = cliente_sessao()
+            if cliente is None or tipo not in CARD_TYPES:
+                mostrar_resultado(tirar_local())
+                return
+            
+            # Multiplayer: a carta sai do baralho da sessão no servidor (igual para todos os jogadores)
+            pendente = [True]
+
+            def concluir(result):
+                if not pendente[0]:
+                    if result and result.get('card_path'):
+                        # Resposta depois do timeout: a carta já saiu do baralho da sessão - devolvê-la
+                        print(f"DEBUG: draw_card chegou tarde - devolvendo {result['card_path']} ao baralho da sessão")
+                        action_data = {'card_path': result['card_path'], 'card_type': result.get('card_type', tipo)}
+                        if result.get('deck'):
+                            action_data['color'] = result['deck'].split('/', 1)[0]
+                        cliente.request_game_action('return_card', action_data, lambda result: None)
+                    return
+                pendente[0] = False
+                if result and result.get('card_path'):
+                    mostrar_resultado(caminho_local_carta(result['card_path']))
+                else:
+                    # Erro, baralho da sessão vazio ou sem resposta: comportamento local de antes
+                    print("DEBUG: draw_card sem carta do servidor - usando o baralho local")
+                    mostrar_resultado(tirar_local())
+
+            # O action_result chega na thread do cliente: mostrar a carta na thread da UI
+            cliente.request_game_action('draw_card', {'card_type': tipo, 'color': casa_cor},
+                                        lambda result: self.after(0, lambda: concluir(result)))
+            self.after(SERVER_DRAW_TIMEOUT_MS, lambda: concluir(None))
+
         go_btn = tk.Button(center_frame, text="Go!", font=("Helvetica", 16, "bold"), bg="#005c75", fg="white", command=revelar_carta)
         go_btn.pack(pady=(5, 0))
 
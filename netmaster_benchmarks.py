@@ -0,0 +1,751 @@
+#!/usr/bin/env python3
+"""
+NetMaster Server - Benchmarks
+Micro-benchmarks dos caminhos críticos do servidor (NetMaster_Server.py).
+
+Uso:
+    python3 netmaster_benchmarks.py serialization [--clients 1000] [--sessions 50]
+    python3 netmaster_benchmarks.py logging [--duration 3] [--players 4]
+    python3 netmaster_benchmarks.py codec [--sessions 50]
+    python3 netmaster_benchmarks.py persistence [--turns 20000] [--sessions 1000]
+    python3 netmaster_benchmarks.py memory [--sessions 100000]
+    python3 netmaster_benchmarks.py handoff [--sessions 50] [--drain 1]
+    python3 netmaster_benchmarks.py spectators [--spectators 100]
+    python3 netmaster_benchmarks.py matchmaking [--queued 1000]
+    python3 netmaster_benchmarks.py eventloop [--players 200] [--turns 20]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import websockets
+
+import NetMaster_Server as nms
+import netmaster_codec
+import netmaster_loadgen
+import netmaster_matchmaking
+import netmaster_persistence
+
+
+def quiet_server_logs():
+    """Evita que os logs do servidor dominem as medições"""
+    logging.getLogger().setLevel(logging.WARNING)
+    nms.logger.setLevel(logging.WARNING)
+
+
+def make_session(num_players: int = 4) -> nms.GameSession:
+    """Cria uma sessão em memória com num_players jogadores (sem websockets)"""
+    colors = list(nms.PlayerColor)
+    players = {}
+    for i in range(num_players):
+        player_id = str(uuid.uuid4())
+        players[player_id] = nms.Player(id=player_id, name=f"Player{i + 1}", color=colors[i],
+                                        last_heartbeat=time.time())
+
+    session = nms.GameSession(
+        id=str(uuid.uuid4())[:8],
+        host_player_id=next(iter(players)),
+        players=players,
+        state=nms.GameState.WAITING,
+        created_at=datetime.now(),
+        expires_at=datetime.now() + timedelta(minutes=nms.SESSION_DURATION_MINUTES),
+        waiting_expires_at=datetime.now() + timedelta(minutes=nms.WAITING_TIMEOUT_MINUTES)
+    )
+    for player_id in players:
+        session.add_player_to_order(player_id)
+    return session
+
+
+def timed(func, repeat: int) -> float:
+    """Tempo médio (µs) de uma chamada de func"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def report(title: str, legacy_us: float, current_us: float):
+    """Imprime uma linha de comparação"""
+    reduction = (1 - current_us / legacy_us) * 100 if legacy_us else 0.0
+    print(f"  {title:<50} antes: {legacy_us:10.1f} µs   depois: {current_us:10.1f} µs   redução: {reduction:5.1f}%")
+
+
+class NullWebSocket:
+    """Websocket falso que aceita envios sem custo (mede apenas o caminho do servidor)"""
+
+    close_code = None
+
+    async def send(self, data):
+        pass
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+async def bench_lobby_fanout(num_clients: int, num_sessions: int, repeat: int) -> float:
+    """Tempo médio (µs) de broadcast_session_list_update para num_clients ligações"""
+    server = nms.NetMasterServer()
+    for _ in range(num_sessions):
+        session = make_session(1)
+        server.sessions[session.id] = session
+
+    for _ in range(num_clients):
+        client_id = str(uuid.uuid4())
+        websocket = NullWebSocket()
+        server.connected_clients[client_id] = websocket
+        outbound = nms.OutboundQueue(websocket, client_id, maxsize=repeat + 1)
+        server.outbound_queues[websocket] = outbound
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await server.broadcast_session_list_update()
+    elapsed = (time.perf_counter() - start) / repeat * 1e6
+
+    for outbound in server.outbound_queues.values():
+        outbound.close()
+    return elapsed
+
+
+def run_serialization(args):
+    """Serialização por destinatário (antes) vs frame codificado uma vez (depois)"""
+    quiet_server_logs()
+    print("Serialização de broadcasts (json.dumps por destinatário vs EncodedFrame partilhado)")
+
+    # Sessão de 4 jogadores: player_joined com a sessão completa e turn_changed
+    session = make_session(4)
+    recipients = len(session.players)
+    player_joined = {
+        'type': 'player_joined',
+        'player': next(iter(session.players.values())).to_dict(),
+        'session': session.to_dict()
+    }
+    turn_changed = {
+        'type': 'turn_changed',
+        'current_player_id': session.player_order[1],
+        'current_player_name': 'Player2',
+        'current_player_color': 'blue',
+        'player_order': session.player_order,
+        'current_turn_index': 1,
+        'session_id': session.id
+    }
+
+    print(f"\nSessão com {recipients} jogadores ({args.repeat} repetições):")
+    for message in (player_joined, turn_changed):
+        legacy = timed(lambda: [json.dumps(message) for _ in range(recipients)], args.repeat)
+        current = timed(lambda: nms.EncodedFrame.encode(message), args.repeat)
+        report(message['type'], legacy, current)
+
+    # to_dict: reconstruída a cada chamada (antes) vs vista em cache por versão da sessão (depois)
+    def rebuild():
+        session.touch()
+        return session.to_dict()
+
+    print(f"\nSerialização da sessão ({args.repeat} repetições):")
+    report("to_dict (sessão de 4 jogadores)", timed(rebuild, args.repeat), timed(session.to_dict, args.repeat))
+
+    # Lobby: lista completa de sessões para todos os clientes ligados
+    sessions = [make_session(1).to_dict() for _ in range(args.sessions)]
+    lobby_update = {'type': 'sessions_list_update', 'sessions': sessions}
+    lobby_repeat = max(1, args.repeat // 100)
+
+    print(f"\nLobby: {args.sessions} sessões para {args.clients} clientes ({lobby_repeat} repetições):")
+    legacy = timed(lambda: [json.dumps(lobby_update) for _ in range(args.clients)], lobby_repeat)
+    current = timed(lambda: nms.EncodedFrame.encode(lobby_update), lobby_repeat)
+    report("sessions_list_update (só serialização)", legacy, current)
+
+    fanout = asyncio.run(bench_lobby_fanout(args.clients, args.sessions, lobby_repeat))
+    print(f"  {'broadcast_session_list_update (caminho completo)':<50} {fanout:10.1f} µs por broadcast")
+
+
+def configure_logging_mode(mode: str, log_file: str):
+    """Configura o logging do servidor para um dos modos comparados"""
+    nms.shutdown_logging()
+    logging.disable(logging.NOTSET)
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        handler.close()
+    nms.logger.setLevel(logging.NOTSET)
+
+    if mode == "sync":
+        # Antes: FileHandler síncrono no event loop e logs por destinatário ao nível INFO
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        root_logger.addHandler(handler)
+        root_logger.setLevel(logging.INFO)
+        verbose_levels = {subsystem: 'DEBUG' for subsystem in nms.LOG_LEVELS}
+        for subsystem, level in verbose_levels.items():
+            subsystem_logger = nms.logger.getChild(subsystem)
+            subsystem_logger.setLevel(level)
+            for existing_filter in list(subsystem_logger.filters):
+                subsystem_logger.removeFilter(existing_filter)
+    elif mode == "queue":
+        nms.setup_logging(log_file=log_file, console=False)
+    else:
+        logging.disable(logging.CRITICAL)
+
+
+async def bench_broadcast_lag(num_players: int, duration: float) -> dict:
+    """Broadcasts contínuos para uma sessão enquanto se mede o atraso do event loop"""
+    server = nms.NetMasterServer()
+    session = make_session(num_players)
+    server.sessions[session.id] = session
+    for player_id, player in session.players.items():
+        player.websocket = NullWebSocket()
+        outbound = nms.OutboundQueue(player.websocket, player_id)
+        outbound.start()
+        server.outbound_queues[player.websocket] = outbound
+
+    lags = []
+    running = True
+
+    async def lag_probe():
+        interval = 0.001
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - start - interval) * 1000)
+
+    probe = asyncio.create_task(lag_probe())
+    message = {'type': 'turn_changed', 'session_id': session.id, 'player_order': session.player_order}
+    broadcasts = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        await server.broadcast_to_session(session.id, message)
+        broadcasts += 1
+        if broadcasts % 10 == 0:
+            await asyncio.sleep(0)  # Deixar o writer das filas e a sonda correrem
+
+    running = False
+    await probe
+    for outbound in server.outbound_queues.values():
+        outbound.close()
+
+    lags.sort()
+    return {
+        'broadcasts_per_second': broadcasts / duration,
+        'lag_p50': statistics.median(lags) if lags else 0.0,
+        'lag_p99': lags[int(len(lags) * 0.99)] if lags else 0.0
+    }
+
+
+def run_logging(args):
+    """Atraso do event loop e débito de broadcasts com diferentes configurações de logging"""
+    modes = [
+        ("sync", "FileHandler síncrono + logs por destinatário (antes)"),
+        ("queue", "QueueHandler/QueueListener + rate limit (depois)"),
+        ("off", "logging desativado (referência)")
+    ]
+    print(f"Logging: broadcasts para sessão de {args.players} jogadores durante {args.duration:.1f}s por modo\n")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode, description in modes:
+            log_file = os.path.join(tmpdir, f"{mode}.log")
+            configure_logging_mode(mode, log_file)
+            result = asyncio.run(bench_broadcast_lag(args.players, args.duration))
+            nms.shutdown_logging()
+            logging.disable(logging.NOTSET)
+            size_kb = os.path.getsize(log_file) / 1024 if os.path.exists(log_file) else 0.0
+            print(f"  {description:<50} {result['broadcasts_per_second']:10.0f} broadcasts/s   "
+                  f"lag p50: {result['lag_p50']:6.2f} ms   p99: {result['lag_p99']:6.2f} ms   log: {size_kb:8.0f} KB")
+
+
+def deflated_size(payload) -> int:
+    """Tamanho após permessage-deflate com as definições do netmaster_codec"""
+    data = payload.encode() if isinstance(payload, str) else payload
+    compressor = zlib.compressobj(netmaster_codec.DEFLATE_COMPRESS_SETTINGS['level'], zlib.DEFLATED,
+                                  -netmaster_codec.DEFLATE_WINDOW_BITS,
+                                  netmaster_codec.DEFLATE_COMPRESS_SETTINGS['memLevel'])
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def run_codec(args):
+    """Bytes no fio e custo de codificação/descodificação de cada codec"""
+    quiet_server_logs()
+    session = make_session(4)
+    player = next(iter(session.players.values()))
+    messages = {
+        'session_joined': {'type': 'session_joined', 'session': session.to_dict(),
+                           'player_id': player.id, 'player_info': player.to_dict()},
+        'sessions_list_update': {'type': 'sessions_list_update',
+                                 'sessions': [make_session(2).to_dict() for _ in range(args.sessions)]},
+        'turn_changed': {'type': 'turn_changed', 'current_player_id': session.player_order[1],
+                         'current_player_name': 'Player2', 'current_player_color': 'blue',
+                         'player_order': session.player_order, 'current_turn_index': 1, 'session_id': session.id}
+    }
+
+    print(f"Codecs disponíveis: {', '.join(netmaster_codec.available_codecs())} ({args.repeat} repetições)")
+    for name, message in messages.items():
+        print(f"\n{name}:")
+        for codec in reversed(netmaster_codec.available_codecs()):
+            payload = netmaster_codec.encode(message, codec)
+            encode_us = timed(lambda: netmaster_codec.encode(message, codec), args.repeat)
+            decode_us = timed(lambda: netmaster_codec.decode(payload), args.repeat)
+            print(f"  {codec:<14} {len(payload):8} bytes   deflate: {deflated_size(payload):7} bytes   "
+                  f"codificar: {encode_us:8.1f} µs   descodificar: {decode_us:8.1f} µs")
+
+
+async def bench_end_turn(store, turns: int) -> float:
+    """Tempo médio (µs) de handle_end_turn numa sessão de 4 jogadores, com ou sem WAL"""
+    server = nms.NetMasterServer()
+    server.persistence = store
+    session = make_session(4)
+    session.state = nms.GameState.PLAYING
+    server.sessions[session.id] = session
+    for player_id, player in session.players.items():
+        player.websocket = NullWebSocket()
+        outbound = nms.OutboundQueue(player.websocket, player_id)
+        outbound.start()
+        server.outbound_queues[player.websocket] = outbound
+    server.persist_session(session.id)
+
+    start = time.perf_counter()
+    for turn in range(turns):
+        player_id = session.get_current_player_id()
+        await server.handle_end_turn(player_id, session.players[player_id].websocket,
+                                     {'session_id': session.id, 'player_id': player_id})
+        if turn % 10 == 0:
+            await asyncio.sleep(0)  # Deixar as filas de saída escoarem
+    elapsed = (time.perf_counter() - start) / turns * 1e6
+
+    for outbound in server.outbound_queues.values():
+        outbound.close()
+    return elapsed
+
+
+def run_persistence(args):
+    """Custo do WAL por end_turn e tempo de reconstrução das sessões no arranque"""
+    logging.disable(logging.INFO)  # Inclui os subsistemas com nível próprio (BROADCAST, WAL)
+    print(f"Persistência: {args.turns} end_turn numa sessão de 4 jogadores\n")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        baseline = asyncio.run(bench_end_turn(None, args.turns))
+        print(f"  {'sem persistência':<34} {baseline:8.1f} µs/end_turn")
+        for fsync in (True, False):
+            store = netmaster_persistence.SessionStore(os.path.join(tmpdir, f"fsync-{fsync}"), fsync=fsync)
+            store.load()
+            store.start()
+            per_turn = asyncio.run(bench_end_turn(store, args.turns))
+            drain_start = time.perf_counter()
+            store.close()
+            drain_ms = (time.perf_counter() - drain_start) * 1000
+            stats = store.stats
+            label = "WAL + fsync por group commit" if fsync else "WAL sem fsync"
+            print(f"  {label:<34} {per_turn:8.1f} µs/end_turn (+{per_turn - baseline:.1f} µs)   "
+                  f"{stats['commits']} commits, {stats['records'] / max(1, stats['commits']):.1f} registos/commit, "
+                  f"{stats['commit_seconds'] / max(1, stats['commits']) * 1e6:.0f} µs/commit, "
+                  f"escoamento final {drain_ms:.1f} ms")
+
+        # Reconstrução no arranque: snapshot + WAL com args.sessions sessões
+        directory = os.path.join(tmpdir, "restore")
+        store = netmaster_persistence.SessionStore(directory, snapshot_every=args.sessions)
+        store.load()
+        store.start()
+        for _ in range(args.sessions * 2):
+            session = make_session(4)
+            session.state = nms.GameState.PLAYING
+            store.append('upsert', session.id, session=session.to_record())
+            store.append('turn', session.id, index=1)
+        store.close()
+
+        server = nms.NetMasterServer()
+        start = time.perf_counter()
+        restored = netmaster_persistence.SessionStore(directory)
+        server.restore_sessions(restored.load())
+        print(f"\n  Reconstrução de {len(server.sessions)} sessões (snapshot + WAL): "
+              f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+@dataclass
+class LegacyPlayer:
+    """Réplica do Player antes dos slots (dict de atributos por instância)"""
+    id: str
+    name: str
+    color: nms.PlayerColor
+    websocket: Optional[object] = None
+    connected: bool = True
+    last_heartbeat: float = 0
+    position: int = 0
+    score: int = 1000
+    resume_token: Optional[str] = None
+
+
+@dataclass
+class LegacyGameSession:
+    """Réplica da GameSession antes da compactação (tabelas paralelas players_info/active_players)"""
+    id: str
+    host_player_id: str
+    players: Dict[str, LegacyPlayer]
+    state: nms.GameState
+    created_at: datetime
+    expires_at: datetime
+    waiting_expires_at: datetime
+    max_players: int = nms.MAX_PLAYERS_PER_SESSION
+    duration_minutes: int = nms.SESSION_DURATION_MINUTES
+    player_order: Optional[List[str]] = None
+    current_turn_index: int = 0
+    empty_since: Optional[float] = None
+    pending_cards: Optional[Dict[str, List[Dict]]] = None
+    timer_finished: bool = False
+    players_info: Optional[Dict[str, Dict]] = None
+    active_players: Optional[List[str]] = None
+    send_hook: Optional[object] = None
+
+    def __post_init__(self):
+        self.player_order = self.player_order or []
+        self.pending_cards = self.pending_cards or {}
+        self.players_info = self.players_info or {}
+        self.active_players = self.active_players or []
+        self.replay = LegacyReplayBuffer()
+
+
+class LegacyReplayBuffer:
+    """Réplica do buffer de retoma com deque(maxlen) (reserva blocos mesmo vazio)"""
+
+    def __init__(self, size: int = nms.REPLAY_BUFFER_SIZE):
+        self.entries = deque(maxlen=size)
+        self.seq = 0
+
+
+def build_legacy_session(server, index: int, now: datetime) -> LegacyGameSession:
+    """Sessão parada com um anfitrião, como era criada antes (bound method e tabelas por sessão)"""
+    player_id = str(uuid.uuid4())
+    player = LegacyPlayer(id=player_id, name=f"Host{index}", color=nms.PlayerColor.RED,
+                          last_heartbeat=time.time())
+    session = LegacyGameSession(
+        id=f"{index:08x}", host_player_id=player_id, players={player_id: player},
+        state=nms.GameState.WAITING, created_at=now, expires_at=now, waiting_expires_at=now,
+        send_hook=server.enqueue_message
+    )
+    session.player_order.append(player_id)
+    session.active_players.append(player_id)
+    session.players_info[player_id] = {'color': player.color.value, 'name': player.name,
+                                       'websocket': None, 'joined_at': time.time()}
+    session.store_actions_deck = []
+    session.store_events_deck = []
+    # players_info_sync do anfitrião guardado como frame completo (mensagem + JSON) no buffer de retoma
+    message = {'type': 'players_info_sync',
+               'players': {player_id: {'color': player.color.value, 'name': player.name, 'is_active': True}},
+               'total_players': 1, 'session_id': session.id, 'source': 'server'}
+    session.replay.seq += 1
+    session.replay.entries.append((session.replay.seq, nms.EncodedFrame.encode(dict(message, seq=1)), None))
+    return session
+
+
+def build_session(server, index: int, now: datetime) -> nms.GameSession:
+    """Sessão parada com um anfitrião, com a representação atual"""
+    player_id = str(uuid.uuid4())
+    player = nms.Player(id=player_id, name=f"Host{index}", color=nms.PlayerColor.RED,
+                        last_heartbeat=time.time())
+    session = nms.GameSession(
+        id=f"{index:08x}", host_player_id=player_id, players={},
+        state=nms.GameState.WAITING, created_at=now, expires_at=now, waiting_expires_at=now,
+        send_hook=server.session_send_hook
+    )
+    session.add_player(player)
+    return session
+
+
+def measure_sessions(build, server, count: int) -> float:
+    """Bytes alocados por sessão (tracemalloc) para count sessões paradas"""
+    now = datetime.now()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = {}
+    for index in range(count):
+        session = build(server, index, now)
+        sessions[session.id] = session
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return allocated / count
+
+
+def run_memory(args):
+    """Memória por sessão parada (um anfitrião) antes e depois da compactação"""
+    logging.disable(logging.INFO)
+    server = nms.NetMasterServer()
+    print(f"Memória: {args.sessions} sessões paradas com um anfitrião\n")
+    legacy = measure_sessions(build_legacy_session, server, args.sessions)
+    current = measure_sessions(build_session, server, args.sessions)
+    reduction = (1 - current / legacy) * 100 if legacy else 0.0
+    print(f"  {'bytes por sessão':<34} antes: {legacy:8.0f}   depois: {current:8.0f}   redução: {reduction:5.1f}%")
+    print(f"  {'total':<34} antes: {legacy * args.sessions / 2**20:6.1f} MiB   "
+          f"depois: {current * args.sessions / 2**20:6.1f} MiB")
+
+
+class HandoffPlayer:
+    """Jogador ligado a um servidor real: mede a pausa entre o fecho 1012 e o session_resumed no processo seguinte"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.websocket = None
+        self.session_id = None
+        self.player_id = None
+        self.resume_token = None
+        self.last_seq = 0
+        self.close_code = None
+        self.pause: Optional[float] = None
+        self.resumed: Optional[dict] = None
+
+    async def request(self, message: dict, expected: set) -> dict:
+        """Envia um pedido e espera pela resposta (as restantes mensagens só atualizam o seq)"""
+        await self.websocket.send(json.dumps(message))
+        while True:
+            data = json.loads(await self.websocket.recv())
+            self.last_seq = max(self.last_seq, data.get('seq', 0))
+            if data.get('type') in expected:
+                return data
+
+    async def join(self, message: dict, expected: str):
+        """Cria ou entra numa sessão e guarda o token de retoma"""
+        self.websocket = await websockets.connect(self.url)
+        data = await self.request(message, {expected})
+        self.session_id = data['session']['id']
+        self.player_id = data['player_id']
+        self.resume_token = data['resume_token']
+
+    async def watch(self, timeout: float):
+        """Lê até o servidor fechar a ligação, religa ao processo seguinte e retoma a sessão"""
+        try:
+            async for raw in self.websocket:
+                self.last_seq = max(self.last_seq, json.loads(raw).get('seq', 0))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        closed_at = time.perf_counter()
+        self.close_code = self.websocket.close_code
+
+        # Religar até o processo seguinte aceitar a ligação e responder à retoma
+        while time.perf_counter() - closed_at < timeout:
+            try:
+                self.websocket = await websockets.connect(self.url)
+                self.resumed = await self.request({'type': 'resume_session', 'session_id': self.session_id,
+                                                   'player_id': self.player_id, 'resume_token': self.resume_token,
+                                                   'last_seq': self.last_seq}, {'session_resumed', 'resume_failed'})
+            except (OSError, websockets.exceptions.WebSocketException):
+                await asyncio.sleep(0.02)
+                continue
+            self.pause = time.perf_counter() - closed_at
+            await self.websocket.close()
+            return
+
+
+async def bench_handoff(args, workdir: str, servers: list):
+    """SIGTERM a um servidor com sessões a decorrer, arranque do seguinte e retoma dos jogadores"""
+    url = f"ws://127.0.0.1:{nms.SERVER_PORT}"
+    await netmaster_loadgen.wait_for_port('127.0.0.1', nms.SERVER_PORT)
+
+    players = []
+    for _ in range(args.sessions):
+        host, guest = HandoffPlayer(url), HandoffPlayer(url)
+        await host.join({'type': 'create_session', 'player_name': 'Host', 'color': 'red'}, 'session_created')
+        await guest.join({'type': 'join_session', 'session_id': host.session_id, 'player_name': 'Guest',
+                          'color': 'blue'}, 'session_joined')
+        await host.request({'type': 'start_game', 'player_id': host.player_id}, {'game_started'})
+        players += [host, guest]
+    watchers = [asyncio.create_task(player.watch(args.timeout)) for player in players]
+
+    start = time.perf_counter()
+    servers[-1].send_signal(signal.SIGTERM)
+    await asyncio.to_thread(servers[-1].wait)
+    stopped = time.perf_counter()
+    servers.append(netmaster_loadgen.start_local_server(['--drain-timeout', '0'], workdir))
+    await asyncio.gather(*watchers)
+
+    pauses = sorted(player.pause * 1000 for player in players if player.pause is not None)
+    resumed = [player.resumed for player in players if player.resumed and player.resumed['type'] == 'session_resumed']
+    print(f"  {'SIGTERM -> fim do processo':<34} {(stopped - start) * 1000:8.1f} ms (prazo de drenagem {args.drain}s)")
+    print(f"  {'fecho da ligação':<34} {sorted({player.close_code for player in players})}")
+    print(f"  {'jogadores retomados':<34} {len(resumed)}/{len(players)} "
+          f"({sum(1 for data in resumed if data['full_state'])} com estado completo, "
+          f"{sum(data['replayed'] for data in resumed)} mensagens reenviadas)")
+    if pauses:
+        print(f"  {'pausa vista pelo cliente':<34} p50 {statistics.median(pauses):8.1f} ms   "
+              f"p95 {pauses[int(len(pauses) * 0.95) - 1]:8.1f} ms   máx {pauses[-1]:8.1f} ms")
+
+
+def run_handoff(args):
+    """Pausa vista pelos clientes durante um reinício com handoff das sessões"""
+    print(f"Handoff: {args.sessions} sessões de 2 jogadores, SIGTERM e arranque de um novo processo\n")
+    servers = []
+    with tempfile.TemporaryDirectory() as workdir:
+        servers.append(netmaster_loadgen.start_local_server(['--drain-timeout', str(args.drain)], workdir))
+        try:
+            asyncio.run(bench_handoff(args, workdir, servers))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+
+async def bench_spectator_fanout(num_spectators: int, message: dict, repeat: int) -> float:
+    """Tempo médio (µs) de broadcast_to_session numa sessão de 4 jogadores com num_spectators espectadores"""
+    server = nms.NetMasterServer()
+    session = make_session(4)
+    session.state = nms.GameState.PLAYING
+    server.sessions[session.id] = session
+    for player_id, player in session.players.items():
+        player.websocket = NullWebSocket()
+        server.outbound_queues[player.websocket] = nms.OutboundQueue(player.websocket, player_id, maxsize=repeat + 1)
+    for _ in range(num_spectators):
+        client_id, websocket = str(uuid.uuid4()), NullWebSocket()
+        server.outbound_queues[websocket] = nms.OutboundQueue(websocket, client_id, maxsize=repeat + 2)
+        await server.handle_watch_session(client_id, websocket, {'session_id': session.id})
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await server.broadcast_to_session(session.id, message)
+    elapsed = (time.perf_counter() - start) / repeat * 1e6
+
+    for outbound in server.outbound_queues.values():
+        outbound.close()
+    return elapsed
+
+
+def run_spectators(args):
+    """Custo dos espectadores de uma sessão: frame partilhado vs serialização por espectador"""
+    logging.disable(logging.INFO)
+    session = make_session(4)
+    turn_changed = {
+        'type': 'turn_changed',
+        'current_player_id': session.player_order[1],
+        'current_player_name': 'Player2',
+        'current_player_color': 'blue',
+        'player_order': session.player_order,
+        'current_turn_index': 1,
+        'session_id': session.id
+    }
+    print(f"Espectadores: turn_changed numa sessão de 4 jogadores ({args.repeat} repetições)\n")
+
+    encode = timed(lambda: nms.EncodedFrame.encode(turn_changed), args.repeat)
+    baseline = asyncio.run(bench_spectator_fanout(0, turn_changed, args.repeat))
+    watched = asyncio.run(bench_spectator_fanout(args.spectators, turn_changed, args.repeat))
+    legacy = baseline + timed(lambda: [json.dumps(turn_changed) for _ in range(args.spectators)], args.repeat)
+    print(f"  {'um encode do frame':<50} {encode:10.1f} µs")
+    print(f"  {'broadcast sem espectadores':<50} {baseline:10.1f} µs")
+    report(f"broadcast com {args.spectators} espectadores", legacy, watched)
+    print(f"  {'custo por espectador':<50} {(watched - baseline) / max(1, args.spectators):10.2f} µs")
+
+
+def run_matchmaking(args):
+    """Custo de um tick do matchmaking e sessões formadas a partir de uma fila com preferências variadas"""
+    colors = [color.value for color in nms.PlayerColor]
+    durations = [15, 30, 60]
+    print(f"Matchmaking: {args.queued} jogadores na fila (durações {durations}, metade com cor preferida)\n")
+    for waited, label in ((0.0, "fila recente"), (nms.MATCHMAKING_MAX_WAIT_SECONDS, "após a espera máxima")):
+        matchmaker = netmaster_matchmaking.Matchmaker(colors, nms.MATCHMAKING_MATCH_SIZE, nms.MATCHMAKING_MIN_PLAYERS,
+                                                      nms.MATCHMAKING_MAX_WAIT_SECONDS)
+        for index in range(args.queued):
+            preferred = (random.choice(colors),) if index % 2 else ()
+            matchmaker.add(netmaster_matchmaking.MatchTicket(str(index), f"P{index}", random.choice(durations),
+                                                             preferred, 0.0))
+        start = time.perf_counter()
+        groups = matchmaker.tick(waited)
+        elapsed = (time.perf_counter() - start) * 1000
+        matched = sum(len(group) for group in groups)
+        print(f"  {label:<22} tick: {elapsed:8.2f} ms   sessões: {len(groups):5}   jogadores agrupados: "
+              f"{matched:5} ({matched / args.queued:.0%})   na fila: {len(matchmaker)}")
+
+
+def run_event_loop(args):
+    """Débito e p99 do broadcast com o servidor em asyncio e em uvloop (mesma carga do netmaster_loadgen)"""
+    loops = [loop for loop in nms.EVENT_LOOPS if loop != 'uvloop' or nms.uvloop is not None]
+    if nms.uvloop is None:
+        print("uvloop não está instalado (pip install uvloop): só o asyncio é medido")
+    load_args = netmaster_loadgen.build_parser().parse_args([
+        '--url', f"ws://127.0.0.1:{nms.SERVER_PORT}", '--players', str(args.players), '--turns', str(args.turns),
+        '--think', str(args.think), '--ramp', '0'])
+    print(f"Event loop: {args.players} jogadores, {args.turns} turnos cada, reflexão {args.think}s\n")
+
+    results = {}
+    for loop in loops:
+        with tempfile.TemporaryDirectory() as workdir:
+            server = netmaster_loadgen.start_local_server(['--drain-timeout', '0', '--loop', loop], workdir)
+            try:
+                asyncio.run(netmaster_loadgen.wait_for_port('127.0.0.1', nms.SERVER_PORT))
+                random.seed(args.seed)  # Mesma divisão em sessões para todos os loops
+                results[loop] = asyncio.run(netmaster_loadgen.run_swarm(load_args))
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(f"  {'loop':<10} {'pedidos/s':>10} {'turn_changed p50':>17} {'p99':>9} {'p99 sessão':>11} {'falhadas':>9}")
+    for loop, summary in results.items():
+        turn = summary['turn_changed']
+        print(f"  {loop:<10} {summary['throughput']:>10.0f} {turn['each_p50']:>14.2f} ms {turn['each_p99']:>6.2f} ms "
+              f"{turn['all_p99']:>8.2f} ms {summary['failed_sessions']:>9}")
+    if len(results) == 2:
+        base, fast = results['asyncio'], results['uvloop']
+        print(f"\n  uvloop: débito x{fast['throughput'] / base['throughput']:.2f}, p99 do broadcast "
+              f"x{fast['turn_changed']['each_p99'] / max(base['turn_changed']['each_p99'], 1e-9):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do NetMaster Server")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    serialization = subparsers.add_parser('serialization', help="Custo de serialização dos broadcasts")
+    serialization.add_argument('--clients', type=int, default=1000, help="Clientes ligados no lobby")
+    serialization.add_argument('--sessions', type=int, default=50, help="Sessões disponíveis no lobby")
+    serialization.add_argument('--repeat', type=int, default=2000, help="Repetições por medição")
+    serialization.set_defaults(func=run_serialization)
+
+    logging_bench = subparsers.add_parser('logging', help="Atraso do event loop com o pipeline de logging")
+    logging_bench.add_argument('--duration', type=float, default=3.0, help="Duração de cada modo (segundos)")
+    logging_bench.add_argument('--players', type=int, default=4, help="Jogadores na sessão")
+    logging_bench.set_defaults(func=run_logging)
+
+    codec = subparsers.add_parser('codec', help="Tamanho e custo de cada codec do protocolo")
+    codec.add_argument('--sessions', type=int, default=50, help="Sessões no sessions_list_update")
+    codec.add_argument('--repeat', type=int, default=2000, help="Repetições por medição")
+    codec.set_defaults(func=run_codec)
+
+    persistence = subparsers.add_parser('persistence', help="Custo do WAL por end_turn e tempo de reconstrução")
+    persistence.add_argument('--turns', type=int, default=20000, help="end_turn por medição")
+    persistence.add_argument('--sessions', type=int, default=1000, help="Sessões para medir a reconstrução")
+    persistence.set_defaults(func=run_persistence)
+
+    memory = subparsers.add_parser('memory', help="Memória por sessão parada (representação compacta)")
+    memory.add_argument('--sessions', type=int, default=100000, help="Sessões criadas")
+    memory.set_defaults(func=run_memory)
+
+    handoff = subparsers.add_parser('handoff', help="Pausa vista pelos clientes num reinício com handoff")
+    handoff.add_argument('--sessions', type=int, default=50, help="Sessões a decorrer no momento do SIGTERM")
+    handoff.add_argument('--drain', type=float, default=1.0, help="Prazo de drenagem do servidor (segundos)")
+    handoff.add_argument('--timeout', type=float, default=30.0, help="Tempo máximo para cada jogador retomar (s)")
+    handoff.set_defaults(func=run_handoff)
+
+    spectators = subparsers.add_parser('spectators', help="Custo dos espectadores de uma sessão (watch_session)")
+    spectators.add_argument('--spectators', type=int, default=100, help="Espectadores na sessão")
+    spectators.add_argument('--repeat', type=int, default=2000, help="Repetições por medição")
+    spectators.set_defaults(func=run_spectators)
+
+    matchmaking = subparsers.add_parser('matchmaking', help="Custo de um tick do matchmaking (queue_for_match)")
+    matchmaking.add_argument('--queued', type=int, default=1000, help="Jogadores na fila")
+    matchmaking.set_defaults(func=run_matchmaking)
+
+    event_loop = subparsers.add_parser('eventloop', help="Servidor em asyncio vs uvloop com o gerador de carga")
+    event_loop.add_argument('--players', type=int, default=200, help="Jogadores simulados")
+    event_loop.add_argument('--turns', type=int, default=20, help="Turnos jogados por cada jogador")
+    event_loop.add_argument('--think', type=float, default=0.0, help="Tempo médio de reflexão antes de cada turno (s)")
+    event_loop.add_argument('--seed', type=int, default=1, help="Seed da divisão dos jogadores em sessões")
+    event_loop.set_defaults(func=run_event_loop)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
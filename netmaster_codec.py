@@ -0,0 +1,136 @@
+"""
+NetMaster - Codecs do protocolo WebSocket
+Partilhado pelo servidor (NetMaster_Server.py) e pelo cliente (PlayerDashboard.py).
+
+O servidor anuncia os codecs disponíveis na mensagem 'welcome' e o cliente
+escolhe um com 'select_codec'. Só a codificação é negociada: a descodificação
+reconhece o formato de cada frame, por isso mensagens em trânsito durante a
+troca de codec são sempre lidas corretamente.
+  - json: JSON normal (frames de texto começados por '{')
+  - json-compact: JSON sem espaços e com chaves curtas (frames de texto com prefixo '~');
+    menos bytes, mas mais CPU a descodificar - só para ligações com pouca largura de banda
+  - msgpack: MessagePack (frames binários; requer o pacote msgpack); menos bytes e
+    descodificação mais rápida do que JSON
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from websockets.extensions.permessage_deflate import (ClientPerMessageDeflateFactory,
+                                                          ServerPerMessageDeflateFactory)
+except ImportError:
+    ClientPerMessageDeflateFactory = ServerPerMessageDeflateFactory = None
+
+CODEC_JSON = "json"
+CODEC_COMPACT = "json-compact"
+CODEC_MSGPACK = "msgpack"
+COMPACT_PREFIX = "~"
+
+# permessage-deflate: mensagens pequenas e frequentes - janela e memória reduzidas,
+# compressão rápida (menos CPU no servidor e nos Raspberry Pi)
+DEFLATE_WINDOW_BITS = 11
+DEFLATE_COMPRESS_SETTINGS = {'memLevel': 4, 'level': 3}
+
+# Dicionário de chaves curtas - só se acrescentam chaves no fim (os índices são o formato)
+# 'type' fica por extenso para os logs e para a coalescência das filas de saída
+KEY_DICTIONARY = [
+    'session', 'sessions', 'session_id', 'player', 'players', 'player_id', 'player_name',
+    'player_info', 'players_info', 'player_color', 'player_order', 'id', 'name', 'color',
+    'connected', 'last_heartbeat', 'position', 'score', 'host_player_id', 'state',
+    'created_at', 'expires_at', 'waiting_expires_at', 'max_players', 'duration_minutes',
+    'current_players', 'is_full', 'available_colors', 'waiting_time_left',
+    'current_turn_index', 'current_player_id', 'current_player_name', 'current_player_color',
+    'next_player_id', 'next_player_name', 'message', 'timestamp', 'version', 'success',
+    'status', 'result', 'action_type', 'action_data', 'time_remaining', 'deadline',
+    'resync_interval', 'source', 'card_type', 'card_path', 'card_data', 'cards',
+    'target_player_color', 'is_active', 'new_score', 'old_score', 'client_id'
+]
+CODEC_DICTIONARY_VERSION = 1
+
+# Preferência do cliente: json-compact poupa bytes mas custa CPU nos Raspberry Pi
+CODEC_PREFERENCE = [CODEC_MSGPACK, CODEC_JSON]
+
+SHORT_KEYS = {key: f"_{index}" for index, key in enumerate(KEY_DICTIONARY)}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+
+def available_codecs() -> list:
+    """Codecs suportados neste processo, por ordem de preferência"""
+    codecs = [CODEC_MSGPACK] if msgpack is not None else []
+    return codecs + [CODEC_COMPACT, CODEC_JSON]
+
+
+def choose_codec(offered: list, dictionary_version: int = None, preference: list = None) -> str:
+    """Primeiro codec da preferência que o servidor oferece e este processo suporta"""
+    supported = available_codecs()
+    for codec in preference or CODEC_PREFERENCE:
+        if codec not in offered or codec not in supported:
+            continue
+        if codec == CODEC_COMPACT and dictionary_version != CODEC_DICTIONARY_VERSION:
+            continue  # Dicionário de chaves diferente do servidor
+        return codec
+    return CODEC_JSON
+
+
+def shorten_keys(value):
+    """Substitui as chaves conhecidas pelas versões curtas (recursivo)"""
+    if isinstance(value, dict):
+        return {SHORT_KEYS.get(key, key): shorten_keys(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shorten_keys(item) for item in value]
+    return value
+
+
+def expand_object(value: dict) -> dict:
+    """object_hook do json.loads: repõe as chaves por extenso de um objeto"""
+    return {LONG_KEYS.get(key, key): item for key, item in value.items()}
+
+
+def encode(message: dict, codec: str = CODEC_JSON):
+    """Codifica a mensagem: str para json/json-compact, bytes para msgpack"""
+    if codec == CODEC_COMPACT:
+        return COMPACT_PREFIX + json.dumps(shorten_keys(message), separators=(',', ':'))
+    if codec == CODEC_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message)
+
+
+def decode(raw) -> dict:
+    """Descodifica um frame em qualquer um dos formatos (levanta ValueError se inválido)"""
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        if msgpack is None:
+            raise ValueError("Frame binário recebido mas msgpack não está instalado")
+        try:
+            return msgpack.unpackb(raw, raw=False)
+        except Exception as e:
+            raise ValueError(f"Frame msgpack inválido: {e}")
+    if raw.startswith(COMPACT_PREFIX):
+        return json.loads(raw[1:], object_hook=expand_object)
+    return json.loads(raw)
+
+
+def server_deflate_extensions() -> list:
+    """Extensão permessage-deflate afinada para o servidor"""
+    if ServerPerMessageDeflateFactory is None:
+        return []
+    return [ServerPerMessageDeflateFactory(
+        server_max_window_bits=DEFLATE_WINDOW_BITS,
+        client_max_window_bits=DEFLATE_WINDOW_BITS,
+        compress_settings=DEFLATE_COMPRESS_SETTINGS
+    )]
+
+
+def client_deflate_extensions() -> list:
+    """Extensão permessage-deflate afinada para o cliente"""
+    if ClientPerMessageDeflateFactory is None:
+        return []
+    return [ClientPerMessageDeflateFactory(
+        server_max_window_bits=DEFLATE_WINDOW_BITS,
+        client_max_window_bits=DEFLATE_WINDOW_BITS,
+        compress_settings=DEFLATE_COMPRESS_SETTINGS
+    )]
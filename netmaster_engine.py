@@ -0,0 +1,213 @@
+"""
+NetMaster - Tabuleiro e baralhos de cada sessão (autoritativos no servidor)
+Usado pelo servidor (NetMaster_Server.py): cada sessão tem um SessionEngine.
+
+O catálogo de cartas é lido do disco uma vez por processo (load_catalog) e
+partilhado por todas as sessões. Cada sessão baralha os seus baralhos
+(cor, tipo) com a seed da sessão: um baralho só é criado no primeiro uso e a
+mesma seed dá sempre a mesma ordem. Tirar uma carta é um popleft de uma deque -
+O(1) e igual para todos os jogadores, sem os clientes lerem os diretórios das cartas.
+
+As operações sobre os baralhos ficam num registo ('d' tirar, 'r' devolver,
+'t' retirar uma carta escolhida na Store), sempre com a carta; reaplicar o
+registo com a mesma seed reconstrói os mesmos baralhos (persistência e handoff).
+A reaplicação tira as cartas pelo valor e ignora as que já não existem (catálogo
+alterado entre processos), em vez de falhar a sessão inteira.
+
+Caminhos das cartas: relativos ao diretório das cartas do cliente,
+<tipo>/Residential-level[/<Cor>]/<ficheiro> - o mesmo em todos os Pis.
+"""
+
+import os
+import random
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+CARDS_DIR = os.path.dirname(os.path.abspath(__file__))  # Contém <Tipo>/Residential-level[/<Cor>]
+CARD_LEVEL = "Residential-level"
+CARD_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+CARD_TYPES = ["users", "actions", "equipments", "challenges", "activities", "events", "services"]
+COLORS = ["green", "yellow", "red", "blue", "neutral"]
+NEUTRAL = "neutral"
+CARD_COLOR_DIRS = ["Blue", "Green", "Red", "Yellow"]  # Subdiretórios dos tipos com cor
+
+# Tabuleiro de 32 casas: (tipo, cor) - igual ao BOARD dos clientes
+BOARD = [
+    # Linha de cima (esquerda para a direita)
+    ("start", "neutral"), ("users", "blue"), ("actions", "neutral"), ("equipments", "blue"),
+    ("challenges", "neutral"), ("activities", "red"), ("events", "neutral"), ("services", "red"),
+    # Coluna da direita (cima para baixo)
+    ("start", "neutral"), ("users", "red"), ("actions", "neutral"), ("equipments", "red"),
+    ("challenges", "neutral"), ("activities", "yellow"), ("events", "neutral"), ("services", "yellow"),
+    # Linha de baixo (direita para a esquerda)
+    ("start", "neutral"), ("users", "yellow"), ("actions", "neutral"), ("equipments", "yellow"),
+    ("challenges", "neutral"), ("activities", "green"), ("events", "neutral"), ("services", "green"),
+    # Coluna da esquerda (baixo para cima)
+    ("start", "neutral"), ("users", "green"), ("actions", "neutral"), ("equipments", "green"),
+    ("challenges", "neutral"), ("activities", "blue"), ("events", "neutral"), ("services", "blue"),
+]
+NUM_SQUARES = len(BOARD)
+START_POSITIONS = {"blue": 0, "red": 8, "yellow": 16, "green": 24}
+
+_catalog: Optional[Dict[str, Tuple[str, ...]]] = None
+
+
+def deck_key(color: str, card_type: str) -> str:
+    """Chave de um baralho ('<cor>/<tipo>')"""
+    return f"{color}/{card_type}"
+
+
+def card_files(directory: str) -> List[str]:
+    """Ficheiros de cartas de um diretório, por ordem de nome (a ordem do SO varia entre discos)"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.lower().endswith(CARD_EXTENSIONS))
+
+
+def load_catalog(base_dir: str = CARDS_DIR) -> Dict[str, Tuple[str, ...]]:
+    """Lê os diretórios das cartas uma vez: chave do baralho -> caminhos relativos"""
+    global _catalog
+    catalog = {}
+    for card_type in CARD_TYPES:
+        # Pasta do tipo em minúsculas (Pis: img/cartas/<tipo>) ou capitalizada (repositório)
+        type_dir = next((os.path.join(base_dir, name, CARD_LEVEL) for name in (card_type, card_type.capitalize())
+                         if os.path.isdir(os.path.join(base_dir, name, CARD_LEVEL))), None)
+        if type_dir is None:
+            continue
+        by_color = {color_dir: [f"{card_type}/{CARD_LEVEL}/{color_dir}/{name}"
+                                for name in card_files(os.path.join(type_dir, color_dir))]
+                    for color_dir in CARD_COLOR_DIRS}
+        if any(by_color.values()):
+            # Tipo com cor: um baralho por cor e o neutral com as cartas de todas as cores
+            for color_dir, cards in by_color.items():
+                catalog[deck_key(color_dir.lower(), card_type)] = tuple(cards)
+            catalog[deck_key(NEUTRAL, card_type)] = tuple(card for cards in by_color.values() for card in cards)
+        else:
+            cards = tuple(f"{card_type}/{CARD_LEVEL}/{name}" for name in card_files(type_dir))
+            for color in COLORS:
+                catalog[deck_key(color, card_type)] = cards
+    _catalog = catalog
+    return catalog
+
+
+def get_catalog() -> Dict[str, Tuple[str, ...]]:
+    """Catálogo partilhado (lido no primeiro uso se o servidor não o carregou no arranque)"""
+    return _catalog if _catalog is not None else load_catalog()
+
+
+def relative_card_path(card_path: str) -> str:
+    """Caminho relativo ao diretório das cartas (clientes antigos enviam o caminho absoluto local)"""
+    parts = card_path.replace('\\', '/').split('/')
+    for index in range(len(parts) - 1):
+        if parts[index].lower() in CARD_TYPES and parts[index + 1] == CARD_LEVEL:
+            return '/'.join([parts[index].lower(), *parts[index + 1:]])
+    return card_path
+
+
+def card_color(card_path: str) -> str:
+    """Cor do baralho de origem de uma carta (neutral para os tipos sem cor)"""
+    parts = card_path.replace('\\', '/').split('/')
+    for part in parts[:-1]:
+        if part in CARD_COLOR_DIRS:
+            return part.lower()
+    return NEUTRAL
+
+
+def square(position: int) -> Tuple[str, str]:
+    """(tipo, cor) da casa"""
+    return BOARD[position % NUM_SQUARES]
+
+
+def advance(position: int, steps: int) -> int:
+    """Nova posição após 'steps' casas"""
+    return (position + steps) % NUM_SQUARES
+
+
+class SessionEngine:
+    """Baralhos (cor, tipo) de uma sessão, criados no primeiro uso a partir da seed"""
+
+    __slots__ = ('seed', 'catalog', 'decks', 'counts', 'log')
+
+    def __init__(self, seed: int, catalog: Optional[Dict[str, Tuple[str, ...]]] = None, log: Optional[list] = None):
+        self.seed = seed
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.decks: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}  # Cartas restantes dos baralhos já alterados
+        self.log: List[tuple] = []
+        for entry in log or ():
+            self.apply(entry)
+
+    def deck(self, key: str) -> deque:
+        """Baralho baralhado com a seed da sessão (cada baralho tem a sua própria sequência)"""
+        deck = self.decks.get(key)
+        if deck is None:
+            cards = list(self.catalog.get(key, ()))
+            random.Random(f"{self.seed}:{key}").shuffle(cards)
+            deck = self.decks[key] = deque(cards)
+        return deck
+
+    def apply(self, entry) -> Optional[str]:
+        """Aplica uma operação: ('d', chave[, carta]) | ('r', chave, carta) | ('t', chave, carta)
+
+        Sem carta, 'd' tira a do topo; com carta (reaplicação do registo) tira essa carta.
+        Devolve a carta, ou None se a operação não se aplica (baralho vazio ou carta inexistente).
+        """
+        op, key = entry[0], entry[1]
+        deck = self.deck(key)
+        if op == 'd' and len(entry) < 3:
+            if not deck:
+                return None
+            card = deck.popleft()
+        else:
+            card = entry[2]
+            if op == 'r':
+                deck.append(card)
+            elif card in deck:
+                deck.remove(card)  # A carta tirada está quase sempre no topo
+            else:
+                return None
+        self.counts[key] = len(deck)
+        self.log.append((op, key, card))
+        return card
+
+    def remaining(self, key: str) -> int:
+        """Cartas restantes num baralho (sem o criar)"""
+        count = self.counts.get(key)
+        return count if count is not None else len(self.catalog.get(key, ()))
+
+    def draw(self, color: str, card_type: str) -> Optional[Tuple[str, str]]:
+        """Tira a carta do topo (baralho neutral se o da cor estiver vazio): (chave do baralho, carta)"""
+        for source in (color, NEUTRAL) if color != NEUTRAL else (NEUTRAL,):
+            key = deck_key(source, card_type)
+            if self.remaining(key):
+                return key, self.apply(('d', key))
+        return None
+
+    def return_card(self, color: str, card_type: str, card_path: str) -> str:
+        """Devolve uma carta ao fundo do baralho"""
+        key = deck_key(color, card_type)
+        self.apply(('r', key, card_path))
+        return key
+
+    def take(self, color: str, card_type: str, card_path: str) -> Optional[str]:
+        """Retira uma carta escolhida na Store (None se já não estiver no baralho)"""
+        key = deck_key(color, card_type)
+        if card_path not in self.deck(key):
+            return None
+        self.apply(('t', key, card_path))
+        return key
+
+    def top(self, color: str, card_type: str, limit: int) -> List[str]:
+        """Primeiras cartas de um baralho (página de compra da Store)"""
+        deck = self.deck(deck_key(color, card_type))
+        return [deck[index] for index in range(min(limit, len(deck)))]
+
+    def inventory(self) -> Dict[str, Dict[str, int]]:
+        """Inventário da Store: tipo -> cor -> cartas restantes"""
+        return {card_type: {color: self.remaining(deck_key(color, card_type)) for color in COLORS}
+                for card_type in CARD_TYPES}
+
+    def to_record(self) -> list:
+        """Registo das operações (com a seed reconstrói os baralhos)"""
+        return [list(entry) for entry in self.log]
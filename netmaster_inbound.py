@@ -0,0 +1,128 @@
+"""
+NetMaster - Pipeline das mensagens recebidas pelo servidor
+Usado pelo servidor (NetMaster_Server.py) antes de chamar cada handler.
+
+Cada mensagem passa por:
+  1. tabela de dispatch (construída uma vez no arranque do servidor)
+  2. limite de débito por cliente e por tipo de mensagem (token bucket)
+  3. validação do payload com o schema do tipo (compilado uma vez)
+Só depois o handler corre - com os campos já com o tipo certo.
+
+Schemas: campo -> (tipos aceites, obrigatório). None nos tipos aceita null.
+Campos desconhecidos são ignorados (clientes antigos e novos enviam campos extra).
+"""
+
+import time
+from typing import Callable, Dict, Optional
+
+MAX_STRING_LENGTH = 256  # Strings maiores são rejeitadas (nomes, IDs, tokens, caminhos de cartas)
+
+REQUIRED = True
+OPTIONAL = False
+NUMBER = (int, float)
+
+MESSAGE_SCHEMAS = {
+    'create_session': {'player_name': (str, OPTIONAL), 'color': (str, OPTIONAL),
+                       'duration_minutes': (int, OPTIONAL)},
+    'join_session': {'session_id': (str, REQUIRED), 'player_name': (str, OPTIONAL),
+                     'color': ((str, None), OPTIONAL)},
+    'leave_session': {'player_id': (str, REQUIRED)},
+    'list_sessions': {},
+    'start_game': {'player_id': (str, REQUIRED)},
+    'game_action': {'player_id': (str, REQUIRED), 'action_type': (str, REQUIRED), 'action_data': (dict, OPTIONAL)},
+    'heartbeat': {'player_id': ((str, None), OPTIONAL), 'timestamp': (NUMBER, OPTIONAL)},
+    'get_session_info': {'session_id': (str, REQUIRED)},
+    'end_turn': {'session_id': (str, REQUIRED), 'player_id': (str, REQUIRED)},
+    'timer_sync': {'time_remaining': ((*NUMBER, None), OPTIONAL), 'timer_active': (bool, OPTIONAL)},
+    'store_card_for_player': {'sender_player_id': (str, OPTIONAL), 'sender_color': (str, OPTIONAL),
+                              'target_player_color': (str, REQUIRED), 'target_player_id': ((str, None), OPTIONAL),
+                              'card_data': (dict, REQUIRED)},
+    'get_pending_cards': {'player_id': (str, REQUIRED), 'player_color': (str, REQUIRED)},
+    'ack_pending_cards': {'player_id': (str, REQUIRED), 'delivery_ids': (list, REQUIRED)},
+    'update_player_score': {'player_id': (str, REQUIRED), 'score': (NUMBER, REQUIRED),
+                            'session_id': ((str, None), OPTIONAL)},
+    'subscribe_lobby': {'version': (int, OPTIONAL)},
+    'unsubscribe_lobby': {},
+    'lobby_resync': {'version': (int, OPTIONAL)},
+    'select_codec': {'codec': (str, REQUIRED)},
+    'watch_session': {'session_id': (str, REQUIRED)},
+    'unwatch_session': {},
+    'queue_for_match': {'player_name': (str, OPTIONAL), 'color': ((str, None), OPTIONAL),
+                        'duration_minutes': (int, OPTIONAL)},
+    'leave_match_queue': {},
+    'resume_session': {'session_id': (str, REQUIRED), 'player_id': (str, REQUIRED),
+                       'resume_token': (str, REQUIRED), 'last_seq': (int, OPTIONAL)},
+}
+
+
+def compile_schema(schema: dict) -> Callable[[dict], Optional[str]]:
+    """Converte um schema num validador: retorna None se o payload é válido, ou o motivo da rejeição"""
+    checks = []
+    for name, (types, required) in schema.items():
+        types = types if isinstance(types, tuple) else (types,)
+        nullable = None in types
+        accepted = tuple(kind for kind in types if kind is not None)
+        checks.append((name, accepted, required, nullable,
+                       bool in accepted, str in accepted, ' ou '.join(kind.__name__ for kind in accepted)))
+    checks = tuple(checks)
+
+    def validate(data: dict) -> Optional[str]:
+        for name, accepted, required, nullable, allows_bool, is_text, type_names in checks:
+            value = data.get(name)
+            if value is None:
+                if required and not (nullable and name in data):
+                    return f"campo '{name}' em falta"
+                continue
+            # bool é subclasse de int - só aceitar onde o schema o pede
+            if not isinstance(value, accepted) or (isinstance(value, bool) and not allows_bool):
+                return f"campo '{name}' deve ser {type_names}"
+            if is_text and isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
+                return f"campo '{name}' demasiado longo"
+        return None
+
+    return validate
+
+
+class TokenBucket:
+    """Token bucket: 'rate' mensagens por segundo com rajadas até 'burst'"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'notified')
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+        self.notified = False  # O cliente já foi avisado nesta sequência de mensagens limitadas
+
+    def allow(self, now: float) -> bool:
+        """Consome um token se houver (repõe os tokens pelo tempo decorrido)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.notified = False
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Segundos até haver um token disponível"""
+        return max(0.0, (1.0 - self.tokens) / self.rate)
+
+
+class ClientRateLimiter:
+    """Buckets de um cliente, um por tipo de mensagem (criados no primeiro uso)"""
+
+    __slots__ = ('limits', 'buckets')
+
+    def __init__(self, limits: Dict[str, tuple]):
+        self.limits = limits  # tipo -> (rate, burst); '*' para os restantes tipos
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, message_type: str, now: Optional[float] = None) -> TokenBucket:
+        """Bucket do tipo de mensagem"""
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            rate, burst = self.limits.get(message_type) or self.limits['*']
+            bucket = self.buckets[message_type] = TokenBucket(rate, burst, now if now is not None else time.monotonic())
+        return bucket
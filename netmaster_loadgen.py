@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+NetMaster Server - Gerador de carga
+Enxame de bots headless que fala o protocolo real do servidor (NetMaster_Server.py).
+
+Cada sessão tem 2 a 4 bots: o host cria a sessão, os restantes juntam-se, o host
+inicia o jogo e os jogadores vão jogando turnos (game_action, store_card_for_player,
+update_player_score, end_turn); quem recebe a vez pede as cartas pendentes. A
+liveness é o ping/pong do WebSocket anunciado no welcome (com --legacy-heartbeat,
+ou contra servidores antigos, quem está à espera envia heartbeats JSON). No fim é impresso o débito e as latências
+p50/p95/p99 por tipo de mensagem, e o tempo até todos receberem turn_changed.
+
+Uso:
+    python3 netmaster_loadgen.py [--players 1000] [--turns 10] [--think 0.5] [--start-server]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import websockets
+
+COLORS = ['red', 'blue', 'green', 'yellow']
+
+# Tipo de pedido -> tipos de resposta que o concluem
+RESPONSE_TYPES = {
+    'create_session': {'session_created'},
+    'join_session': {'session_joined'},
+    'start_game': {'game_started'},
+    'game_action': {'action_result'},
+    'end_turn': {'end_turn_ack'},
+    'store_card_for_player': {'card_stored_confirmation', 'card_returned_to_store'},
+    'get_pending_cards': {'pending_cards'},
+    'update_player_score': {'score_updated'},
+    'heartbeat': {'heartbeat_ack'}
+}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Percentil p (0-100) de uma lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadStats:
+    """Latências (ms) por tipo de mensagem e tempos até turn_changed"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.turn_changed_each: List[float] = []  # end_turn -> turn_changed em cada jogador
+        self.turn_changed_all: List[float] = []  # end_turn -> último jogador da sessão a receber
+        self.failed_sessions = 0
+        self.started_at = 0.0
+        self.finished_at = 0.0
+
+    def record(self, message_type: str, latency_ms: float):
+        self.latencies[message_type].append(latency_ms)
+
+    def summary(self) -> dict:
+        """Resumo agregado (usado pelo relatório e por outros benchmarks)"""
+        duration = max(self.finished_at - self.started_at, 1e-9)
+        per_type = {}
+        for message_type, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            per_type[message_type] = {
+                'count': len(values),
+                'rate': len(values) / duration,
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'errors': self.errors.get(message_type, 0)
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        each = sorted(self.turn_changed_each)
+        fanout = sorted(self.turn_changed_all)
+        return {
+            'duration': duration,
+            'requests': total,
+            'throughput': total / duration,
+            'per_type': per_type,
+            'turn_changed': {
+                'count': len(fanout),
+                'each_p50': percentile(each, 50), 'each_p95': percentile(each, 95), 'each_p99': percentile(each, 99),
+                'all_p50': percentile(fanout, 50), 'all_p95': percentile(fanout, 95), 'all_p99': percentile(fanout, 99)
+            },
+            'failed_sessions': self.failed_sessions
+        }
+
+
+class Bot:
+    """Jogador simulado: uma ligação WebSocket com um pedido pendente de cada vez"""
+
+    def __init__(self, url: str, name: str, color: str, stats: LoadStats, timeout: float, subscribe_lobby: bool = True,
+                 legacy_heartbeat: bool = False):
+        self.url = url
+        self.subscribe_lobby = subscribe_lobby
+        self.legacy_heartbeat = legacy_heartbeat
+        self.keepalive = False  # Servidor anunciou keepalive ping/pong no welcome
+        self.name = name
+        self.color = color
+        self.stats = stats
+        self.timeout = timeout
+        self.websocket = None
+        self.player_id: Optional[str] = None
+        self.session_id: Optional[str] = None
+        self.pending: Optional[tuple] = None  # (tipos de resposta, future)
+        self.events: asyncio.Queue = asyncio.Queue()  # game_started / turn_changed / fim de jogo
+        self.reader_task = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        self.reader_task = asyncio.create_task(self._reader())
+        if self.subscribe_lobby:
+            # Como o PlayerDashboard: deltas do lobby em vez da lista completa
+            await self.websocket.send(json.dumps({'type': 'subscribe_lobby', 'version': 0}))
+
+    async def close(self):
+        if self.websocket:
+            await self.websocket.close()
+        if self.reader_task:
+            self.reader_task.cancel()
+
+    async def _reader(self):
+        try:
+            async for raw in self.websocket:
+                received_at = time.perf_counter()
+                message = json.loads(raw)
+                message_type = message.get('type')
+
+                if message_type == 'welcome':
+                    self.keepalive = bool(message.get('server_info', {}).get('keepalive'))
+
+                if self.pending and (message_type in self.pending[0] or message_type == 'error'):
+                    future = self.pending[1]
+                    if not future.done():
+                        future.set_result(message)
+
+                if message_type in ('game_started', 'turn_changed', 'game_finished', 'session_expired'):
+                    self.events.put_nowait((message_type, message, received_at))
+
+                if message_type == 'pending_cards' and message.get('delivery_ids'):
+                    # Como o PlayerDashboard: confirmar as cartas recebidas (senão o servidor reentrega)
+                    await self.websocket.send(json.dumps({'type': 'ack_pending_cards', 'player_id': self.player_id,
+                                                          'delivery_ids': message['delivery_ids']}))
+        except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+            pass
+        finally:
+            self.events.put_nowait(('closed', {}, time.perf_counter()))
+
+    async def request(self, message: dict) -> dict:
+        """Envia um pedido e espera pela resposta, registando a latência"""
+        message_type = message['type']
+        future = asyncio.get_running_loop().create_future()
+        self.pending = (RESPONSE_TYPES[message_type], future)
+        start = time.perf_counter()
+        try:
+            await self.websocket.send(json.dumps(message))
+            response = await asyncio.wait_for(future, self.timeout)
+        except Exception:
+            self.stats.errors[message_type] += 1
+            raise
+        finally:
+            self.pending = None
+
+        if response.get('type') == 'error':
+            self.stats.errors[message_type] += 1
+            raise RuntimeError(f"{message_type}: {response.get('message')}")
+        self.stats.record(message_type, (time.perf_counter() - start) * 1000)
+        return response
+
+    async def wait_event(self, *event_types: str, timeout: float) -> tuple:
+        """Espera por um dos eventos indicados (ignora os restantes)"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            event = await asyncio.wait_for(self.events.get(), remaining)
+            if event[0] in event_types or event[0] == 'closed':
+                return event
+
+
+class SessionRun:
+    """Uma sessão simulada de 2 a 4 bots"""
+
+    def __init__(self, index: int, size: int, args, stats: LoadStats):
+        self.args = args
+        self.stats = stats
+        self.bots = [Bot(args.url, f"Bot{index}-{i + 1}", COLORS[i], stats, args.timeout, not args.legacy_lobby,
+                         args.legacy_heartbeat)
+                     for i in range(size)]
+        self.turn_sent_at = 0.0
+        self.turn_received: List[float] = []
+        self.finished = False
+
+    def finish(self):
+        """Termina a sessão e acorda os bots que estão à espera da vez"""
+        if not self.finished:
+            self.finished = True
+            for bot in self.bots:
+                bot.events.put_nowait(('closed', {}, time.perf_counter()))
+
+    async def think(self):
+        if self.args.think > 0:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.args.think)
+
+    async def setup(self):
+        host = self.bots[0]
+        for bot in self.bots:
+            await bot.connect()
+
+        created = await host.request({
+            'type': 'create_session',
+            'player_name': host.name,
+            'color': host.color,
+            'duration_minutes': self.args.duration_minutes
+        })
+        host.player_id = created['player_id']
+        host.session_id = created['session']['id']
+
+        for bot in self.bots[1:]:
+            joined = await bot.request({
+                'type': 'join_session',
+                'session_id': host.session_id,
+                'player_name': bot.name,
+                'color': bot.color
+            })
+            bot.player_id = joined['player_id']
+            bot.session_id = host.session_id
+
+        await host.request({'type': 'start_game', 'player_id': host.player_id})
+        for bot in self.bots[1:]:
+            await bot.wait_event('game_started', timeout=self.args.timeout)
+
+    async def play_turn(self, bot: Bot):
+        """Turno completo de um jogador"""
+        await self.think()
+        await bot.request({
+            'type': 'game_action',
+            'player_id': bot.player_id,
+            'action_type': 'move',
+            'action_data': {'position': random.randint(0, 31)}
+        })
+
+        target = random.choice([other for other in self.bots if other is not bot])
+        await bot.request({
+            'type': 'store_card_for_player',
+            'sender_player_id': bot.player_id,
+            'sender_color': bot.color,
+            'target_player_color': target.color,
+            'target_player_id': target.player_id,
+            'card_data': {'card_path': 'loadgen/card.png', 'card_type': 'actions', 'card_id': random.randint(1, 50)}
+        })
+        await bot.request({
+            'type': 'update_player_score',
+            'player_id': bot.player_id,
+            'session_id': bot.session_id,
+            'score': random.randint(0, 2000)
+        })
+
+        self.turn_received = []
+        self.turn_sent_at = time.perf_counter()
+        await bot.request({'type': 'end_turn', 'session_id': bot.session_id, 'player_id': bot.player_id})
+
+    async def run_bot(self, bot: Bot, turns: int):
+        """Ciclo de um bot: joga na sua vez, espera pela vez (heartbeats JSON só no modo legacy)"""
+        my_turns = 0
+        current = self.bots[0].player_id
+        while not self.finished:
+            if current == bot.player_id:
+                if my_turns >= turns:
+                    self.finish()
+                    break
+                await self.play_turn(bot)
+                my_turns += 1
+
+            try:
+                event_type, message, received_at = await bot.wait_event(
+                    'turn_changed', 'game_finished', 'session_expired', timeout=self.args.heartbeat)
+            except asyncio.TimeoutError:
+                if bot.legacy_heartbeat or not bot.keepalive:
+                    await bot.request({'type': 'heartbeat', 'player_id': bot.player_id, 'timestamp': time.time()})
+                continue
+
+            if event_type != 'turn_changed':
+                self.finish()
+                break
+
+            latency = (received_at - self.turn_sent_at) * 1000
+            self.stats.turn_changed_each.append(latency)
+            self.turn_received.append(latency)
+            if len(self.turn_received) == len(self.bots):
+                self.stats.turn_changed_all.append(max(self.turn_received))
+
+            current = message.get('current_player_id')
+            if current == bot.player_id:
+                await bot.request({'type': 'get_pending_cards', 'player_id': bot.player_id, 'player_color': bot.color})
+
+    async def run(self):
+        try:
+            await self.setup()
+            await asyncio.gather(*(self.run_bot(bot, self.args.turns) for bot in self.bots))
+        except Exception as e:
+            self.stats.failed_sessions += 1
+            if self.args.verbose:
+                print(f"Sessão {self.bots[0].name} falhou: {e!r}")
+        finally:
+            self.finished = True
+            await asyncio.gather(*(bot.close() for bot in self.bots), return_exceptions=True)
+
+
+def plan_sessions(players: int) -> List[int]:
+    """Divide os jogadores em sessões realistas de 2 a 4"""
+    sizes = []
+    remaining = players
+    while remaining >= 2:
+        size = min(random.choice([2, 3, 4]), remaining)
+        if remaining - size == 1:
+            size = remaining if remaining <= 4 else size - 1
+        sizes.append(size)
+        remaining -= size
+    return sizes
+
+
+async def run_swarm(args) -> dict:
+    """Corre o enxame completo e retorna o resumo"""
+    stats = LoadStats()
+    sizes = plan_sessions(args.players)
+    runs = [SessionRun(index, size, args, stats) for index, size in enumerate(sizes)]
+
+    stats.started_at = time.perf_counter()
+    tasks = []
+    for index, session_run in enumerate(runs):
+        tasks.append(asyncio.create_task(session_run.run()))
+        if args.ramp > 0 and index % args.ramp == args.ramp - 1:
+            await asyncio.sleep(1.0)  # Ramp-up: args.ramp sessões por segundo
+    await asyncio.gather(*tasks)
+    stats.finished_at = time.perf_counter()
+
+    summary = stats.summary()
+    summary['sessions'] = len(sizes)
+    summary['players'] = sum(sizes)
+    return summary
+
+
+def print_report(summary: dict):
+    """Imprime o relatório de débito e latências"""
+    print(f"\n{summary['players']} jogadores em {summary['sessions']} sessões "
+          f"({summary['failed_sessions']} falhadas) - {summary['duration']:.1f}s")
+    print(f"Débito total: {summary['throughput']:.0f} pedidos/s ({summary['requests']} pedidos)\n")
+    print(f"  {'mensagem':<24} {'n':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'erros':>7}")
+    for message_type, row in summary['per_type'].items():
+        print(f"  {message_type:<24} {row['count']:>8} {row['rate']:>9.1f} {row['p50']:>9.2f} "
+              f"{row['p95']:>9.2f} {row['p99']:>9.2f} {row['errors']:>7}")
+
+    turn = summary['turn_changed']
+    print(f"\nend_turn -> turn_changed ({turn['count']} turnos completos):")
+    print(f"  {'cada jogador':<24} p50 {turn['each_p50']:8.2f} ms   p95 {turn['each_p95']:8.2f} ms   p99 {turn['each_p99']:8.2f} ms")
+    print(f"  {'toda a sessão':<24} p50 {turn['all_p50']:8.2f} ms   p95 {turn['all_p95']:8.2f} ms   p99 {turn['all_p99']:8.2f} ms")
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 15.0):
+    """Espera até o servidor aceitar ligações"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"Servidor não respondeu em {host}:{port}")
+
+
+def start_local_server(server_args: List[str], workdir: str) -> subprocess.Popen:
+    """Arranca o NetMaster_Server num processo separado (logs no diretório temporário)"""
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'NetMaster_Server.py')
+    return subprocess.Popen([sys.executable, server_path, *server_args], cwd=workdir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Gerador de carga do NetMaster Server")
+    parser.add_argument('--url', default="ws://127.0.0.1:8000", help="Endereço do servidor")
+    parser.add_argument('--players', type=int, default=1000, help="Número total de jogadores simulados")
+    parser.add_argument('--turns', type=int, default=10, help="Turnos jogados por cada jogador")
+    parser.add_argument('--think', type=float, default=0.5, help="Tempo médio de reflexão antes de cada turno (s)")
+    parser.add_argument('--heartbeat', type=float, default=10.0, help="Intervalo de heartbeat enquanto espera pela vez (s)")
+    parser.add_argument('--ramp', type=int, default=100, help="Sessões iniciadas por segundo (0 = todas de uma vez)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Tempo máximo de espera por resposta (s)")
+    parser.add_argument('--duration-minutes', type=int, default=30, help="Duração das sessões criadas")
+    parser.add_argument('--legacy-lobby', action='store_true', help="Bots não subscrevem o lobby (recebem sessions_list_update completo)")
+    parser.add_argument('--legacy-heartbeat', action='store_true', help="Bots enviam heartbeat JSON enquanto esperam (clientes antigos)")
+    parser.add_argument('--start-server', action='store_true', help="Arrancar um NetMaster_Server local para o teste")
+    parser.add_argument('--verbose', action='store_true', help="Mostrar erros de cada sessão")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    server = None
+    workdir = tempfile.TemporaryDirectory()
+    try:
+        host_port = args.url.split('://', 1)[-1].split('/', 1)[0]
+        host, _, port = host_port.rpartition(':')
+        if args.start_server:
+            # Sem prazo de drenagem: no fim do teste o servidor termina logo, com as sessões por acabar
+            server = start_local_server(['--port', port, '--drain-timeout', '0'], workdir.name)
+        asyncio.run(wait_for_port(host, int(port)))
+
+        print(f"Gerador de carga: {args.players} jogadores contra {args.url}")
+        summary = asyncio.run(run_swarm(args))
+        print_report(summary)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
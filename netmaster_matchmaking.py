@@ -0,0 +1,131 @@
+"""
+NetMaster - Fila de matchmaking (queue_for_match)
+Usado pelo servidor (NetMaster_Server.py): os jogadores entram na fila com a
+duração e a cor preferidas e, em cada tick, o Matchmaker agrupa-os; o servidor
+cria as sessões de todos os grupos do tick de uma só vez.
+
+Os grupos formam-se por duração, pela ordem de chegada: um jogador entra no
+grupo se ainda existir uma atribuição de cores livres que respeite as
+preferências de todos. Um grupo completo (match_size) sai logo; um grupo
+incompleto só sai quando o jogador mais antigo já espera há max_wait segundos
+e tem pelo menos min_players. Jogadores que não cabem em nenhum grupo ficam
+na fila para o tick seguinte.
+"""
+
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class MatchTicket:
+    """Jogador na fila (colors vazio = qualquer cor)"""
+
+    __slots__ = ('client_id', 'player_name', 'duration_minutes', 'colors', 'queued_at')
+
+    def __init__(self, client_id: str, player_name: str, duration_minutes: int, colors: Sequence[str], queued_at: float):
+        self.client_id = client_id
+        self.player_name = player_name
+        self.duration_minutes = duration_minutes
+        self.colors = tuple(colors)
+        self.queued_at = queued_at
+
+
+def assign_colors(tickets: Sequence[MatchTicket], colors: Sequence[str]) -> Optional[List[str]]:
+    """Uma cor diferente para cada jogador, dentro das suas preferências (None se impossível)"""
+    assignment: List[str] = []
+
+    def place(index: int) -> bool:
+        if index == len(tickets):
+            return True
+        for color in tickets[index].colors or colors:
+            if color in colors and color not in assignment:
+                assignment.append(color)
+                if place(index + 1):
+                    return True
+                assignment.pop()
+        return False
+
+    return assignment if place(0) else None
+
+
+class Matchmaker:
+    """Fila de jogadores à espera de sessão, agrupados em cada tick"""
+
+    def __init__(self, colors: Sequence[str], match_size: int, min_players: int, max_wait: float):
+        self.colors = tuple(colors)
+        self.match_size = min(match_size, len(self.colors))
+        self.min_players = min_players
+        self.max_wait = max_wait
+        self.tickets: Dict[str, MatchTicket] = {}  # client_id -> ticket (ordem de chegada)
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, client_id: str) -> bool:
+        return client_id in self.tickets
+
+    def add(self, ticket: MatchTicket):
+        """Põe o jogador na fila (um pedido repetido substitui o anterior e volta ao fim)"""
+        self.tickets.pop(ticket.client_id, None)
+        self.tickets[ticket.client_id] = ticket
+
+    def remove(self, client_id: str) -> Optional[MatchTicket]:
+        return self.tickets.pop(client_id, None)
+
+    def form_group(self, candidates: Iterable[MatchTicket]) -> Tuple[List[MatchTicket], List[str]]:
+        """Grupo formado pela ordem de chegada a partir do primeiro candidato, com as cores atribuídas"""
+        group: List[MatchTicket] = []
+        colors: List[str] = []
+        rejected = set()  # Preferências que já não cabem (o grupo só cresce, continuam a não caber)
+        for ticket in candidates:
+            if ticket.colors in rejected:
+                continue
+            assignment = assign_colors(group + [ticket], self.colors)
+            if assignment is None:
+                rejected.add(ticket.colors)
+                continue
+            group.append(ticket)
+            colors = assignment
+            if len(group) == self.match_size:
+                break
+        return group, colors
+
+    def color_choices(self, candidates: Iterable[MatchTicket]) -> int:
+        """Cores distintas aceites pelos candidatos (limite superior do tamanho de um grupo)"""
+        choices = set()
+        for ticket in candidates:
+            if not ticket.colors:
+                return len(self.colors)
+            choices.update(ticket.colors)
+        return len(choices)
+
+    def tick(self, now: float) -> List[List[Tuple[MatchTicket, str]]]:
+        """Grupos prontos neste tick ([(ticket, cor)] por sessão); os tickets agrupados saem da fila"""
+        buckets: Dict[int, List[MatchTicket]] = {}
+        for ticket in self.tickets.values():
+            buckets.setdefault(ticket.duration_minutes, []).append(ticket)
+
+        groups = []
+        for bucket in buckets.values():
+            placed = set()  # client_ids já agrupados neste tick (ou num grupo ainda incompleto)
+            first = 0
+            waiting = False  # Último grupo ficou à espera: verificar as cores antes de tentar outro
+            while True:
+                while first < len(bucket) and bucket[first].client_id in placed:
+                    first += 1
+                if first == len(bucket):
+                    break
+                candidates = [ticket for ticket in islice(bucket, first, None) if ticket.client_id not in placed] \
+                    if waiting else islice(bucket, first, None)
+                # Só o grupo de um jogador que já esperou max_wait pode sair incompleto (ordem de chegada)
+                needed = self.min_players if now - bucket[first].queued_at >= self.max_wait else self.match_size
+                if len(bucket) - len(placed) < needed or (waiting and self.color_choices(candidates) < needed):
+                    break
+                group, colors = self.form_group(ticket for ticket in candidates if ticket.client_id not in placed)
+                placed.update(ticket.client_id for ticket in group)
+                waiting = len(group) < self.match_size and len(group) < needed
+                if waiting:
+                    continue  # Os restantes (cores incompatíveis com este grupo) tentam outro grupo
+                for ticket in group:
+                    del self.tickets[ticket.client_id]
+                groups.append(list(zip(group, colors)))
+        return groups
@@ -0,0 +1,218 @@
+"""
+NetMaster - Persistência das sessões (write-ahead log + snapshots)
+Usado pelo servidor (NetMaster_Server.py) para sobreviver a reinícios.
+
+Cada mutação de uma sessão é um registo JSON numa linha do WAL (append-only).
+O event loop só enfileira os registos; uma thread de escrita junta todos os
+registos pendentes num único write + fsync (group commit). A mesma thread
+mantém o estado materializado das sessões e, a cada SNAPSHOT_EVERY registos,
+grava um snapshot compactado (ficheiro temporário + os.replace) e trunca o WAL.
+
+No arranque: snapshot + registos do WAL com seq superior ao do snapshot.
+Uma linha incompleta no fim do WAL (queda a meio de uma escrita) é ignorada.
+
+Registos (campo 'op'):
+  - upsert: estado completo da sessão (criação, entradas/saídas, mudanças de estado)
+  - remove: sessão removida
+  - turn: current_turn_index
+  - player: campos alterados de um jogador (score, position)
+  - card_stored: envelope (delivery_id + carta) na caixa de correio de uma cor
+  - cards_acked: envelopes confirmados pelo cliente (removidos da caixa)
+  - cards_taken: caixa de correio de uma cor esvaziada (cartas devolvidas à Store)
+  - deck: operação sobre os baralhos da sessão (tirar, devolver, retirar na Store)
+  - store_card: carta devolvida à Store (registos antigos, antes do motor de baralhos)
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+WAL_FILE = "sessions.wal"
+SNAPSHOT_FILE = "sessions.snapshot"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_EVERY = 10000  # Registos no WAL antes de compactar num snapshot
+COMMIT_BATCH_LIMIT = 1000  # Máximo de registos por group commit
+FSYNC = True  # fsync por group commit (False: só flush para o SO)
+
+
+def apply_record(sessions: Dict[str, dict], record: dict):
+    """Aplica um registo do WAL ao estado materializado (session_id -> registo da sessão)"""
+    op = record['op']
+    session_id = record['session_id']
+    if op == 'upsert':
+        sessions[session_id] = record['session']
+        return
+    if op == 'remove':
+        sessions.pop(session_id, None)
+        return
+
+    session = sessions.get(session_id)
+    if session is None:
+        return
+    if op == 'turn':
+        session['current_turn_index'] = record['index']
+    elif op == 'player':
+        player = session['players'].get(record['player_id'])
+        if player is not None:
+            player.update(record['fields'])
+    elif op == 'card_stored':
+        envelope = record['card']
+        session['pending_cards'].setdefault(record['color'], []).append(envelope)
+        if 'delivery_id' in envelope:
+            session['mailbox_seq'] = max(session.get('mailbox_seq', 0), envelope['delivery_id'])
+    elif op == 'cards_acked':
+        acked = set(record['delivery_ids'])
+        session['pending_cards'][record['color']] = [envelope for envelope in session['pending_cards'].get(record['color'], [])
+                                                     if envelope.get('delivery_id') not in acked]
+    elif op == 'cards_taken':
+        session['pending_cards'][record['color']] = []
+    elif op == 'deck':
+        session.setdefault('deck_ops', []).append(record['entry'])
+    elif op == 'store_card':
+        session.setdefault('store_decks', {}).setdefault(record['deck'], []).append(record['card_path'])
+    else:
+        logger.warning(f"[PERSISTENCE] Registo desconhecido ignorado: {op}")
+
+
+class SessionStore:
+    """
+    WAL + snapshots das sessões num diretório local.
+
+    append() é seguro a partir do event loop (só enfileira); a escrita, o fsync
+    e a compactação acontecem na thread de escrita.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = SNAPSHOT_EVERY, fsync: bool = FSYNC):
+        self.directory = directory
+        self.wal_path = os.path.join(directory, WAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.pending: queue.SimpleQueue = queue.SimpleQueue()
+        self.sessions: Dict[str, dict] = {}  # Estado materializado (só a thread de escrita altera)
+        self.seq = 0
+        self.since_snapshot = 0
+        self.thread: Optional[threading.Thread] = None
+        self.wal = None
+        self.stats = {'records': 0, 'commits': 0, 'snapshots': 0, 'commit_seconds': 0.0}
+
+    def load(self) -> Dict[str, dict]:
+        """Reconstrói o estado a partir do snapshot e do WAL (chamar antes de start)"""
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.perf_counter()
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('format') != SNAPSHOT_FORMAT:
+                raise ValueError(f"Formato de snapshot não suportado: {snapshot.get('format')}")
+            self.sessions = snapshot['sessions']
+            snapshot_seq = self.seq = snapshot['seq']
+
+        replayed = 0
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path, encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"[PERSISTENCE] Linha {line_number} do WAL incompleta - ignorando o resto")
+                        break
+                    if record['seq'] <= snapshot_seq:
+                        continue  # Já incluído no snapshot (queda entre o snapshot e a truncagem)
+                    apply_record(self.sessions, record)
+                    self.seq = record['seq']
+                    replayed += 1
+
+        self.since_snapshot = replayed
+        logger.info(f"[PERSISTENCE] {len(self.sessions)} sessões recuperadas (snapshot seq {snapshot_seq}, "
+                    f"{replayed} registos do WAL) em {(time.perf_counter() - start) * 1000:.1f}ms")
+        return self.sessions
+
+    def start(self):
+        """Abre o WAL e inicia a thread de escrita"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.wal = open(self.wal_path, 'a', encoding='utf-8')
+        self.thread = threading.Thread(target=self._writer, name="netmaster-wal", daemon=True)
+        self.thread.start()
+
+    def append(self, op: str, session_id: str, **fields):
+        """Enfileira um registo de mutação (não bloqueia)"""
+        fields['op'] = op
+        fields['session_id'] = session_id
+        self.pending.put(fields)
+
+    def close(self):
+        """Escreve os registos pendentes, grava um snapshot final e para a thread"""
+        if self.thread is None:
+            return
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _writer(self):
+        """Thread de escrita: group commit dos registos pendentes"""
+        running = True
+        while running:
+            batch = [self.pending.get()]
+            while len(batch) < COMMIT_BATCH_LIMIT:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+            batch = [record for record in batch if record is not None]
+
+            try:
+                if batch:
+                    self._commit(batch)
+                if self.since_snapshot >= self.snapshot_every or (not running and self.since_snapshot):
+                    self._snapshot()
+            except Exception as e:
+                logger.error(f"[PERSISTENCE] Erro ao escrever o WAL: {e}")
+
+        self.wal.close()
+
+    def _commit(self, batch: list):
+        """Escreve um lote de registos com um único write + fsync"""
+        start = time.perf_counter()
+        lines = []
+        for record in batch:
+            self.seq += 1
+            record['seq'] = self.seq
+            lines.append(json.dumps(record, separators=(',', ':')))
+            apply_record(self.sessions, record)
+        self.wal.write('\n'.join(lines) + '\n')
+        self.wal.flush()
+        if self.fsync:
+            os.fsync(self.wal.fileno())
+        self.since_snapshot += len(batch)
+        self.stats['records'] += len(batch)
+        self.stats['commits'] += 1
+        self.stats['commit_seconds'] += time.perf_counter() - start
+
+    def _snapshot(self):
+        """Grava o estado materializado e trunca o WAL"""
+        start = time.perf_counter()
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': SNAPSHOT_FORMAT, 'seq': self.seq, 'created_at': time.time(),
+                       'sessions': self.sessions}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # O snapshot já contém tudo até self.seq - o WAL recomeça vazio
+        self.wal.close()
+        self.wal = open(self.wal_path, 'w', encoding='utf-8')
+        self.since_snapshot = 0
+        self.stats['snapshots'] += 1
+        logger.info(f"[PERSISTENCE] Snapshot de {len(self.sessions)} sessões (seq {self.seq}) "
+                    f"em {(time.perf_counter() - start) * 1000:.1f}ms")
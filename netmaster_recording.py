@@ -0,0 +1,157 @@
+"""
+NetMaster - Gravação binária das sessões (mensagens recebidas e broadcasts)
+Usado pelo servidor (NetMaster_Server.py, opção --record) e pela ferramenta
+de replay (netmaster_replay.py).
+
+Um ficheiro por sessão: cabeçalho (MAGIC + versão) seguido de registos
+    <tipo:u8> <flags:u8> <cliente:u16> <t:f64> <tamanho:u32> <payload>
+'t' são segundos monotónicos desde o início da gravação e 'cliente' é o
+índice da ligação no ficheiro (0 = servidor). O payload é o JSON já
+serializado (broadcasts - sem novo encode) ou msgpack/JSON das mensagens recebidas.
+
+Registos:
+  - SESSION: seed e duração da sessão (primeiro registo)
+  - INBOUND: mensagem de um cliente, antes do handler (resume_token omitido)
+  - BIND: jogador e sessão associados à ligação (após create/join/resume)
+  - BROADCAST: frame enviado a toda a sessão (com o seq do buffer de replay)
+  - CLOSE: ligação do cliente fechada
+  - OUTCOME: resultado de calculate_game_winner
+
+A escrita é bufferizada no event loop (um write por RECORDING_BUFFER_SIZE bytes).
+"""
+
+import json
+import os
+import struct
+import time
+from typing import Dict, Iterator, NamedTuple
+
+import netmaster_codec
+
+MAGIC = b"NMREC"
+FORMAT_VERSION = 1
+RECORDING_SUFFIX = ".nmrec"
+RECORDING_BUFFER_SIZE = 64 * 1024  # bytes bufferizados antes de cada write
+
+RECORD_HEADER = struct.Struct('<BBHdI')
+
+SESSION = 1
+INBOUND = 2
+BIND = 3
+BROADCAST = 4
+CLOSE = 5
+OUTCOME = 6
+KIND_NAMES = {SESSION: 'session', INBOUND: 'inbound', BIND: 'bind', BROADCAST: 'broadcast',
+              CLOSE: 'close', OUTCOME: 'outcome'}
+
+FLAG_BINARY = 1  # Payload msgpack (sem a flag: JSON em UTF-8)
+
+SERVER_CLIENT = 0
+REDACTED_FIELDS = ('resume_token',)  # Segredos que não ficam no disco (o replay usa os tokens novos)
+
+
+class Record(NamedTuple):
+    kind: int
+    client: int
+    t: float
+    payload: bytes
+    binary: bool
+
+    def decode(self) -> dict:
+        """Payload como dict"""
+        return netmaster_codec.decode(self.payload if self.binary else self.payload.decode('utf-8'))
+
+
+def inbound_codec() -> str:
+    """Codec das mensagens recebidas (msgpack se disponível - mais compacto)"""
+    return netmaster_codec.CODEC_MSGPACK if netmaster_codec.CODEC_MSGPACK in netmaster_codec.available_codecs() \
+        else netmaster_codec.CODEC_JSON
+
+
+class SessionRecording:
+    """Ficheiro de gravação de uma sessão (aberto em start, fechado em close)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.started = 0.0
+        self.clients: Dict[str, int] = {}  # client_id -> índice no ficheiro
+        self.codec = inbound_codec()
+        self.records = 0
+        self.outcomes = 0
+
+    def start(self, session_id: str, seed: int, duration_minutes: int, max_players: int):
+        """Cria o ficheiro e escreve o registo SESSION"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.file = open(self.path, 'wb', buffering=RECORDING_BUFFER_SIZE)
+        self.file.write(MAGIC + bytes([FORMAT_VERSION]))
+        self.started = time.monotonic()
+        self.write_json(SESSION, SERVER_CLIENT, {
+            'session_id': session_id, 'seed': seed, 'duration_minutes': duration_minutes,
+            'max_players': max_players, 'started_at': time.time()})
+
+    def client_index(self, client_id: str) -> int:
+        """Índice da ligação no ficheiro (atribuído no primeiro registo)"""
+        index = self.clients.get(client_id)
+        if index is None:
+            index = self.clients[client_id] = len(self.clients) + 1
+        return index
+
+    def write(self, kind: int, client: int, payload: bytes, binary: bool = False, at: float = None):
+        """Escreve um registo (at: instante monotónico do evento, por omissão agora)"""
+        if self.file is None:
+            return
+        t = (at if at is not None else time.monotonic()) - self.started
+        self.file.write(RECORD_HEADER.pack(kind, FLAG_BINARY if binary else 0, client, t, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+    def write_json(self, kind: int, client: int, value: dict):
+        self.write(kind, client, json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    def inbound(self, client_id: str, data: dict, at: float):
+        """Mensagem recebida de um cliente"""
+        if any(field in data for field in REDACTED_FIELDS):
+            data = {key: ('' if key in REDACTED_FIELDS else value) for key, value in data.items()}
+        payload = netmaster_codec.encode(data, self.codec)
+        binary = isinstance(payload, bytes)
+        self.write(INBOUND, self.client_index(client_id), payload if binary else payload.encode('utf-8'), binary, at)
+
+    def bind(self, client_id: str, player_id: str, session_id: str):
+        self.write_json(BIND, self.client_index(client_id), {'player_id': player_id, 'session_id': session_id})
+
+    def broadcast(self, data: str):
+        """Frame de broadcast já serializado (JSON)"""
+        self.write(BROADCAST, SERVER_CLIENT, data.encode('utf-8'))
+
+    def client_closed(self, client_id: str):
+        if client_id in self.clients:
+            self.write(CLOSE, self.clients[client_id], b'')
+
+    def outcome(self, game_result: dict):
+        self.write_json(OUTCOME, SERVER_CLIENT, game_result)
+        self.outcomes += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_recording(path: str) -> Iterator[Record]:
+    """Registos de um ficheiro de gravação (um registo incompleto no fim é ignorado)"""
+    with open(path, 'rb') as f:
+        header = f.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} não é uma gravação NetMaster")
+        if header[len(MAGIC)] != FORMAT_VERSION:
+            raise ValueError(f"Versão de gravação não suportada: {header[len(MAGIC)]}")
+        while True:
+            raw = f.read(RECORD_HEADER.size)
+            if len(raw) < RECORD_HEADER.size:
+                return
+            kind, flags, client, t, size = RECORD_HEADER.unpack(raw)
+            payload = f.read(size)
+            if len(payload) < size:
+                return  # Servidor terminou a meio de um write
+            yield Record(kind, client, t, payload, bool(flags & FLAG_BINARY))
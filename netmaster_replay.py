@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+NetMaster - Replay de sessões gravadas (NetMaster_Server.py --record)
+
+Cada gravação é reproduzida num NetMasterServer novo, no mesmo processo, com
+ligações falsas: as mensagens recebidas voltam a entrar por process_message pela
+ordem gravada, ao ritmo original (--speed 1), N vezes mais depressa (--speed N)
+ou sem esperas (--speed max). Os IDs de jogador e de sessão da gravação são
+trocados pelos do replay nos registos BIND, os resume_token pelos novos, e a seed
+dos baralhos é a gravada - as mesmas mensagens dão o mesmo jogo.
+
+O replay também é gravado e no fim compara-se com o original:
+  - resultados de calculate_game_winner (ranking, cores, saldos): diferenças falham (código 1)
+  - sequência de tipos dos broadcasts (sem os que dependem do relógio): só aviso
+
+Prazos (timer da sessão, heartbeats, períodos de graça) dependem do relógio: sem
+esperas o resultado é calculado no ponto em que o servidor original o calculou.
+
+Uso:
+    python3 netmaster_replay.py netmaster_recordings/*.nmrec [--speed max] [--output DIR]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import NetMaster_Server as nms
+import netmaster_recording
+
+CLOCK_BROADCAST_TYPES = {'timer_sync', 'game_finished', 'session_expired'}  # Dependem dos prazos, não das mensagens
+
+
+def parse_speed(value: str) -> Optional[float]:
+    """'max' (None: sem esperas) ou fator de velocidade > 0"""
+    if value == 'max':
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("a velocidade tem de ser > 0 ou 'max'")
+    return speed
+
+
+def translate(value, ids: Dict[str, str]):
+    """Troca os IDs da gravação pelos do replay (em qualquer campo da mensagem)"""
+    if isinstance(value, str):
+        return ids.get(value, value)
+    if isinstance(value, dict):
+        return {key: translate(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [translate(item, ids) for item in value]
+    return value
+
+
+def ranking_key(game_result: dict, ids: Dict[str, str]) -> list:
+    """Ranking comparável: posição, jogador, cor e saldo"""
+    return [(entry['position'], ids.get(entry['player_id'], entry['player_id']), entry['player_color'], entry['score'])
+            for entry in game_result.get('ranking', [])]
+
+
+def broadcast_types(records: List[netmaster_recording.Record]) -> List[str]:
+    """Tipos dos broadcasts de uma gravação (sem os que dependem do relógio)"""
+    types = (record.decode().get('type') for record in records if record.kind == netmaster_recording.BROADCAST)
+    return [message_type for message_type in types if message_type not in CLOCK_BROADCAST_TYPES]
+
+
+class ReplayConnection:
+    """Websocket falso de um cliente da gravação (conta os frames recebidos)"""
+
+    close_code = None
+
+    def __init__(self, index: int):
+        self.remote_address = ('replay', index)
+        self.frames = 0
+
+    async def send(self, data):
+        self.frames += 1
+
+    async def close(self, code=1000, reason=''):
+        self.close_code = code
+
+
+class SessionReplay:
+    """Reprodução de uma gravação num servidor novo"""
+
+    def __init__(self, path: str, speed: Optional[float], output_dir: str):
+        self.path = path
+        self.speed = speed
+        self.records = list(netmaster_recording.read_recording(path))
+        self.server = nms.NetMasterServer()
+        self.server.recording_enabled = True
+        self.server.recording_dir = output_dir
+        self.clients: Dict[int, tuple] = {}  # índice na gravação -> (client_id, ligação)
+        self.ids: Dict[str, str] = {}  # ID gravado -> ID do replay
+        self.tokens: Dict[str, str] = {}  # player_id do replay -> resume_token
+        self.original_outcomes: List[dict] = []
+        self.session_id: Optional[str] = None  # Sessão gravada
+        self.seed: Optional[int] = None
+        self.replay_path: Optional[str] = None
+        self.inbound = 0
+        self.elapsed = 0.0
+
+    def connect(self, index: int) -> tuple:
+        """Ligação do cliente 'index' (registada como em handle_client, sem limite de débito)"""
+        client = self.clients.get(index)
+        if client is None:
+            client_id, connection = str(uuid.uuid4()), ReplayConnection(index)
+            self.server.registry.add_client(client_id, connection)
+            outbound = nms.OutboundQueue(connection, client_id)
+            self.server.outbound_queues[connection] = outbound
+            outbound.start()
+            client = self.clients[index] = (client_id, connection)
+        return client
+
+    async def disconnect(self, index: int):
+        client = self.clients.pop(index, None)
+        if client is None:
+            return
+        client_id, connection = client
+        await self.server.cleanup_client(client_id)
+        outbound = self.server.outbound_queues.pop(connection, None)
+        if outbound:
+            outbound.close()
+
+    def bind(self, index: int, original: dict):
+        """Associa os IDs gravados aos do replay (e usa a seed gravada nos baralhos)"""
+        client_id, _ = self.connect(index)
+        player_id = self.server.registry.player_by_client.get(client_id)
+        session_id = self.server.player_to_session.get(player_id) if player_id else None
+        session = self.server.sessions.get(session_id) if session_id else None
+        if session is None:
+            return
+        self.ids[original['player_id']] = player_id
+        self.ids[original['session_id']] = session_id
+        self.tokens[player_id] = session.players[player_id].resume_token
+        if self.seed is not None and session.engine is None:
+            session.seed = self.seed
+        recording = self.server.recordings.get(session_id)
+        if recording is not None and self.replay_path is None:
+            self.replay_path = recording.path
+
+    def replayed_outcome(self):
+        """Resultado no ponto em que o original o calculou (se o prazo ainda não disparou no replay)"""
+        session = self.server.sessions.get(self.ids.get(self.session_id))
+        recording = self.server.recordings.get(session.id) if session else None
+        if recording is not None and recording.outcomes < len(self.original_outcomes):
+            self.server.calculate_game_winner(session)
+
+    async def run(self):
+        scheduler = asyncio.create_task(self.server.scheduler.run())
+        start = time.monotonic()
+        try:
+            for record in self.records:
+                if self.speed is not None:
+                    delay = record.t / self.speed - (time.monotonic() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                if record.kind == netmaster_recording.SESSION:
+                    session_info = record.decode()
+                    self.session_id, self.seed = session_info['session_id'], session_info['seed']
+                elif record.kind == netmaster_recording.INBOUND:
+                    client_id, connection = self.connect(record.client)
+                    data = translate(record.decode(), self.ids)
+                    if 'resume_token' in data:
+                        data['resume_token'] = self.tokens.get(data.get('player_id'), '')
+                    await self.server.process_message(client_id, connection, data)
+                    self.inbound += 1
+                elif record.kind == netmaster_recording.BIND:
+                    self.bind(record.client, record.decode())
+                elif record.kind == netmaster_recording.CLOSE:
+                    await self.disconnect(record.client)
+                elif record.kind == netmaster_recording.OUTCOME:
+                    self.original_outcomes.append(record.decode())
+                    self.replayed_outcome()
+            self.elapsed = time.monotonic() - start
+        finally:
+            # Fechar as gravações antes das ligações: as saídas do fim do replay não entram na comparação
+            self.server.close_recordings()
+            for index in list(self.clients):
+                await self.disconnect(index)
+            self.server.scheduler.stop()
+            scheduler.cancel()
+
+    def report(self) -> bool:
+        """Imprime a comparação com o original; retorna False se algum resultado difere"""
+        replayed = list(netmaster_recording.read_recording(self.replay_path)) if self.replay_path else []
+        replayed_outcomes = [record.decode() for record in replayed if record.kind == netmaster_recording.OUTCOME]
+        rate = self.inbound / self.elapsed if self.elapsed else 0.0
+        print(f"{self.path}: {self.inbound} mensagens em {self.elapsed:.2f}s ({rate:.0f} msg/s)")
+
+        matches = 0
+        for index, original in enumerate(self.original_outcomes):
+            if index >= len(replayed_outcomes):
+                print(f"  ✗ resultado {index + 1}: sem resultado no replay")
+                continue
+            expected, actual = ranking_key(original, self.ids), ranking_key(replayed_outcomes[index], {})
+            if expected == actual:
+                matches += 1
+            else:
+                print(f"  ✗ resultado {index + 1}: ranking diferente\n      original: {expected}\n      replay:   {actual}")
+        print(f"  resultados iguais: {matches}/{len(self.original_outcomes)}")
+
+        original_types, replayed_types = broadcast_types(self.records), broadcast_types(replayed)
+        if original_types == replayed_types:
+            print(f"  broadcasts iguais: {len(original_types)}")
+        else:
+            divergence = next((index for index, (a, b) in enumerate(zip(original_types, replayed_types)) if a != b),
+                              min(len(original_types), len(replayed_types)))
+            print(f"  ! broadcasts: {len(original_types)} no original, {len(replayed_types)} no replay "
+                  f"(primeira diferença no broadcast {divergence + 1})")
+        return matches == len(self.original_outcomes)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Replay de sessões gravadas do NetMaster Server")
+    parser.add_argument('recordings', nargs='+', help="Ficheiros .nmrec (NetMaster_Server.py --record)")
+    parser.add_argument('--speed', type=parse_speed, default=None,
+                        help="Fator de velocidade (1 = ritmo original) ou 'max' (por omissão)")
+    parser.add_argument('--output', help="Diretório para as gravações do replay (por omissão um temporário)")
+    parser.add_argument('--verbose', action='store_true', help="Manter os logs INFO do servidor")
+    return parser
+
+
+async def replay_all(args, output_dir: str) -> bool:
+    ok = True
+    for path in args.recordings:
+        replay = SessionReplay(path, args.speed, output_dir)
+        await replay.run()
+        ok = replay.report() and ok
+    return ok
+
+
+def main():
+    args = build_parser().parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)  # Inclui os subsistemas com nível próprio (BROADCAST, TIMER)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ok = asyncio.run(replay_all(args, args.output or tmpdir))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+NetMaster Server - Modo multi-processo (sharding)
+N processos worker, cada um dono das sessões cujo hash do ID lhe pertence.
+
+Todos os workers aceitam ligações na porta pública (SO_REUSEPORT) e cada um tem
+ainda uma porta dedicada. Um cliente que peça para entrar numa sessão de outro
+shard recebe um 'redirect' com essa porta. O coordenador (socket Unix neste
+processo) junta os deltas do lobby de todos os shards e distribui-os aos restantes.
+
+Uso:
+    python3 netmaster_shards.py [--workers 4] [--base-port 8001] [--socket /tmp/netmaster_coordinator.sock]
+        [--loop uvloop]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from typing import Dict
+
+import NetMaster_Server as nms
+from NetMaster_Server import ShardConfig, logger
+
+COORDINATOR_LINE_LIMIT = 16 * 1024 * 1024  # Tamanho máximo de uma linha do protocolo (lobby_state completo)
+COORDINATOR_RECONNECT_DELAY = 1.0  # segundos entre tentativas de ligação ao coordenador
+
+
+async def write_line(writer: asyncio.StreamWriter, message: dict):
+    """Envia uma mensagem do protocolo do coordenador (uma linha JSON)"""
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+class ShardCoordinator:
+    """
+    Coordenador do lobby entre shards.
+
+    Guarda as entradas do lobby de cada shard e reencaminha cada delta para os
+    outros workers. Quando um worker se liga recebe o estado atual dos restantes;
+    quando um worker cai as suas sessões são retiradas do lobby dos outros.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.writers: Dict[int, asyncio.StreamWriter] = {}  # shard -> ligação
+        self.entries: Dict[int, Dict[str, dict]] = {}  # shard -> session_id -> entrada do lobby
+
+    async def start(self):
+        """Abre o socket Unix do coordenador"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_worker, self.socket_path, limit=COORDINATOR_LINE_LIMIT)
+        logger.info(f"[SHARDS] Coordenador ativo em {self.socket_path}")
+        return server
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Lida com a ligação de um worker"""
+        shard = None
+        try:
+            hello = json.loads(await reader.readline())
+            shard = hello['shard']
+            self.writers[shard] = writer
+            self.entries.setdefault(shard, {})
+            logger.info(f"[SHARDS] Shard {shard} ligado ao coordenador")
+
+            # Estado atual do lobby dos outros shards
+            remote = [{'type': 'session_added', 'session': entry}
+                      for other, entries in self.entries.items() if other != shard
+                      for entry in entries.values()]
+            await write_line(writer, {'op': 'lobby_deltas', 'deltas': remote})
+
+            async for line in reader:
+                message = json.loads(line)
+                if message.get('op') == 'lobby_deltas':
+                    self.record_deltas(shard, message['deltas'])
+                    await self.relay(shard, message['deltas'])
+
+        except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+            logger.error(f"[SHARDS] Erro na ligação do shard {shard}: {e}")
+        finally:
+            if shard is not None and self.writers.get(shard) is writer:
+                del self.writers[shard]
+                # Sessões do shard que caiu deixam de estar disponíveis
+                removed = [{'type': 'session_removed', 'session_id': session_id}
+                           for session_id in self.entries.pop(shard, {})]
+                logger.warning(f"[SHARDS] Shard {shard} desligado - {len(removed)} sessões retiradas do lobby")
+                await self.relay(shard, removed)
+            writer.close()
+
+    def record_deltas(self, shard: int, deltas: list):
+        """Atualiza as entradas conhecidas do shard"""
+        entries = self.entries.setdefault(shard, {})
+        for delta in deltas:
+            if delta['type'] == 'session_removed':
+                entries.pop(delta['session_id'], None)
+            else:
+                entries[delta['session']['id']] = delta['session']
+
+    async def relay(self, origin: int, deltas: list):
+        """Reencaminha deltas para todos os shards exceto a origem"""
+        if not deltas:
+            return
+        for shard, writer in list(self.writers.items()):
+            if shard == origin:
+                continue
+            try:
+                await write_line(writer, {'op': 'lobby_deltas', 'deltas': deltas})
+            except ConnectionError as e:
+                logger.error(f"[SHARDS] Erro ao reencaminhar para o shard {shard}: {e}")
+
+
+class ShardLink:
+    """Ligação de um worker ao coordenador (publica deltas locais e aplica os remotos)"""
+
+    def __init__(self, server: nms.NetMasterServer, socket_path: str):
+        self.server = server
+        self.socket_path = socket_path
+        self.writer = None
+
+    def publish(self, deltas: list):
+        """Envia deltas locais ao coordenador (sem bloquear o event loop)"""
+        if not self.writer:
+            logger.warning(f"[SHARDS] Coordenador indisponível - {len(deltas)} delta(s) não publicados")
+            return
+        self.writer.write(json.dumps({'op': 'lobby_deltas', 'deltas': deltas}).encode() + b'\n')
+
+    async def run(self):
+        """Mantém a ligação ao coordenador, religando se cair"""
+        shard = self.server.shard.index
+        while self.server.running:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=COORDINATOR_LINE_LIMIT)
+                await write_line(writer, {'op': 'hello', 'shard': shard})
+                self.writer = writer
+
+                # Republicar as sessões locais (o coordenador pode ter reiniciado)
+                local = [{'type': 'session_added', 'session': entry}
+                         for session_id, entry in self.server.lobby.entries.items()
+                         if self.server.shard.owns(session_id)]
+                if local:
+                    self.publish(local)
+
+                async for line in reader:
+                    message = json.loads(line)
+                    if message.get('op') == 'lobby_deltas':
+                        await self.server.apply_remote_lobby_deltas(message['deltas'])
+
+            except (ConnectionError, FileNotFoundError) as e:
+                logger.warning(f"[SHARDS] Shard {shard} sem ligação ao coordenador: {e}")
+            except (ValueError, KeyError) as e:
+                # Linha acima do limite ou JSON inválido (JSONDecodeError é um ValueError): religar
+                logger.error(f"[SHARDS] Mensagem inválida do coordenador no shard {shard}: {e}")
+            finally:
+                if self.writer:
+                    self.writer.close()  # Ligação abandonada após erro (o coordenador vê o fim e limpa)
+                self.writer = None
+            await asyncio.sleep(COORDINATOR_RECONNECT_DELAY)
+
+
+async def run_worker(config: ShardConfig, socket_path: str):
+    """Executa um shard: servidor NetMaster com ligação ao coordenador"""
+    server = nms.NetMasterServer(shard=config)
+    server.running = True
+    server.shard_link = ShardLink(server, socket_path)
+    link_task = asyncio.create_task(server.shard_link.run())  # Referência forte: o loop só guarda fracas
+    try:
+        await server.start_server()
+    finally:
+        server.running = False
+        server.scheduler.stop()
+        link_task.cancel()
+
+
+def worker_main(index: int, count: int, base_port: int, socket_path: str, event_loop: str = nms.EVENT_LOOP):
+    """Ponto de entrada do processo worker"""
+    nms.install_event_loop(event_loop)
+    try:
+        asyncio.run(run_worker(ShardConfig(index=index, count=count, base_port=base_port), socket_path))
+    except KeyboardInterrupt:
+        pass
+
+
+async def supervise(workers: list, socket_path: str):
+    """Corre o coordenador enquanto os workers estiverem vivos (ou até SIGTERM)"""
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+
+    coordinator = ShardCoordinator(socket_path)
+    server = await coordinator.start()
+    async with server:
+        while not stop.is_set():
+            if not any(worker.is_alive() for worker in workers):
+                logger.error("[SHARDS] Todos os workers terminaram")
+                return
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+        logger.info("[SHARDS] SIGTERM recebido - terminando workers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetMaster Server em modo multi-processo")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Número de processos worker")
+    parser.add_argument('--base-port', type=int, default=nms.SHARD_BASE_PORT, help="Porta dedicada do shard 0")
+    parser.add_argument('--socket', default=nms.SHARD_COORDINATOR_SOCKET, help="Socket Unix do coordenador")
+    parser.add_argument('--loop', choices=nms.EVENT_LOOPS, default=nms.EVENT_LOOP,
+                        help="Event loop dos workers e do coordenador (uvloop só se estiver instalado)")
+    args = parser.parse_args()
+
+    print(f"NetMaster Server - {args.workers} shards")
+    print("=" * 50)
+
+    # spawn: cada worker importa o servidor do zero (sem herdar a thread de logging)
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=worker_main,
+                               args=(index, args.workers, args.base_port, args.socket, args.loop),
+                               name=f"netmaster-shard-{index}", daemon=True)
+               for index in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    nms.install_event_loop(args.loop)
+    try:
+        asyncio.run(supervise(workers, args.socket))
+    except KeyboardInterrupt:
+        logger.info("Servidor interrompido pelo usuário")
+    finally:
+        # SIGTERM nos workers: encerramento gracioso (sessões terminam ou passam ao handoff de cada shard)
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join(timeout=nms.DRAIN_TIMEOUT_SECONDS + 10)
+        logger.info("Servidor NetMaster (shards) finalizado")
+
+
+if __name__ == "__main__":
+    main()